@@ -0,0 +1,131 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+
+from coldfront_plugin_nese import utils
+from coldfront_plugin_nese.backends import get_backend
+from coldfront_plugin_nese.clients import endpoint_slot
+
+# Asyncio provisioning engine.
+#
+# The clients underneath (boto3, rgwadmin, minio) are blocking, so each
+# remote operation is handed to one thread pool shared by the whole
+# process. Every coroutine goes through the same pooled S3/RGW/MinIO
+# clients (see clients.py), so many allocations can be in flight at
+# once without a connection setup per call. Callers only see
+# coroutines and the run_provisioning driver.
+
+# Seconds between attempts to take a busy endpoint slot
+SLOT_POLL_INTERVAL = 0.05
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                settings.NESE_AIO_THREADS,
+                thread_name_prefix='nese-aio'
+            )
+        return _executor
+
+
+async def _run(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_executor(),
+        partial(utils.in_thread(func), *args, **kwargs)
+    )
+
+
+async def create_user(username, profile):
+    return await _run(get_backend(profile).create_user, username)
+
+
+async def create_bucket(bucket_name, profile):
+    await _run(get_backend(profile).create_bucket, bucket_name)
+
+
+async def apply_policy(bucket_name, user_name, profile):
+    await _run(get_backend(profile).apply_policy, bucket_name, user_name)
+
+
+async def apply_cors(bucket_name, profile):
+    await _run(get_backend(profile).apply_cors, bucket_name)
+
+
+async def set_bucket_quota(bucket_name, quota, profile, tags=None):
+    await _run(
+        get_backend(profile).set_bucket_quota,
+        bucket_name,
+        quota,
+        tags=tags
+    )
+
+
+async def set_bucket_tags(bucket_name, tags, profile):
+    await _run(utils.set_bucket_tags_minio, bucket_name, tags, profile)
+
+
+# User, bucket, policy, CORS and quota for one bucket. Policy and CORS
+# do not depend on each other so they go out together.
+async def provision_bucket(bucket_name, quota, profile):
+    uinfo = await create_user(f"{bucket_name}_datamanager", profile)
+    await create_bucket(bucket_name, profile)
+    await asyncio.gather(
+        apply_policy(bucket_name, uinfo['uid'], profile),
+        apply_cors(bucket_name, profile)
+    )
+    await set_bucket_quota(bucket_name, quota, profile)
+    return uinfo
+
+
+async def provision_many(items, profile, concurrency=None, on_done=None):
+    """Provision many buckets concurrently.
+
+    items is an iterable of (key, bucket_name, quota). Returns a dict
+    mapping each key to the user info of its bucket or to the exception
+    that stopped it. At most concurrency buckets are in flight at a
+    time, and each one holds the endpoint's slot (see
+    clients.endpoint_slot) shared with everything else in the process.
+    on_done(key) is called on the thread pool after each bucket, it may
+    use the database.
+    """
+    if concurrency is None:
+        concurrency = settings.NESE_PROVISION_WORKERS
+    slots = asyncio.Semaphore(concurrency)
+    endpoint = endpoint_slot(profile['endpoint'])
+
+    async def provision_one(key, bucket_name, quota):
+        async with slots:
+            # Polled, waiting on a pool thread could starve the holders
+            # of the threads they need to finish
+            while not endpoint.acquire(blocking=False):
+                await asyncio.sleep(SLOT_POLL_INTERVAL)
+            try:
+                result = await provision_bucket(bucket_name, quota, profile)
+            except Exception as e:
+                result = e
+            finally:
+                endpoint.release()
+        if on_done is not None:
+            await _run(on_done, key)
+        return key, result
+
+    results = await asyncio.gather(*[
+        provision_one(*item) for item in items
+    ])
+    return dict(results)
+
+
+def run_provisioning(items, profile, concurrency=None, on_done=None):
+    # Synchronous entry point for task code
+    return asyncio.run(
+        provision_many(items, profile, concurrency, on_done=on_done)
+    )
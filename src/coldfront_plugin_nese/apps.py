@@ -12,3 +12,6 @@ class NesePluginConfig(AppConfig):
 
     def ready(self):
         import coldfront_plugin_nese.signals
+        from coldfront_plugin_nese import ledger, registry
+        ledger.install_atomic_save()
+        registry.warm()
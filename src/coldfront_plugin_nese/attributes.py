@@ -1,3 +1,5 @@
+RESOURCE_DESCRIPTION = 'NESE S3 Allocation'
+
 RESOURCE_ENDPOINT = 'NESE S3 Bucket Endpoint'
 RESOURCE_QUOTA = 'NESE S3 Total Bucket Quota'
 RESOURCE_OWNER = 'NESE Storage Owner'
@@ -7,6 +9,7 @@ ALLOCATION_ACCESS_KEY = 'NESE S3 Bucket Access Key'
 ALLOCATION_SECRET_KEY = 'NESE S3 Bucket Secret Key'
 ALLOCATION_QUOTA = 'NESE S3 Bucket Quota'
 ALLOCATION_QUOTA_UPDATE = 'NESE S3 Bucket Quota Update'
+ALLOCATION_ENDPOINT = 'NESE S3 Endpoint'
 
 ALLOCATION_STATUS_PROVISIONING_ERROR = 'Provisioning Error'
 
@@ -22,7 +25,8 @@ RESOURCE_INT_ATTRIBUTES = [
 ALLOCATION_TEXT_ATTRIBUTES = [
     ALLOCATION_BUCKETNAME,
     ALLOCATION_ACCESS_KEY,
-    ALLOCATION_SECRET_KEY
+    ALLOCATION_SECRET_KEY,
+    ALLOCATION_ENDPOINT
 ]
 
 ALLOCATION_INT_ATTRIBUTES = [
@@ -0,0 +1,261 @@
+import copy
+import secrets
+import string
+import threading
+
+from django.conf import settings
+
+from coldfront_plugin_nese import utils
+from coldfront_plugin_nese.exceptions import NESEProvisioningError
+from coldfront_plugin_nese.quota import STATE_HASH_TAG, equal
+
+# Object store backends. One class per endpoint type, picked by
+# get_backend from profile['endpoint_type']. Bulk reads go through
+# get_bucket_snapshot, bulk writes through the asyncio engine in aio.py.
+
+
+class Backend:
+
+    def __init__(self, profile: dict):
+        self.profile = profile
+
+    def create_user(self, username: str) -> dict:
+        raise NotImplementedError()
+
+    def create_bucket(self, bucket_name: str):
+        raise NotImplementedError()
+
+    def apply_policy(self, bucket_name: str, user_name: str):
+        raise NotImplementedError()
+
+    def apply_cors(self, bucket_name: str):
+        raise NotImplementedError()
+
+    # Documents apply_policy and apply_cors put on the bucket, None if
+    # the backend has none
+    def policy_document(self, bucket_name: str, user_name: str):
+        return None
+
+    def cors_document(self, bucket_name: str):
+        return None
+
+    # tags is extra bucket metadata for backends that keep the quota
+    # in bucket tags, others ignore it
+    def set_bucket_quota(self, bucket_name: str, quota, tags: dict = None):
+        raise NotImplementedError()
+
+    def get_bucket_snapshot(self, bucket_names=None) -> dict:
+        raise NotImplementedError()
+
+    # Snapshot entry of a single bucket, None if it does not exist
+    def get_bucket_state(self, bucket_name: str):
+        return self.get_bucket_snapshot([bucket_name]).get(bucket_name)
+
+    # True if the bucket already has the desired quota. state_hash is
+    # the hash of the desired quota and tags (see quota.state_hash),
+    # used by backends that store it with the bucket.
+    def in_sync(self, state: dict, quota, state_hash: str) -> bool:
+        return equal(state['quota'], quota)
+
+    # Everything a new bucket needs once its user exists
+    def provision_bucket(self, bucket_name: str, uid: str, quota):
+        self.create_bucket(bucket_name)
+        self.apply_policy(bucket_name, uid)
+        self.apply_cors(bucket_name)
+        self.set_bucket_quota(bucket_name, quota)
+
+    @staticmethod
+    def _limit(snapshot, bucket_names):
+        if bucket_names is None:
+            return snapshot
+        wanted = set(bucket_names)
+        return {k: v for k, v in snapshot.items() if k in wanted}
+
+
+class RGWBackend(Backend):
+
+    def create_user(self, username):
+        return utils.create_user_rgw(username, self.profile)
+
+    def create_bucket(self, bucket_name):
+        utils.create_bucket(bucket_name, self.profile)
+
+    def apply_policy(self, bucket_name, user_name):
+        utils.apply_policy_rgw(bucket_name, user_name, self.profile)
+
+    def apply_cors(self, bucket_name):
+        utils.apply_cors(bucket_name, self.profile)
+
+    def policy_document(self, bucket_name, user_name):
+        return utils.bucket_policy_rgw(bucket_name, user_name)
+
+    def cors_document(self, bucket_name):
+        return utils.bucket_cors_configuration()
+
+    def set_bucket_quota(self, bucket_name, quota, tags=None):
+        utils.set_bucket_quota_rgw(bucket_name, quota, self.profile)
+
+    def get_bucket_snapshot(self, bucket_names=None):
+        return self._limit(
+            utils.get_bucket_snapshot_rgw(self.profile, bucket_names),
+            bucket_names
+        )
+
+
+class MinioBackend(Backend):
+
+    def create_user(self, username):
+        return utils.create_user_minio(username, self.profile)
+
+    def create_bucket(self, bucket_name):
+        utils.create_bucket(bucket_name, self.profile)
+
+    def apply_policy(self, bucket_name, user_name):
+        utils.apply_policy_minio(bucket_name, user_name, self.profile)
+
+    # Minio does not support CORS policy. CORS is on
+    # by default for all buckets and HTTP verbs
+    def apply_cors(self, bucket_name):
+        pass
+
+    def policy_document(self, bucket_name, user_name):
+        return utils.bucket_policy_minio(bucket_name, user_name)
+
+    # Quota is kept in the bucket tags, enforced outside of minio
+    def set_bucket_quota(self, bucket_name, quota, tags=None):
+        bucket_tags = dict(tags or {})
+        bucket_tags['quota'] = quota
+        utils.set_bucket_tags_minio(bucket_name, bucket_tags, self.profile)
+
+    # Tags only, skips the endpoint wide usage call of a snapshot. A
+    # bucket that cannot be read is treated as missing so the caller
+    # writes it.
+    def get_bucket_state(self, bucket_name):
+        try:
+            tags = utils.get_bucket_tags_minio(bucket_name, self.profile)
+        except NESEProvisioningError:
+            return None
+        return {'quota': tags.get('quota'), 'tags': tags, 'usage_kb': None}
+
+    # The tags are part of the desired state here, so compare the hash
+    # written with them too. Buckets tagged before hashes existed get
+    # rewritten once. The quota tag is checked on its own, it can be
+    # edited without touching the hash.
+    def in_sync(self, state, quota, state_hash):
+        return (
+            equal(state['quota'], quota) and
+            state['tags'].get(STATE_HASH_TAG) == state_hash
+        )
+
+    def get_bucket_snapshot(self, bucket_names=None):
+        return self._limit(
+            utils.get_bucket_snapshot_minio(self.profile, bucket_names),
+            bucket_names
+        )
+
+
+# Buckets, users and quotas kept in process memory, one store per
+# endpoint name. Reference implementation of the interface, and a
+# stand in for a real endpoint in tests and benchmarks
+# (NESE_ENDPOINT_TYPE=memory). Refused unless NESE_ALLOW_MEMORY_BACKEND
+# is set, a typo'd production config must not provision into memory.
+_memory_stores = {}
+_memory_lock = threading.Lock()
+
+
+class MemoryBackend(Backend):
+
+    def __init__(self, profile):
+        super().__init__(profile)
+        with _memory_lock:
+            self._store = _memory_stores.setdefault(
+                profile['endpoint'],
+                {'users': {}, 'buckets': {}}
+            )
+
+    @classmethod
+    def reset(cls):
+        with _memory_lock:
+            _memory_stores.clear()
+
+    def create_user(self, username):
+        with _memory_lock:
+            user = self._store['users'].get(username)
+            if user is None:
+                alphabet = string.ascii_letters + string.digits
+                user = {
+                    'uid': username,
+                    'access_key': username,
+                    'secret_key': ''.join(
+                        secrets.choice(alphabet) for i in range(30)
+                    )
+                }
+                self._store['users'][username] = user
+            return dict(user)
+
+    def create_bucket(self, bucket_name):
+        with _memory_lock:
+            self._store['buckets'].setdefault(bucket_name, {
+                'quota': None,
+                'tags': {},
+                'usage_kb': 0,
+                'policy': None,
+                'cors': False
+            })
+
+    def apply_policy(self, bucket_name, user_name):
+        with _memory_lock:
+            self._bucket(bucket_name)['policy'] = user_name
+
+    def apply_cors(self, bucket_name):
+        with _memory_lock:
+            self._bucket(bucket_name)['cors'] = True
+
+    def set_bucket_quota(self, bucket_name, quota, tags=None):
+        with _memory_lock:
+            bucket = self._bucket(bucket_name)
+            bucket['quota'] = quota
+            bucket['tags'].update(tags or {})
+
+    def get_bucket_snapshot(self, bucket_names=None):
+        with _memory_lock:
+            snapshot = {
+                name: {
+                    'quota': b['quota'],
+                    'tags': copy.deepcopy(b['tags']),
+                    'usage_kb': b['usage_kb']
+                }
+                for name, b in self._store['buckets'].items()
+            }
+        return self._limit(snapshot, bucket_names)
+
+    def _bucket(self, bucket_name):
+        bucket = self._store['buckets'].get(bucket_name)
+        if bucket is None:
+            raise NESEProvisioningError(f"No such bucket: {bucket_name}")
+        return bucket
+
+
+BACKENDS = {
+    'rgw': RGWBackend,
+    'minio': MinioBackend,
+    'memory': MemoryBackend
+}
+
+# Endpoint types a production profile may use
+PRODUCTION_BACKENDS = ('rgw', 'minio')
+
+
+def allowed_types() -> list:
+    if settings.NESE_ALLOW_MEMORY_BACKEND:
+        return list(BACKENDS)
+    return list(PRODUCTION_BACKENDS)
+
+
+def get_backend(profile: dict) -> Backend:
+    endpoint_type = profile['endpoint_type']
+    if endpoint_type not in allowed_types():
+        raise NESEProvisioningError(
+            f"Endpoint type not allowed: {endpoint_type}"
+        )
+    return BACKENDS[endpoint_type](profile)
@@ -0,0 +1,187 @@
+import datetime
+import hashlib
+import json
+
+from django.conf import settings
+from django.utils import timezone
+
+from coldfront_plugin_nese.models import BucketState
+from coldfront_plugin_nese.quota import (STATE_HASH_TAG, convert,
+                                         state_hash, to_bytes)
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Local cache of object store state in the BucketState table.
+#
+# Provisioning tasks write through to it after every successful remote
+# write (and record the error when one fails), full sweeps refresh it
+# from the endpoint snapshot. Readers use get_snapshot, which answers
+# from fresh rows and only asks the endpoint about the rest.
+
+CHUNK_SIZE = 1000
+
+UPDATE_FIELDS = (
+    'owner_uid',
+    'quota',
+    'state_hash',
+    'policy_hash',
+    'cors_hash',
+    'last_verified',
+    'last_error'
+)
+
+
+def document_hash(document) -> str:
+    if document is None:
+        return ''
+    encoded = json.dumps(document, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def _stale_before():
+    return timezone.now() - datetime.timedelta(
+        seconds=settings.NESE_BUCKET_STATE_TTL
+    )
+
+
+def record(bucket_name, profile, **fields):
+    """Write through the state just applied to bucket_name.
+
+    fields are BucketState fields, quota in TB as everywhere else.
+    """
+    record_many(profile, {bucket_name: fields})
+
+
+def record_many(profile, buckets: dict):
+    """Write through the state of many buckets, {bucket: fields}."""
+    now = timezone.now()
+    rows = {}
+    for name, fields in buckets.items():
+        fields = dict(fields)
+        if 'quota' in fields:
+            try:
+                fields['quota'] = to_bytes(fields['quota'])
+            except ValueError:
+                # Garbage in a bucket tag, nothing usable to cache
+                fields['quota'] = None
+        fields.update(last_verified=now, last_error='')
+        rows[name] = fields
+
+    _upsert(profile, rows)
+
+
+def record_errors(profile, errors: dict):
+    """Remember failed remote writes, {bucket: error}.
+
+    Entries with an error count as stale.
+    """
+    _upsert(profile, {
+        name: {'last_error': str(error)}
+        for name, error in errors.items()
+    })
+
+
+def refresh(profile, snapshot: dict):
+    """Refresh the cached quota of every bucket in a snapshot.
+
+    The state hash is only known when the bucket carries it in its
+    tags and it matches the bucket's actual quota and tags, otherwise
+    it is cleared so the next quota task checks the endpoint instead of
+    trusting the cache.
+    """
+    record_many(profile, {
+        name: {
+            'quota': state['quota'],
+            'state_hash': _tagged_hash(state)
+        }
+        for name, state in snapshot.items()
+    })
+
+
+# Hash tag of a bucket if it still describes the bucket. The quota tag
+# is the quota itself, not one of the hashed tags.
+def _tagged_hash(state) -> str:
+    tagged = state['tags'].get(STATE_HASH_TAG, '')
+    if not tagged:
+        return ''
+    tags = {k: v for k, v in state['tags'].items() if k != 'quota'}
+    try:
+        actual = state_hash(state['quota'], tags)
+    except ValueError:
+        return ''
+    return tagged if actual == tagged else ''
+
+
+def fresh(profile, bucket_names=None) -> dict:
+    """Fresh cached entries of the profile's endpoint by bucket name."""
+    rows = BucketState.objects.filter(
+        endpoint=profile['endpoint'],
+        last_verified__gte=_stale_before(),
+        last_error=''
+    )
+    if bucket_names is not None:
+        rows = rows.filter(bucket_name__in=bucket_names)
+    return {row.bucket_name: row for row in rows.iterator()}
+
+
+def get_snapshot(backend, bucket_names) -> dict:
+    """Bucket snapshot for bucket_names, remote only for stale entries.
+
+    Same shape as Backend.get_bucket_snapshot. Entries served from the
+    cache carry no tags or usage.
+    """
+    cached = fresh(backend.profile, bucket_names)
+    snapshot = {
+        name: {
+            'quota': convert(row.quota, 'b', 'tb'),
+            'tags': {},
+            'usage_kb': None
+        }
+        for name, row in cached.items()
+    }
+
+    stale = [name for name in bucket_names if name not in cached]
+    if stale:
+        remote = backend.get_bucket_snapshot(stale)
+        refresh(backend.profile, remote)
+        snapshot.update(remote)
+
+    logger.debug(
+        f"Bucket snapshot: {len(cached)} cached, {len(stale)} remote"
+    )
+    return snapshot
+
+
+# Bucket names are only unique per endpoint
+def _upsert(profile, rows: dict):
+    endpoint = profile['endpoint']
+    names = list(rows)
+    for i in range(0, len(names), CHUNK_SIZE):
+        chunk = names[i:i + CHUNK_SIZE]
+        existing = {
+            obj.bucket_name: obj
+            for obj in BucketState.objects.filter(
+                endpoint=endpoint,
+                bucket_name__in=chunk
+            )
+        }
+
+        updated = set()
+        for name, obj in existing.items():
+            for field, value in rows[name].items():
+                setattr(obj, field, value)
+            updated.update(rows[name])
+        if existing:
+            BucketState.objects.bulk_update(
+                existing.values(),
+                [f for f in UPDATE_FIELDS if f in updated]
+            )
+
+        # Another worker may have created the row in the meantime, its
+        # write is just as current
+        BucketState.objects.bulk_create([
+            BucketState(endpoint=endpoint, bucket_name=name, **rows[name])
+            for name in chunk if name not in existing
+        ], ignore_conflicts=True)
@@ -0,0 +1,191 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import boto3
+import requests
+from botocore.config import Config
+from django.conf import settings
+import urllib3
+from rgwadmin import RGWAdmin
+
+# Optional - without the minio SDK MinIO admin calls fall back to mc
+try:
+    from minio import MinioAdmin
+    from minio.credentials import StaticProvider
+except ImportError:
+    MinioAdmin = None
+
+
+# Registry of remote clients shared by every task running in this
+# worker process. Clients are keyed by the identity of the endpoint
+# (scheme, host, access key) and remember a fingerprint of the full
+# profile, so a credential rotation evicts the stale client instead of
+# leaving it around next to the new one.
+
+
+def profile_identity(profile: dict) -> tuple:
+    return (
+        profile['endpoint_type'],
+        profile['scheme'],
+        profile['endpoint'],
+        profile['access_key']
+    )
+
+
+def profile_fingerprint(profile: dict) -> tuple:
+    secret_digest = hashlib.sha256(
+        profile['secret_key'].encode()
+    ).hexdigest()
+    return profile_identity(profile) + (secret_digest,)
+
+
+class ClientRegistry:
+
+    # max_size bounds the number of live clients (least recently used
+    # goes first). Clients idle for longer than idle_timeout seconds are
+    # rebuilt on next use since the server has most likely dropped
+    # their keep-alive connections by then.
+    def __init__(self, factory, max_size=None, idle_timeout=None):
+        self._factory = factory
+        self._max_size = max_size
+        self._idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._clients = OrderedDict()
+
+    def get(self, profile: dict):
+        identity = profile_identity(profile)
+        fingerprint = profile_fingerprint(profile)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._clients.get(identity)
+            if (
+                entry is not None and
+                entry[0] == fingerprint and
+                not self._expired(entry, now)
+            ):
+                self._clients[identity] = (fingerprint, entry[1], now)
+                self._clients.move_to_end(identity)
+                return entry[1]
+
+            # Missing, idle too long, or credentials changed
+            client = self._factory(profile)
+            self._clients[identity] = (fingerprint, client, now)
+            self._clients.move_to_end(identity)
+            if self._max_size is not None:
+                while len(self._clients) > self._max_size:
+                    self._clients.popitem(last=False)
+            return client
+
+    def _expired(self, entry, now):
+        if self._idle_timeout is None:
+            return False
+        return now - entry[2] > self._idle_timeout
+
+    def evict(self, profile: dict = None):
+        with self._lock:
+            if profile is None:
+                self._clients.clear()
+            else:
+                self._clients.pop(profile_identity(profile), None)
+
+
+def _new_s3_client(profile: dict):
+    # boto3's default session is not thread safe, so each client gets
+    # its own session. The client itself is safe to share.
+    session = boto3.session.Session()
+    client_config = Config(
+        max_pool_connections=settings.NESE_S3_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True
+    )
+    return session.client(
+        's3',
+        aws_access_key_id=profile['access_key'],
+        aws_secret_access_key=profile['secret_key'],
+        endpoint_url=f"{profile['scheme']}://{profile['endpoint']}",
+        config=client_config
+    )
+
+
+s3_clients = ClientRegistry(_new_s3_client)
+
+
+def _new_rgw_admin(profile: dict):
+    # pool_connections keeps one requests.Session (and its keep-alive
+    # connection pool) per RGWAdmin instead of a new one per request
+    return RGWAdmin(
+        access_key=profile['access_key'],
+        secret_key=profile['secret_key'],
+        server=profile['endpoint'],
+        secure=profile['scheme'] == 'https',
+        pool_connections=True
+    )
+
+
+rgw_admins = ClientRegistry(
+    _new_rgw_admin,
+    max_size=settings.NESE_RGW_MAX_SESSIONS,
+    idle_timeout=settings.NESE_RGW_IDLE_TIMEOUT
+)
+
+
+def rgw_call(profile: dict, func):
+    """Run func(rgw) against the cached admin session for profile.
+
+    A connection level failure drops the cached session and the call is
+    retried once on a fresh one. Errors reported by RGW itself are not
+    retried here.
+    """
+    rgw = rgw_admins.get(profile)
+    try:
+        return func(rgw)
+    except requests.exceptions.ConnectionError:
+        rgw_admins.evict(profile)
+        return func(rgw_admins.get(profile))
+
+
+def _new_minio_admin(profile: dict):
+    http_client = urllib3.PoolManager(
+        maxsize=settings.NESE_S3_MAX_POOL_CONNECTIONS,
+        timeout=urllib3.Timeout(connect=10, read=60),
+        retries=False
+    )
+    return MinioAdmin(
+        profile['endpoint'],
+        credentials=StaticProvider(
+            profile['access_key'],
+            profile['secret_key']
+        ),
+        secure=profile['scheme'] == 'https',
+        http_client=http_client
+    )
+
+
+minio_admins = ClientRegistry(_new_minio_admin)
+
+
+# Per endpoint semaphores capping concurrent remote work from this
+# process at NESE_ENDPOINT_CONCURRENCY, shared by the quota sweeps and
+# the asyncio provisioning engine.
+_endpoint_slots = {}
+_endpoint_slots_lock = threading.Lock()
+
+
+def endpoint_slot(endpoint) -> threading.BoundedSemaphore:
+    with _endpoint_slots_lock:
+        slot = _endpoint_slots.get(endpoint)
+        if slot is None:
+            slot = threading.BoundedSemaphore(
+                settings.NESE_ENDPOINT_CONCURRENCY
+            )
+            _endpoint_slots[endpoint] = slot
+        return slot
+
+
+def minio_admin_available() -> bool:
+    return (
+        MinioAdmin is not None and
+        settings.NESE_MINIO_CLIENT != 'mc'
+    )
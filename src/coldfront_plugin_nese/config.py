@@ -1,4 +1,4 @@
-from coldfront.config.base import INSTALLED_APPS
+from coldfront.config.base import INSTALLED_APPS, MIDDLEWARE
 from coldfront.config.logging import LOGGING
 from coldfront.config.env import ENV
 
@@ -7,12 +7,89 @@ if 'coldfront_plugin_nese' not in INSTALLED_APPS:
         'coldfront_plugin_nese',
     ]
 
-NESE_ENDPOINT = ENV.str('NESE_ENDPOINT')
+# Capacity ledger refusals become an error message, see middleware.py
+if 'coldfront_plugin_nese.middleware.CapacityExceededMiddleware' \
+        not in MIDDLEWARE:
+    MIDDLEWARE += [
+        'coldfront_plugin_nese.middleware.CapacityExceededMiddleware',
+    ]
+
+# JSON list of endpoints, see endpoints.py. When unset the single
+# endpoint below is used.
+NESE_ENDPOINTS = ENV.json('NESE_ENDPOINTS', default=[])
+
+NESE_ENDPOINT = ENV.str('NESE_ENDPOINT', default='')
 NESE_ENDPOINT_TYPE = ENV.str('NESE_ENDPOINT_TYPE', default='rgw')
 NESE_ENDPOINT_SCHEME = ENV.str('NESE_ENDPOINT_SCHEME', default='https')
-NESE_ENDPOINT_ACCESS_KEY = ENV.str('NESE_ENDPOINT_ACCESS_KEY')
-NESE_ENDPOINT_SECRET_KEY = ENV.str('NESE_ENDPOINT_SECRET_KEY')
-NESE_ENDPOINT_UID = ENV.str('NESE_ENDPOINT_UID')
+NESE_ENDPOINT_ACCESS_KEY = ENV.str('NESE_ENDPOINT_ACCESS_KEY', default='')
+NESE_ENDPOINT_SECRET_KEY = ENV.str('NESE_ENDPOINT_SECRET_KEY', default='')
+NESE_ENDPOINT_UID = ENV.str('NESE_ENDPOINT_UID', default='')
+
+NESE_S3_MAX_POOL_CONNECTIONS = ENV.int(
+    'NESE_S3_MAX_POOL_CONNECTIONS',
+    default=10
+)
+NESE_RGW_MAX_SESSIONS = ENV.int('NESE_RGW_MAX_SESSIONS', default=4)
+NESE_RGW_IDLE_TIMEOUT = ENV.int('NESE_RGW_IDLE_TIMEOUT', default=300)
+# 'native' (minio SDK + boto3) or 'mc' (minio client subprocess)
+NESE_MINIO_CLIENT = ENV.str('NESE_MINIO_CLIENT', default='native')
+NESE_SNAPSHOT_WORKERS = ENV.int('NESE_SNAPSHOT_WORKERS', default=16)
+# 0 queues one quota task per drifted bucket, > 0 fixes them inline
+NESE_SWEEP_WORKERS = ENV.int('NESE_SWEEP_WORKERS', default=0)
+NESE_ENDPOINT_CONCURRENCY = ENV.int('NESE_ENDPOINT_CONCURRENCY', default=8)
+# Seconds between full sweeps, runs in between are incremental
+NESE_SWEEP_FULL_INTERVAL = ENV.int('NESE_SWEEP_FULL_INTERVAL', default=86400)
+# Allocations per backfill task, 0 keeps one chain per allocation
+NESE_PROVISION_BATCH_SIZE = ENV.int('NESE_PROVISION_BATCH_SIZE', default=0)
+NESE_PROVISION_WORKERS = ENV.int('NESE_PROVISION_WORKERS', default=8)
+# Threads behind the asyncio provisioning engine
+NESE_AIO_THREADS = ENV.int('NESE_AIO_THREADS', default=32)
+# Allow endpoint_type 'memory' (buckets in process memory), for tests
+# and benchmarks only
+NESE_ALLOW_MEMORY_BACKEND = ENV.bool(
+    'NESE_ALLOW_MEMORY_BACKEND',
+    default=False
+)
+# Seconds to collapse quota changes per allocation, 0 disables
+NESE_QUOTA_DEBOUNCE = ENV.int('NESE_QUOTA_DEBOUNCE', default=30)
+# Seconds the cached NESE ids are trusted, rows added by another
+# process show up after at most this long
+NESE_REGISTRY_TTL = ENV.int('NESE_REGISTRY_TTL', default=60)
+# Allocation lease lifetime and how long a step waits to get it
+NESE_LEASE_TTL = ENV.int('NESE_LEASE_TTL', default=600)
+NESE_LEASE_WAIT = ENV.int('NESE_LEASE_WAIT', default=300)
+# Seconds a cached bucket state is trusted before asking the endpoint
+NESE_BUCKET_STATE_TTL = ENV.int('NESE_BUCKET_STATE_TTL', default=3600)
+# Remote call retries (see resilience.py), backoff in seconds
+NESE_RETRY_ATTEMPTS = ENV.int('NESE_RETRY_ATTEMPTS', default=3)
+NESE_RETRY_BACKOFF = ENV.float('NESE_RETRY_BACKOFF', default=0.5)
+NESE_RETRY_MAX_BACKOFF = ENV.float('NESE_RETRY_MAX_BACKOFF', default=8.0)
+# Consecutive failures opening an endpoint's breaker, seconds it stays open
+NESE_BREAKER_THRESHOLD = ENV.int('NESE_BREAKER_THRESHOLD', default=5)
+NESE_BREAKER_RESET = ENV.int('NESE_BREAKER_RESET', default=30)
+# Admin API operations per second by operation class (user_create,
+# bucket_create, quota_set, read), see ratelimit.py. Unlisted or 0 is
+# unlimited. Burst is in seconds worth of tokens.
+NESE_RATE_LIMITS = ENV.dict(
+    'NESE_RATE_LIMITS',
+    cast={'value': float},
+    default={}
+)
+NESE_RATE_LIMIT_BURST = ENV.float('NESE_RATE_LIMIT_BURST', default=1.0)
+# Refuse quotas that would commit more than a resource's capacity
+NESE_CAPACITY_CHECK = ENV.bool('NESE_CAPACITY_CHECK', default=True)
+# Dotted paths of metrics sinks, see metrics.py
+NESE_METRICS_SINKS = ENV.list('NESE_METRICS_SINKS', default=[])
+# Bucket directories on CephFS for reconcile_nese_quota
+NESE_QUOTA_BASE_DIR = ENV.str('NESE_QUOTA_BASE_DIR', default='')
+# 'ceph' on CephFS, 'user' to test on a plain filesystem
+NESE_QUOTA_XATTR_NAMESPACE = ENV.str(
+    'NESE_QUOTA_XATTR_NAMESPACE',
+    default='ceph'
+)
+NESE_QUOTA_WORKERS = ENV.int('NESE_QUOTA_WORKERS', default=32)
+# Journal of quota changes for apply_nese_quota_journal, empty disables
+NESE_QUOTA_JOURNAL = ENV.str('NESE_QUOTA_JOURNAL', default='')
 
 LOGGING['loggers']['coldfront_plugin_nese'] = {
     'handlers': ['console'],
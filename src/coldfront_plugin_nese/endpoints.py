@@ -0,0 +1,276 @@
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Subquery
+
+from coldfront.core.allocation.models import Allocation, AllocationAttribute
+from coldfront.core.resource.models import ResourceAttribute
+
+from coldfront_plugin_nese import attributes, ledger, registry
+from coldfront_plugin_nese.exceptions import NESEProvisioningError
+from coldfront_plugin_nese.quota import to_bytes
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# NESE endpoints (object store clusters) and bucket placement.
+#
+# NESE_ENDPOINTS is a JSON list with one object per endpoint:
+#
+#   {"name": "nese-a", "endpoint": "s3a.example.org",
+#    "endpoint_type": "rgw", "scheme": "https", "access_key": "...",
+#    "secret_key": "...", "uid": "...", "resource": "NESE A"}
+#
+# resource names the ColdFront resource the endpoint serves. Without it
+# the resource whose NESE S3 Bucket Endpoint attribute matches the
+# endpoint host is used. Its NESE S3 Total Bucket Quota (TB) is the
+# endpoint's capacity. Without NESE_ENDPOINTS the single NESE_ENDPOINT*
+# settings make up an endpoint called 'default'.
+#
+# With more than one endpoint every allocation records its endpoint
+# name in the NESE S3 Endpoint attribute when its bucket is placed.
+# Allocations without it belong to the first endpoint.
+
+DEFAULT_NAME = 'default'
+
+
+def get_profiles() -> dict:
+    """Profiles of all endpoints by name, in configuration order."""
+    configured = settings.NESE_ENDPOINTS or [{
+        'name': DEFAULT_NAME,
+        'endpoint': settings.NESE_ENDPOINT,
+        'endpoint_type': settings.NESE_ENDPOINT_TYPE,
+        'scheme': settings.NESE_ENDPOINT_SCHEME,
+        'access_key': settings.NESE_ENDPOINT_ACCESS_KEY,
+        'secret_key': settings.NESE_ENDPOINT_SECRET_KEY,
+        'uid': settings.NESE_ENDPOINT_UID
+    }]
+
+    profiles = {}
+    for entry in configured:
+        name = entry.get('name') or entry['endpoint']
+        profiles[name] = {
+            'name': name,
+            'endpoint': entry['endpoint'],
+            'endpoint_type': entry.get('endpoint_type', 'rgw'),
+            'scheme': entry.get('scheme', 'https'),
+            'access_key': entry['access_key'],
+            'secret_key': entry['secret_key'],
+            'uid': entry.get('uid', ''),
+            'resource': entry.get('resource')
+        }
+    return profiles
+
+
+def default_name() -> str:
+    return next(iter(get_profiles()))
+
+
+def get_profile(name=None) -> dict:
+    profiles = get_profiles()
+    if name is None:
+        name = next(iter(profiles))
+    if name not in profiles:
+        raise NESEProvisioningError(f"Unknown NESE endpoint: {name}")
+    return profiles[name]
+
+
+def allocation_endpoints(alloc_pks) -> dict:
+    """Endpoint names of allocations that have one, by allocation pk."""
+    return dict(
+        AllocationAttribute.objects.filter(
+            allocation_id__in=alloc_pks,
+            allocation_attribute_type_id=registry.attribute_type_pk(
+                attributes.ALLOCATION_ENDPOINT
+            )
+        ).values_list('allocation_id', 'value')
+    )
+
+
+def profile_for_allocation(allocation_pk, quota=None, place=False):
+    """Profile of the endpoint holding the allocation's bucket.
+
+    With place=True an allocation without an endpoint is placed first
+    (quota in TB, the allocation's quantity if not given).
+    """
+    name = allocation_endpoints([allocation_pk]).get(allocation_pk)
+    if name is None:
+        if not place:
+            return get_profile()
+        allocation = Allocation.objects.get(pk=allocation_pk)
+        if quota is None:
+            quota = allocation.quantity
+        name = place_many({allocation_pk: quota}).get(allocation_pk)
+        if name is None:
+            raise NESEProvisioningError(
+                f"No NESE endpoint has room for allocation {allocation_pk}"
+            )
+    return get_profile(name)
+
+
+def usage() -> dict:
+    """Resource, capacity, committed quota (TB) and pending work per endpoint.
+
+    capacity and used come from the capacity ledger of the endpoint's
+    resource, capacity is None when the resource has no total quota.
+    pending counts allocations with a bucket name but no keys yet.
+    """
+    profiles = get_profiles()
+    default = next(iter(profiles))
+
+    # Resource name and endpoint host by resource id
+    resources = {}
+    for resource_id, resource_name, attr_name, value in \
+            ResourceAttribute.objects.filter(
+                resource_id__in=registry.nese_resource_pks(),
+                resource_attribute_type__name__in=[
+                    attributes.RESOURCE_QUOTA,
+                    attributes.RESOURCE_ENDPOINT
+                ]
+            ).values_list(
+                'resource_id',
+                'resource__name',
+                'resource_attribute_type__name',
+                'value'
+            ):
+        entry = resources.setdefault(resource_id, {'name': resource_name})
+        if attr_name == attributes.RESOURCE_ENDPOINT:
+            entry['endpoint'] = value
+
+    ledgers = ledger.get(resources.keys())
+
+    result = {}
+    for name, profile in profiles.items():
+        entry = {
+            'resource': profile['resource'],
+            'capacity': None,
+            'used': 0.0,
+            'pending': 0
+        }
+        for resource_id, resource in resources.items():
+            if (
+                resource['name'] == profile['resource'] or
+                (
+                    profile['resource'] is None and
+                    resource.get('endpoint') == profile['endpoint']
+                )
+            ):
+                row = ledgers[resource_id]
+                entry['resource'] = resource['name']
+                entry['capacity'] = _tb(row.capacity, 'b')
+                entry['used'] = _tb(row.committed, 'b') or 0.0
+                break
+        result[name] = entry
+
+    rows = AllocationAttribute.objects.filter(
+        allocation_attribute_type__name=attributes.ALLOCATION_BUCKETNAME
+    ).exclude(
+        Exists(AllocationAttribute.objects.filter(
+            allocation=OuterRef('allocation'),
+            allocation_attribute_type__name=attributes.ALLOCATION_SECRET_KEY
+        ))
+    ).annotate(
+        endpoint_name=Subquery(AllocationAttribute.objects.filter(
+            allocation=OuterRef('allocation'),
+            allocation_attribute_type__name=attributes.ALLOCATION_ENDPOINT
+        ).values('value')[:1])
+    ).values_list('endpoint_name', flat=True)
+
+    for endpoint_name in rows.iterator():
+        entry = result.get(endpoint_name or default)
+        if entry is not None:
+            entry['pending'] += 1
+
+    return result
+
+
+def choose(endpoint_usage: dict, quota, resource_name=None) -> str:
+    """Endpoint with the most room for quota TB, None if none fits.
+
+    Only endpoints serving resource_name are considered, the allocation's
+    quota is charged to that resource's ledger and would not show up in
+    the usage of any other endpoint. Room is the free fraction of the
+    capacity, divided by one plus the endpoint's pending provisioning
+    work so that a burst of new allocations spreads out instead of
+    piling onto one cluster.
+    """
+    candidates = [
+        name for name, entry in endpoint_usage.items()
+        if resource_name is not None and entry['resource'] == resource_name
+    ]
+
+    quota = _tb(quota) or 0.0
+    best, best_score = None, None
+    for name in candidates:
+        entry = endpoint_usage[name]
+        if entry['capacity'] is None:
+            free_fraction = 1.0
+        else:
+            free = entry['capacity'] - entry['used']
+            if free < quota:
+                continue
+            free_fraction = (
+                free / entry['capacity'] if entry['capacity'] else 0.0
+            )
+        score = free_fraction / (1 + entry['pending'])
+        if best_score is None or score > best_score:
+            best, best_score = name, score
+
+    return best
+
+
+def place_many(quotas: dict) -> dict:
+    """Place allocations on endpoints, {allocation pk: quota TB}.
+
+    Allocations that already have an endpoint keep it. Returns the
+    endpoint name of every allocation that has one afterwards, the ones
+    no endpoint has room for are logged and left out. With a single
+    endpoint nothing is recorded.
+    """
+    profiles = get_profiles()
+    if len(profiles) == 1:
+        # Nothing to choose or record, allocations without the endpoint
+        # attribute belong to the first endpoint anyway
+        return {pk: next(iter(profiles)) for pk in quotas}
+
+    placed = allocation_endpoints(quotas.keys())
+    todo = [pk for pk in quotas if pk not in placed]
+    if not todo:
+        return placed
+
+    endpoint_usage = usage()
+
+    resource_names = dict(
+        Allocation.resources.through.objects.filter(
+            allocation_id__in=todo
+        ).values_list('allocation_id', 'resource__name')
+    )
+
+    attr_type_pk = registry.attribute_type_pk(attributes.ALLOCATION_ENDPOINT)
+    for pk in sorted(todo):
+        name = choose(endpoint_usage, quotas[pk], resource_names.get(pk))
+        if name is None:
+            logger.error(
+                f"No NESE endpoint serving {resource_names.get(pk)} has "
+                f"room for allocation {pk} ({quotas[pk]} TB)"
+            )
+            continue
+        endpoint_usage[name]['used'] += _tb(quotas[pk]) or 0.0
+        endpoint_usage[name]['pending'] += 1
+
+        # Someone else may have placed it meanwhile, theirs wins
+        attr, _ = AllocationAttribute.objects.get_or_create(
+            allocation_id=pk,
+            allocation_attribute_type_id=attr_type_pk,
+            defaults={'value': name}
+        )
+        placed[pk] = attr.value
+
+    return placed
+
+
+def _tb(value, unit='tb'):
+    try:
+        quota_bytes = to_bytes(value, unit)
+    except ValueError:
+        return None
+    return None if quota_bytes is None else quota_bytes / (1024**4)
@@ -1,2 +1,14 @@
 class NESEProvisioningError(Exception):
     pass
+
+
+# The endpoint is down or not answering, see resilience.py. Work
+# failing with it is retried later rather than reported.
+class EndpointUnavailable(NESEProvisioningError):
+    pass
+
+
+# Admitting a quota would commit more than a resource's capacity, see
+# ledger.py
+class CapacityExceeded(NESEProvisioningError):
+    pass
@@ -0,0 +1,124 @@
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Local journal of bucket quota changes, consumed by the
+# apply_nese_quota_journal command to update the CephFS quota xattr of
+# just the affected bucket directories.
+#
+# The journal is a JSON lines file, one {"bucket", "quota", "ts"} entry
+# per line. Writers append under an exclusive flock and fsync before
+# returning, so an acknowledged quota change survives a crash. The
+# applier keeps the byte offset it has applied up to in a separate
+# offset file next to the journal and truncates the journal once it
+# has caught up.
+
+
+def enabled() -> bool:
+    return bool(settings.NESE_QUOTA_JOURNAL)
+
+
+def _offset_path(path):
+    return f"{path}.offset"
+
+
+@contextmanager
+def _locked(path, mode):
+    with open(path, mode) as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield f
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def append_many(entries, path=None):
+    """Append (bucket, quota) pairs to the journal with one fsync."""
+    path = path or settings.NESE_QUOTA_JOURNAL
+    now = time.time()
+    lines = "".join(
+        json.dumps({'bucket': bucket, 'quota': quota, 'ts': now}) + "\n"
+        for bucket, quota in entries
+    )
+    if not lines:
+        return
+
+    with _locked(path, 'a') as f:
+        f.write(lines)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def append(bucket, quota, path=None):
+    append_many([(bucket, quota)], path)
+
+
+def read_offset(path) -> int:
+    try:
+        with open(_offset_path(path)) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_offset(path, offset):
+    tmp = f"{_offset_path(path)}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(str(offset))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, _offset_path(path))
+
+
+def read_entries(path, offset):
+    """Complete entries after offset and the offset following them.
+
+    A partially written last line is left for the next read.
+    """
+    try:
+        with open(path, 'rb') as f:
+            # Stale offset from an older journal
+            if offset > os.fstat(f.fileno()).st_size:
+                offset = 0
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], 0
+
+    end = data.rfind(b"\n") + 1
+    entries = []
+    for line in data[:end].splitlines():
+        if not line.strip():
+            continue
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            # Garbled line, skip it rather than wedge the applier
+            continue
+
+    return entries, offset + end
+
+
+def compact(path, offset) -> int:
+    """Truncate the journal if everything in it has been applied.
+
+    Returns the offset to continue from.
+    """
+    try:
+        with _locked(path, 'r+') as f:
+            if os.fstat(f.fileno()).st_size != offset:
+                return offset
+            # Offset first, a crash in between only replays entries
+            # that were already applied
+            write_offset(path, 0)
+            f.truncate(0)
+            f.flush()
+            os.fsync(f.fileno())
+    except FileNotFoundError:
+        return 0
+
+    return 0
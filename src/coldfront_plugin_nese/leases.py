@@ -0,0 +1,81 @@
+import datetime
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils import timezone
+
+from coldfront_plugin_nese.exceptions import NESEProvisioningError
+from coldfront_plugin_nese.models import AllocationLease
+
+LEASE_POLL_INTERVAL = 0.5
+
+
+# Lease based lock on an allocation. Unlike select_for_update this
+# does not keep a transaction (and a row lock) open while the holder
+# talks to the object store - acquiring and releasing are single
+# short statements.
+@contextmanager
+def allocation_lease(allocation_pk, ttl=None, wait=None):
+    token = acquire(allocation_pk, ttl=ttl, wait=wait)
+    try:
+        yield token
+    finally:
+        release(allocation_pk, token)
+
+
+def acquire(allocation_pk, ttl=None, wait=None):
+    if ttl is None:
+        ttl = settings.NESE_LEASE_TTL
+    if wait is None:
+        wait = settings.NESE_LEASE_WAIT
+
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + wait
+
+    while True:
+        now = timezone.now()
+        expires = now + datetime.timedelta(seconds=ttl)
+
+        _, created = AllocationLease.objects.get_or_create(
+            allocation_id=allocation_pk,
+            defaults={'owner': token, 'expires': expires}
+        )
+        if created:
+            return token
+
+        # Take over a lease whose holder went away
+        taken = AllocationLease.objects.filter(
+            allocation_id=allocation_pk,
+            expires__lt=now
+        ).update(owner=token, expires=expires)
+        if taken:
+            return token
+
+        if time.monotonic() >= deadline:
+            raise NESEProvisioningError(
+                f"Timed out waiting for lease on allocation {allocation_pk}"
+            )
+        time.sleep(LEASE_POLL_INTERVAL)
+
+
+# Push back the expiry of a held lease. Holders that run longer than
+# the TTL renew while they work. False if the lease was lost (it
+# expired and was taken over).
+def renew(allocation_pk, token, ttl=None) -> bool:
+    if ttl is None:
+        ttl = settings.NESE_LEASE_TTL
+    return AllocationLease.objects.filter(
+        allocation_id=allocation_pk,
+        owner=token
+    ).update(
+        expires=timezone.now() + datetime.timedelta(seconds=ttl)
+    ) > 0
+
+
+def release(allocation_pk, token):
+    AllocationLease.objects.filter(
+        allocation_id=allocation_pk,
+        owner=token
+    ).delete()
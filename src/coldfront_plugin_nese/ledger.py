@@ -0,0 +1,196 @@
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from coldfront.core.allocation.models import Allocation, AllocationAttribute
+from coldfront.core.resource.models import ResourceAttribute
+
+from coldfront_plugin_nese import attributes, registry
+from coldfront_plugin_nese.exceptions import CapacityExceeded
+from coldfront_plugin_nese.models import CapacityLedger
+from coldfront_plugin_nese.quota import to_bytes
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Committed capacity per NESE resource.
+#
+# Every change to an allocation's quota attribute moves the committed
+# total of the allocation's NESE resources by the difference. The
+# ledger rows are locked with select_for_update, checked against the
+# capacity and updated.
+#
+# The signal handlers run just before (or after, for deletes) the row
+# is written. Django does not wrap a plain save in a transaction, so
+# install_atomic_save makes AllocationAttribute.save run in one, and the
+# ledger update commits or rolls back together with the attribute row.
+# Deletes already run in one. Anything bypassing the signals (bulk
+# operations, raw SQL, resources moved between allocations) is
+# corrected by verify, which recomputes the totals from the attributes.
+
+
+def quota_bytes(value) -> int:
+    try:
+        return to_bytes(value) or 0
+    except ValueError:
+        return 0
+
+
+def allocation_resources(allocation_pk) -> list:
+    """NESE resources of an allocation, one indexed lookup."""
+    return resources_by_allocation([allocation_pk]).get(allocation_pk, [])
+
+
+def resources_by_allocation(alloc_pks) -> dict:
+    """NESE resources of many allocations by allocation pk, one query."""
+    nese_resources = registry.nese_resource_pks()
+    if not nese_resources or not alloc_pks:
+        return {}
+    result = {}
+    for allocation_id, resource_id in \
+            Allocation.resources.through.objects.filter(
+                allocation_id__in=alloc_pks,
+                resource_id__in=nese_resources
+            ).values_list('allocation_id', 'resource_id'):
+        result.setdefault(allocation_id, []).append(resource_id)
+    return result
+
+
+def admit(resource_ids, delta: int):
+    """Commit delta bytes on each resource.
+
+    Raises CapacityExceeded, committing nothing, if an increase would
+    take any of them over capacity. Decreases always go through.
+    """
+    if not resource_ids or delta == 0:
+        return
+
+    for resource_id in resource_ids:
+        _ensure(resource_id)
+
+    with transaction.atomic():
+        # Locked in resource order so concurrent admits cannot deadlock
+        rows = CapacityLedger.objects.select_for_update().filter(
+            resource_id__in=resource_ids
+        ).order_by('resource_id')
+        for row in rows:
+            if delta > 0 and settings.NESE_CAPACITY_CHECK and \
+                    row.capacity is not None and \
+                    row.committed + delta > row.capacity:
+                raise CapacityExceeded(
+                    f"Committing {delta} bytes would exceed the capacity "
+                    f"of NESE resource {row.resource_id}"
+                )
+        CapacityLedger.objects.filter(resource_id__in=resource_ids).update(
+            committed=F('committed') + delta
+        )
+
+
+def install_atomic_save():
+    """Run every AllocationAttribute.save in a transaction.
+
+    The quota signal handlers then update the ledger in the same
+    transaction as the attribute row, whoever saves it.
+    """
+    save = AllocationAttribute.save
+    if getattr(save, 'nese_atomic', False):
+        return
+
+    @wraps(save)
+    def atomic_save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            return save(self, *args, **kwargs)
+
+    atomic_save.nese_atomic = True
+    AllocationAttribute.save = atomic_save
+
+
+def set_capacity(resource_id, value):
+    _ensure(resource_id)
+    CapacityLedger.objects.filter(resource_id=resource_id).update(
+        capacity=to_bytes(value) if value not in (None, '') else None
+    )
+
+
+def get(resource_ids) -> dict:
+    """Ledger rows by resource id, created on first use."""
+    return {resource_id: _ensure(resource_id) for resource_id in resource_ids}
+
+
+def verify(fix=True) -> dict:
+    """Recompute every resource's committed total and capacity.
+
+    Returns {resource id: (ledger committed, actual committed)} for the
+    resources that were off. With fix the ledger is corrected.
+    """
+    nese_resources = registry.nese_resource_pks()
+    actual = {resource_id: 0 for resource_id in nese_resources}
+
+    quota_rows = AllocationAttribute.objects.filter(
+        allocation_attribute_type__name=attributes.ALLOCATION_QUOTA,
+        allocation__resources__in=nese_resources
+    ).values_list('allocation__resources', 'value')
+    for resource_id, value in quota_rows.iterator():
+        if resource_id in actual:
+            actual[resource_id] += quota_bytes(value)
+
+    capacities = _capacities(nese_resources)
+
+    drift = {}
+    now = timezone.now()
+    for resource_id, committed in actual.items():
+        ledger = _ensure(resource_id, committed)
+        if ledger.committed != committed:
+            drift[resource_id] = (ledger.committed, committed)
+            logger.warning(
+                f"NESE capacity ledger of resource {resource_id} is off: "
+                f"{ledger.committed} recorded, {committed} committed"
+            )
+        if fix:
+            # Relative to what was read, so concurrent changes survive
+            CapacityLedger.objects.filter(resource_id=resource_id).update(
+                committed=F('committed') + (committed - ledger.committed),
+                capacity=capacities.get(resource_id),
+                verified=now
+            )
+
+    return drift
+
+
+def _capacities(resource_ids) -> dict:
+    return {
+        resource_id: quota_bytes(value) or None
+        for resource_id, value in ResourceAttribute.objects.filter(
+            resource_id__in=resource_ids,
+            resource_attribute_type__name=attributes.RESOURCE_QUOTA
+        ).values_list('resource_id', 'value')
+    }
+
+
+def _ensure(resource_id, committed=None):
+    ledger = CapacityLedger.objects.filter(resource_id=resource_id).first()
+    if ledger is not None:
+        return ledger
+
+    # First use, start from the current totals
+    if committed is None:
+        committed = sum(
+            quota_bytes(value)
+            for value in AllocationAttribute.objects.filter(
+                allocation_attribute_type__name=attributes.ALLOCATION_QUOTA,
+                allocation__resources=resource_id
+            ).values_list('value', flat=True)
+        )
+    try:
+        with transaction.atomic():
+            return CapacityLedger.objects.create(
+                resource_id=resource_id,
+                capacity=_capacities([resource_id]).get(resource_id),
+                committed=committed
+            )
+    except IntegrityError:
+        return CapacityLedger.objects.get(resource_id=resource_id)
@@ -28,7 +28,7 @@ class Command(BaseCommand):
             resource_type=ResourceType.objects.get(name='Storage'),
             parent_resource=None,
             name=options['name'],
-            description='NESE S3 Allocation',
+            description=attributes.RESOURCE_DESCRIPTION,
             is_available=True,
             is_public=True,
             is_allocatable=True
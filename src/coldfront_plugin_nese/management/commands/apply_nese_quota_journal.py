@@ -0,0 +1,110 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from coldfront_plugin_nese import journal, metrics, quotafs
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Outcomes worth another try on the next poll. A bucket directory can
+# show up a little after the bucket is created.
+RETRY_OUTCOMES = (quotafs.MISSING, quotafs.FAILED)
+# Polls before giving up on a bucket, the periodic reconcile_nese_quota
+# run covers whatever is dropped
+RETRY_LIMIT = 60
+
+
+class Command(BaseCommand):
+    help = (
+        'Follow the NESE quota journal and write each quota change to the '
+        'quota.max_bytes extended attribute of the bucket directory.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--journal', type=str, required=False,
+                            default=settings.NESE_QUOTA_JOURNAL,
+                            help='Journal file written by the quota tasks')
+        parser.add_argument('--base-dir', type=str, required=False,
+                            default=settings.NESE_QUOTA_BASE_DIR,
+                            help='Directory holding one directory per bucket')
+        parser.add_argument('--namespace', type=str, required=False,
+                            default=settings.NESE_QUOTA_XATTR_NAMESPACE,
+                            help='xattr namespace, ceph or user')
+        parser.add_argument('--workers', type=int, required=False,
+                            default=settings.NESE_QUOTA_WORKERS,
+                            help='Threads writing xattrs')
+        parser.add_argument('--poll', type=float, required=False,
+                            default=1.0,
+                            help='Seconds between journal reads')
+        parser.add_argument('--once', action='store_true',
+                            help='Apply what is in the journal and exit')
+
+    def handle(self, *args, **options):
+        if not options['journal'] or not options['base_dir']:
+            raise CommandError(
+                "Set --journal/NESE_QUOTA_JOURNAL and "
+                "--base-dir/NESE_QUOTA_BASE_DIR"
+            )
+
+        path = options['journal']
+        offset = journal.read_offset(path)
+        # Entries to retry, only the newest quota per bucket matters
+        pending = {}
+        attempts = {}
+
+        while True:
+            entries, next_offset = journal.read_entries(path, offset)
+            for entry in entries:
+                pending[entry['bucket']] = entry['quota']
+                attempts[entry['bucket']] = 0
+
+            if pending:
+                pending = self.apply(pending, options)
+                for name in list(attempts):
+                    if name not in pending:
+                        del attempts[name]
+                        continue
+                    attempts[name] += 1
+                    if attempts[name] >= RETRY_LIMIT:
+                        logger.warning(
+                            f"Giving up on quota for bucket {name}"
+                        )
+                        del pending[name]
+                        del attempts[name]
+
+            if next_offset != offset:
+                journal.write_offset(path, next_offset)
+                offset = journal.compact(path, next_offset)
+
+            if options['once']:
+                break
+            time.sleep(options['poll'])
+
+    @metrics.timed(metrics.TASK, task='apply_nese_quota_journal')
+    def apply(self, quotas, options):
+        summary = quotafs.reconcile(
+            options['base_dir'],
+            quotas,
+            options['namespace'],
+            options['workers']
+        )
+
+        for name, current, wanted, _ in summary[quotafs.CHANGED]:
+            logger.info(f"Bucket {name} quota {current} -> {wanted}")
+        for name, _, _, error in summary[quotafs.FAILED]:
+            logger.error(f"Bucket {name} quota not applied: {error}")
+        for outcome, rows in summary.items():
+            metrics.inc(
+                'nese_quota_journal_entries_total',
+                amount=len(rows),
+                result=outcome
+            )
+
+        return {
+            name: quotas[name]
+            for outcome in RETRY_OUTCOMES
+            for name, _, _, _ in summary[outcome]
+        }
@@ -0,0 +1,247 @@
+import json
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from coldfront.core.allocation.models import (Allocation,
+                                              AllocationAttribute,
+                                              AllocationAttributeType,
+                                              AllocationStatusChoice)
+from coldfront.core.field_of_science.models import FieldOfScience
+from coldfront.core.project.models import Project, ProjectStatusChoice
+from coldfront.core.resource.models import Resource, ResourceType
+
+from coldfront_plugin_nese import attributes, endpoints, registry, tasks
+from coldfront_plugin_nese.backends import MemoryBackend, get_backend
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+BENCH_PREFIX = 'nese-bench'
+BENCH_QUOTA = 10
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the NESE sweep and backfill entry points against '
+        'synthetic allocations. Needs a database prepared with '
+        'initial_setup and register_nese_attributes. All seeded data is '
+        'rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--allocations', type=int, default=10000,
+                            help='Number of synthetic allocations')
+        parser.add_argument('--unprovisioned', type=float, default=0.1,
+                            help='Fraction of allocations without keys')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Allocations per backfill batch')
+        parser.add_argument('--budget', type=str, required=False,
+                            help='JSON file with per entry point limits, '
+                                 'e.g. {"sweep_full": {"seconds": 30, '
+                                 '"queries": 5, "peak_mb": 200}}')
+
+    def handle(self, *args, **options):
+        budget = {}
+        if options['budget']:
+            with open(options['budget']) as f:
+                budget = json.load(f)
+
+        # Memory backend so only the database side is measured
+        with override_settings(
+            NESE_ENDPOINTS=[{
+                'name': BENCH_PREFIX,
+                'endpoint': BENCH_PREFIX,
+                'endpoint_type': 'memory',
+                'access_key': BENCH_PREFIX,
+                'secret_key': BENCH_PREFIX
+            }],
+            NESE_ALLOW_MEMORY_BACKEND=True,
+            NESE_QUOTA_DEBOUNCE=0,
+            NESE_SWEEP_WORKERS=0
+        ):
+            results = {}
+            try:
+                with transaction.atomic():
+                    self.seed(options)
+                    self.run_all(results, options)
+                    raise _Rollback()
+            except _Rollback:
+                pass
+            finally:
+                MemoryBackend.reset()
+                registry.invalidate()
+
+        self.report(results)
+
+        violations = self.check_budget(results, budget)
+        if violations:
+            raise CommandError(
+                "Benchmark budget exceeded:\n" + "\n".join(violations)
+            )
+
+    def run_all(self, results, options):
+        batch_size = options['batch_size']
+
+        def backfill():
+            alloc_pks = sorted(tasks._get_unprovisioned_pks())
+            profile = endpoints.get_profile()
+            for i in range(0, len(alloc_pks), batch_size):
+                tasks.provision_nese_allocation_batch(
+                    alloc_pks[i:i + batch_size],
+                    profile
+                )
+
+        entry_points = [
+            ('get_alloc_pks', lambda: tasks._get_alloc_pks(
+                attributes.ALLOCATION_BUCKETNAME
+            )),
+            ('unprovisioned_pks', tasks._get_unprovisioned_pks),
+            ('backfill', backfill),
+            ('sweep_full', lambda: tasks.process_nese_quota_sweep(
+                workers=0,
+                full=True
+            )),
+            ('sweep_incremental', lambda: tasks.process_nese_quota_sweep(
+                workers=0,
+                full=False
+            )),
+        ]
+
+        for name, func in entry_points:
+            results[name] = self.measure(func)
+            logger.debug(f"{name}: {results[name]}")
+
+    def measure(self, func):
+        tracemalloc.start()
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {
+            'seconds': round(seconds, 3),
+            'queries': len(queries),
+            'peak_mb': round(peak / (1024 * 1024), 2)
+        }
+
+    def seed(self, options):
+        count = options['allocations']
+        unprovisioned = int(count * options['unprovisioned'])
+
+        pi, _ = User.objects.get_or_create(username=BENCH_PREFIX)
+        project = Project.objects.create(
+            title=BENCH_PREFIX,
+            pi=pi,
+            description=BENCH_PREFIX,
+            field_of_science=FieldOfScience.objects.first(),
+            status=ProjectStatusChoice.objects.get_or_create(
+                name='Active'
+            )[0]
+        )
+        resource = Resource.objects.create(
+            resource_type=ResourceType.objects.get(name='Storage'),
+            name=BENCH_PREFIX,
+            description=attributes.RESOURCE_DESCRIPTION
+        )
+        status, _ = AllocationStatusChoice.objects.get_or_create(
+            name='Active'
+        )
+
+        Allocation.objects.bulk_create([
+            Allocation(
+                project=project,
+                status=status,
+                quantity=BENCH_QUOTA,
+                justification=BENCH_PREFIX
+            )
+            for i in range(count)
+        ], batch_size=1000)
+        # Not every backend hands primary keys back from bulk_create
+        alloc_pks = list(
+            Allocation.objects.filter(project=project).order_by('pk')
+            .values_list('pk', flat=True)
+        )
+
+        Allocation.resources.through.objects.bulk_create([
+            Allocation.resources.through(
+                allocation_id=pk,
+                resource_id=resource.pk
+            )
+            for pk in alloc_pks
+        ], batch_size=1000)
+
+        attr_types = dict(
+            AllocationAttributeType.objects.filter(name__in=[
+                attributes.ALLOCATION_BUCKETNAME,
+                attributes.ALLOCATION_QUOTA,
+                attributes.ALLOCATION_ACCESS_KEY,
+                attributes.ALLOCATION_SECRET_KEY
+            ]).values_list('name', 'pk')
+        )
+
+        backend = get_backend(endpoints.get_profile())
+
+        attrs = []
+        for i, pk in enumerate(alloc_pks):
+            bucket_name = f"{BENCH_PREFIX}-{pk}"
+            values = {
+                attributes.ALLOCATION_BUCKETNAME: bucket_name,
+                attributes.ALLOCATION_QUOTA: BENCH_QUOTA
+            }
+            # The first allocations are left for the backfill
+            if i >= unprovisioned:
+                values[attributes.ALLOCATION_ACCESS_KEY] = bucket_name
+                values[attributes.ALLOCATION_SECRET_KEY] = BENCH_PREFIX
+                backend.create_bucket(bucket_name)
+                backend.set_bucket_quota(bucket_name, BENCH_QUOTA)
+
+            attrs.extend(
+                AllocationAttribute(
+                    allocation_id=pk,
+                    allocation_attribute_type_id=attr_types[name],
+                    value=value
+                )
+                for name, value in values.items()
+            )
+
+        AllocationAttribute.objects.bulk_create(attrs, batch_size=1000)
+
+        self.stdout.write(
+            f"Seeded {count} allocations ({unprovisioned} unprovisioned)."
+        )
+
+    def report(self, results):
+        self.stdout.write(
+            f"{'entry point':<20}{'seconds':>10}{'queries':>10}{'peak MB':>10}"
+        )
+        for name, r in results.items():
+            self.stdout.write(
+                f"{name:<20}{r['seconds']:>10}{r['queries']:>10}"
+                f"{r['peak_mb']:>10}"
+            )
+
+    def check_budget(self, results, budget):
+        violations = []
+        for name, limits in budget.items():
+            measured = results.get(name)
+            if measured is None:
+                violations.append(f"{name}: no such entry point")
+                continue
+            for metric, limit in limits.items():
+                if measured[metric] > limit:
+                    violations.append(
+                        f"{name}: {metric} {measured[metric]} > {limit}"
+                    )
+        return violations
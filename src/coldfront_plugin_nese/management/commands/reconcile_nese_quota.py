@@ -0,0 +1,106 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from coldfront_plugin_nese import endpoints, metrics, quotafs
+from coldfront_plugin_nese.backends import get_backend
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Write the quota of every NESE bucket to the quota.max_bytes '
+        'extended attribute of its directory on CephFS.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', type=str, required=False,
+                            help='NESE endpoint name, the first by default')
+        parser.add_argument('--base-dir', type=str, required=False,
+                            default=settings.NESE_QUOTA_BASE_DIR,
+                            help='Directory holding one directory per bucket')
+        parser.add_argument('--namespace', type=str, required=False,
+                            default=settings.NESE_QUOTA_XATTR_NAMESPACE,
+                            help='xattr namespace, ceph or user')
+        parser.add_argument('--workers', type=int, required=False,
+                            default=settings.NESE_QUOTA_WORKERS,
+                            help='Threads reading and writing xattrs')
+        parser.add_argument('--interval', type=int, required=False,
+                            default=0,
+                            help='Run every INTERVAL seconds, 0 runs once')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report changes without writing them')
+        parser.add_argument('--verbose-diff', action='store_true',
+                            help='List every bucket, not only changes')
+
+    def handle(self, *args, **options):
+        if not options['base_dir']:
+            raise CommandError(
+                "No bucket directory, set --base-dir or NESE_QUOTA_BASE_DIR"
+            )
+
+        while True:
+            self.run_once(options)
+            if options['interval'] <= 0:
+                break
+            time.sleep(options['interval'])
+
+    @metrics.timed(metrics.TASK, task='reconcile_nese_quota')
+    def run_once(self, options):
+        start = time.monotonic()
+
+        # Quotas of every bucket in one snapshot, tags are fetched
+        # concurrently by the backend
+        profile = endpoints.get_profile(options['endpoint'])
+        snapshot = get_backend(profile).get_bucket_snapshot()
+        quotas = {name: state['quota'] for name, state in snapshot.items()}
+
+        summary = quotafs.reconcile(
+            options['base_dir'],
+            quotas,
+            options['namespace'],
+            options['workers'],
+            dry_run=options['dry_run']
+        )
+
+        self.report(summary, options)
+
+        counts = {k: len(v) for k, v in summary.items()}
+        for outcome, count in counts.items():
+            metrics.inc(
+                'nese_quota_xattr_buckets_total',
+                amount=count,
+                result=outcome
+            )
+        logger.info(
+            f"Reconciled {len(quotas)} bucket quotas in "
+            f"{time.monotonic() - start:.2f}s: {counts}"
+        )
+        return counts
+
+    def report(self, summary, options):
+        prefix = '(dry run) ' if options['dry_run'] else ''
+
+        for name, current, wanted, _ in summary[quotafs.CHANGED]:
+            self.stdout.write(f"{prefix}{name}: {current} -> {wanted}")
+        for name, _, _, _ in summary[quotafs.MISSING]:
+            self.stdout.write(f"{name}: no bucket directory")
+        for name, _, _, error in summary[quotafs.FAILED]:
+            self.stderr.write(f"{name}: {error}")
+        if options['verbose_diff']:
+            for name, current, _, _ in summary[quotafs.UNCHANGED]:
+                self.stdout.write(f"{name}: {current}")
+            for name, _, _, _ in summary[quotafs.NO_QUOTA]:
+                self.stdout.write(f"{name}: no quota set")
+
+        self.stdout.write(
+            f"{prefix}changed {len(summary[quotafs.CHANGED])}, "
+            f"unchanged {len(summary[quotafs.UNCHANGED])}, "
+            f"no quota {len(summary[quotafs.NO_QUOTA])}, "
+            f"missing {len(summary[quotafs.MISSING])}, "
+            f"failed {len(summary[quotafs.FAILED])}"
+        )
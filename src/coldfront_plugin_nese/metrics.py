@@ -0,0 +1,206 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Latency histograms and counters for remote operations and tasks.
+#
+# Every observation goes to the in-process registry (render() gives
+# Prometheus text format, served by views.metrics_view) and to each
+# sink listed in NESE_METRICS_SINKS, so deployments running several
+# worker processes can ship the numbers somewhere central. A sink is
+# any callable taking (kind, name, labels, value) with kind 'histogram'
+# or 'counter'.
+
+REMOTE_OP = 'nese_remote_op_seconds'
+TASK = 'nese_task_seconds'
+QUEUE_WAIT = 'nese_queue_wait_seconds'
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+
+class Registry:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, name, value, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = {
+                    'counts': [0] * (len(self._buckets) + 1),
+                    'sum': 0.0,
+                    'count': 0
+                }
+                self._histograms[key] = hist
+            hist['counts'][bisect.bisect_left(self._buckets, value)] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name in sorted({k[0] for k in self._histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (hname, labels), hist in sorted(
+                        self._histograms.items()):
+                    if hname != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(
+                            self._buckets + (float('inf'),),
+                            hist['counts']):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else bound
+                        lines.append(
+                            f"{name}_bucket"
+                            f"{_labels(labels + (('le', le),))} "
+                            f"{cumulative}"
+                        )
+                    lines.append(
+                        f"{name}_sum{_labels(labels)} {hist['sum']}"
+                    )
+                    lines.append(
+                        f"{name}_count{_labels(labels)} {hist['count']}"
+                    )
+
+            for name in sorted({k[0] for k in self._counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (cname, labels), value in sorted(self._counters.items()):
+                    if cname == name:
+                        lines.append(f"{name}{_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    inner = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return '{' + inner + '}'
+
+
+# Label value escaping of the Prometheus text format
+def _escape(value):
+    value = str(value).replace('\\', r'\\').replace('"', r'\"')
+    return value.replace('\n', r'\n')
+
+
+registry = Registry()
+
+_sinks = None
+_sinks_lock = threading.Lock()
+
+
+def _get_sinks():
+    global _sinks
+    with _sinks_lock:
+        if _sinks is None:
+            _sinks = [import_string(s) for s in settings.NESE_METRICS_SINKS]
+        return _sinks
+
+
+def _emit(kind, name, labels, value):
+    for sink in _get_sinks():
+        try:
+            sink(kind, name, labels, value)
+        except Exception:
+            # Metrics must never break provisioning
+            logger.exception(f"Metrics sink {sink} failed")
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, labels)
+    _emit('histogram', name, labels, value)
+
+
+def inc(name, amount=1, **labels):
+    registry.inc(name, labels, amount)
+    _emit('counter', name, labels, amount)
+
+
+@contextmanager
+def timer(name, **labels):
+    start = time.monotonic()
+    outcome = 'ok'
+    try:
+        yield
+    except Exception:
+        outcome = 'error'
+        raise
+    finally:
+        observe(name, time.monotonic() - start, outcome=outcome, **labels)
+
+
+def timed(name, **labels):
+    def decorator(func):
+        @wraps(func)
+        def inner_func(*args, **kwargs):
+            with timer(name, **labels):
+                return func(*args, **kwargs)
+
+        return inner_func
+
+    return decorator
+
+
+def render() -> str:
+    return registry.render()
+
+
+# ---- Sinks usable in NESE_METRICS_SINKS
+
+def log_sink(kind, name, labels, value):
+    logger.info(f"METRIC {kind} {name} {labels} {value}")
+
+
+_prometheus_metrics = {}
+
+
+def prometheus_sink(kind, name, labels, value):
+    # Mirrors observations into prometheus_client, which has to be
+    # installed (and set up for multiprocess mode if workers fork)
+    import prometheus_client
+
+    key = (kind, name, tuple(sorted(labels)))
+    with _sinks_lock:
+        metric = _prometheus_metrics.get(key)
+        if metric is None:
+            cls = (
+                prometheus_client.Histogram if kind == 'histogram'
+                else prometheus_client.Counter
+            )
+            metric = cls(name, name, sorted(labels))
+            _prometheus_metrics[key] = metric
+
+    child = metric.labels(**labels) if labels else metric
+    if kind == 'histogram':
+        child.observe(value)
+    else:
+        child.inc(value)
@@ -0,0 +1,34 @@
+from django.contrib import messages
+from django.http import HttpResponseRedirect
+from django.utils.http import url_has_allowed_host_and_scheme
+
+from coldfront_plugin_nese.exceptions import CapacityExceeded
+
+# A quota change refused by the capacity ledger (see ledger.py) is
+# raised from a model signal inside whichever ColdFront view saved the
+# attribute. Turn it into an error message on the page the user came
+# from instead of a server error.
+
+
+class CapacityExceededMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, CapacityExceeded):
+            return None
+
+        messages.error(request, str(exception))
+
+        referer = request.META.get('HTTP_REFERER')
+        if not url_has_allowed_host_and_scheme(
+            referer,
+            allowed_hosts={request.get_host()},
+            require_https=request.is_secure()
+        ):
+            referer = '/'
+        return HttpResponseRedirect(referer)
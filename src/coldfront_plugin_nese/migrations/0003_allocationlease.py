@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coldfront_plugin_nese', '0002_provisioninghandoff'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AllocationLease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('allocation_id', models.IntegerField(unique=True)),
+                ('owner', models.CharField(max_length=64)),
+                ('expires', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coldfront_plugin_nese', '0003_allocationlease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BucketState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_name', models.CharField(max_length=255, unique=True)),
+                ('endpoint', models.CharField(max_length=255)),
+                ('owner_uid', models.CharField(blank=True, max_length=255)),
+                ('quota', models.BigIntegerField(blank=True, null=True)),
+                ('state_hash', models.CharField(blank=True, max_length=64)),
+                ('policy_hash', models.CharField(blank=True, max_length=64)),
+                ('cors_hash', models.CharField(blank=True, max_length=64)),
+                ('last_verified', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coldfront_plugin_nese', '0005_ratelimitbucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CapacityLedger',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource_id', models.IntegerField(unique=True)),
+                ('capacity', models.BigIntegerField(blank=True, null=True)),
+                ('committed', models.BigIntegerField(default=0)),
+                ('verified', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
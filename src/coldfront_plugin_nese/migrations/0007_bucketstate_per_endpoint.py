@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coldfront_plugin_nese', '0006_capacityledger'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bucketstate',
+            name='bucket_name',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AlterUniqueTogether(
+            name='bucketstate',
+            unique_together={('endpoint', 'bucket_name')},
+        ),
+    ]
@@ -0,0 +1,94 @@
+from django.db import models
+
+
+# Bookkeeping for the periodic quota sweep. watermark is the start
+# time of the last successful run, anything modified after it is
+# rechecked by the next incremental run along with the allocations
+# left in drifted.
+class SweepState(models.Model):
+    name = models.CharField(max_length=64, unique=True)
+    watermark = models.DateTimeField(null=True, blank=True)
+    last_full_sweep = models.DateTimeField(null=True, blank=True)
+    drifted = models.JSONField(default=list, blank=True)
+
+    def __str__(self):
+        return self.name
+
+
+# Result of one step of an allocation provisioning chain, keyed by the
+# chain group. Later steps read the results of earlier ones from here
+# instead of polling the django-q result store.
+class ProvisioningHandoff(models.Model):
+    group = models.CharField(max_length=100)
+    step = models.CharField(max_length=64)
+    func = models.CharField(max_length=256)
+    success = models.BooleanField()
+    result = models.JSONField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('group', 'step')
+
+    def __str__(self):
+        return f"{self.group}/{self.step}"
+
+
+# Per allocation lease serializing provisioning steps. Held by owner
+# until released or until expires passes, so a crashed worker cannot
+# block an allocation forever.
+class AllocationLease(models.Model):
+    allocation_id = models.IntegerField(unique=True)
+    owner = models.CharField(max_length=64)
+    expires = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.allocation_id} ({self.owner})"
+
+
+# Last known state of a bucket on the object store, written through by
+# the provisioning tasks and refreshed from bulk snapshots. quota is in
+# bytes, the hashes are of the documents applied to the bucket (see
+# bucketstate.py). Entries older than NESE_BUCKET_STATE_TTL or with an
+# error are stale and get read from the endpoint again.
+class BucketState(models.Model):
+    bucket_name = models.CharField(max_length=255)
+    endpoint = models.CharField(max_length=255)
+    owner_uid = models.CharField(max_length=255, blank=True)
+    quota = models.BigIntegerField(null=True, blank=True)
+    state_hash = models.CharField(max_length=64, blank=True)
+    policy_hash = models.CharField(max_length=64, blank=True)
+    cors_hash = models.CharField(max_length=64, blank=True)
+    last_verified = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        unique_together = ('endpoint', 'bucket_name')
+
+    def __str__(self):
+        return self.bucket_name
+
+
+# Token bucket shared by every worker process, one per endpoint and
+# operation class (see ratelimit.py). tokens is the fill level at
+# updated.
+class RateLimitBucket(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    tokens = models.FloatField()
+    updated = models.DateTimeField()
+
+    def __str__(self):
+        return self.name
+
+
+# Capacity committed to allocations on a NESE resource, kept up to date
+# by the quota attribute signals (see ledger.py) so admission checks do
+# not have to add up every allocation. Both values are in bytes,
+# capacity is None when the resource has no total quota.
+class CapacityLedger(models.Model):
+    resource_id = models.IntegerField(unique=True)
+    capacity = models.BigIntegerField(null=True, blank=True)
+    committed = models.BigIntegerField(default=0)
+    verified = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.resource_id}: {self.committed}/{self.capacity}"
@@ -0,0 +1,101 @@
+import hashlib
+import json
+from decimal import Decimal, InvalidOperation
+
+# Quota values come in different shapes depending on where they are
+# read from: the allocation attribute and MinIO bucket tags are TB as
+# strings ("10", "10.0"), RGW reports KB, MinIO admin and the CephFS
+# quota xattr use bytes. Everything is normalized to an int number of
+# bytes before comparing. Units are binary, matching the existing TB to
+# KB/bytes conversions.
+
+UNITS = {
+    'b': 1,
+    'kb': 1024,
+    'mb': 1024**2,
+    'gb': 1024**3,
+    'tb': 1024**4
+}
+
+_SUFFIXES = {
+    'b': 'b',
+    'k': 'kb', 'kb': 'kb', 'kib': 'kb',
+    'm': 'mb', 'mb': 'mb', 'mib': 'mb',
+    'g': 'gb', 'gb': 'gb', 'gib': 'gb',
+    't': 'tb', 'tb': 'tb', 'tib': 'tb'
+}
+
+# Bucket tag holding the hash of the desired state last written
+STATE_HASH_TAG = 'statehash'
+# Tags that are not part of the desired bucket state
+VOLATILE_TAGS = ('timestamp', STATE_HASH_TAG)
+
+
+def to_bytes(value, unit='tb'):
+    """Quota in bytes, None if value is unset or unlimited.
+
+    value is a number or a string, optionally with a unit suffix
+    ("10", "10.5", "10t", "512 GiB"). Without a suffix it is taken to
+    be in unit. Raises ValueError for anything else.
+    """
+    if value is None:
+        return None
+
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text in ('', 'none', 'null'):
+            return None
+        number = text.rstrip('abcdefghijklmnopqrstuvwxyz').strip()
+        suffix = text[len(number):].strip()
+        if suffix:
+            if suffix not in _SUFFIXES:
+                raise ValueError(f"Unknown quota unit: {value!r}")
+            unit = _SUFFIXES[suffix]
+        value = number
+
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"Invalid quota: {value!r}")
+
+    if not amount.is_finite():
+        raise ValueError(f"Invalid quota: {value!r}")
+
+    # RGW reports -1 for no quota
+    if amount < 0:
+        return None
+
+    return int(amount * UNITS[unit])
+
+
+def convert(value, from_unit, to_unit):
+    """Convert between units, an int when it divides evenly."""
+    quota_bytes = to_bytes(value, from_unit)
+    if quota_bytes is None:
+        return None
+
+    result = Decimal(quota_bytes) / UNITS[to_unit]
+    if result == result.to_integral_value():
+        return int(result)
+    return float(result)
+
+
+def equal(a, b, unit='tb') -> bool:
+    """True if a and b are the same quota. Unparsable values never match."""
+    try:
+        return to_bytes(a, unit) == to_bytes(b, unit)
+    except ValueError:
+        return False
+
+
+def state_hash(quota, tags: dict = None) -> str:
+    """Hash of the desired bucket state, quota in TB plus bucket tags."""
+    state = {
+        'quota': to_bytes(quota),
+        'tags': {
+            str(k): str(v) for k, v in (tags or {}).items()
+            if k not in VOLATILE_TAGS
+        }
+    }
+    encoded = json.dumps(state, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()[:16]
@@ -0,0 +1,99 @@
+import errno
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from coldfront_plugin_nese.quota import to_bytes
+
+# Filesystem quota enforcement for buckets served out of a CephFS
+# directory tree (one directory per bucket). The quota set on the bucket
+# by ColdFront is written to the directory's quota.max_bytes extended
+# attribute. Use the 'ceph' xattr namespace on CephFS and 'user' to
+# try it out on a plain filesystem.
+
+# Outcomes of reconciling one bucket directory
+UNCHANGED = 'unchanged'
+CHANGED = 'changed'
+NO_QUOTA = 'no_quota'
+MISSING = 'missing'
+FAILED = 'failed'
+
+
+def quota_attr(namespace: str) -> str:
+    return f"{namespace}.quota.max_bytes"
+
+
+def read_quota(path: str, namespace: str):
+    """Quota in bytes set on path, None if unset."""
+    try:
+        value = os.getxattr(path, quota_attr(namespace))
+    except OSError as e:
+        # Attribute not set
+        if e.errno == errno.ENODATA:
+            return None
+        raise
+    value = value.decode().strip()
+    return int(value) if value else None
+
+
+def write_quota(path: str, quota_bytes: int, namespace: str):
+    os.setxattr(path, quota_attr(namespace), str(quota_bytes).encode())
+
+
+def reconcile_bucket(base_dir, bucket_name, quota, namespace, dry_run=False):
+    """Bring the quota xattr of one bucket directory in line.
+
+    quota is the bucket quota in TB (None when the bucket has none).
+    Returns (outcome, current bytes, wanted bytes, error).
+    """
+    try:
+        wanted = to_bytes(quota)
+    except ValueError as e:
+        return FAILED, None, None, e
+
+    if wanted is None:
+        return NO_QUOTA, None, None, None
+
+    path = os.path.join(base_dir, bucket_name)
+
+    try:
+        current = read_quota(path, namespace)
+    except FileNotFoundError:
+        return MISSING, None, wanted, None
+    except OSError as e:
+        return FAILED, None, wanted, e
+
+    if current == wanted:
+        return UNCHANGED, current, wanted, None
+
+    if not dry_run:
+        try:
+            write_quota(path, wanted, namespace)
+        except OSError as e:
+            return FAILED, current, wanted, e
+
+    return CHANGED, current, wanted, None
+
+
+def reconcile(base_dir, quotas: dict, namespace, workers, dry_run=False):
+    """Reconcile every bucket in quotas ({bucket: quota TB}).
+
+    Returns a dict mapping each outcome to a list of
+    (bucket, current bytes, wanted bytes, error).
+    """
+    def run(item):
+        name, quota = item
+        return name, reconcile_bucket(
+            base_dir,
+            name,
+            quota,
+            namespace,
+            dry_run
+        )
+
+    summary = {k: [] for k in (UNCHANGED, CHANGED, NO_QUOTA, MISSING, FAILED)}
+    with ThreadPoolExecutor(workers) as pool:
+        for name, (outcome, current, wanted, error) in pool.map(
+                run, sorted(quotas.items())):
+            summary[outcome].append((name, current, wanted, error))
+
+    return summary
@@ -0,0 +1,92 @@
+import inspect
+import random
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.utils import timezone
+
+from coldfront_plugin_nese import metrics
+from coldfront_plugin_nese.models import RateLimitBucket
+
+# Token bucket rate limits on admin API traffic, shared by all worker
+# processes through the RateLimitBucket table.
+#
+# Each endpoint has one bucket per operation class. NESE_RATE_LIMITS
+# sets the sustained rate (operations per second) of each class,
+# NESE_RATE_LIMIT_BURST how many seconds worth of tokens a bucket can
+# hold. A class without a rate, or with 0, is not limited.
+#
+# Taking tokens is a compare and swap on the bucket row, no lock is
+# held. Callers short on tokens sleep until enough have refilled, so a
+# batch runs at the configured rate rather than as fast as the workers
+# can go.
+
+USER_CREATE = 'user_create'
+BUCKET_CREATE = 'bucket_create'
+QUOTA_SET = 'quota_set'
+READ = 'read'
+
+WAIT = 'nese_rate_limit_wait_seconds'
+
+
+def acquire(endpoint, op_class, tokens=1) -> float:
+    """Take tokens from the bucket of op_class on endpoint.
+
+    Blocks until they are available, returns the seconds waited.
+    """
+    rate = float(settings.NESE_RATE_LIMITS.get(op_class, 0))
+    if rate <= 0:
+        return 0.0
+
+    capacity = max(float(tokens), rate * settings.NESE_RATE_LIMIT_BURST)
+    name = f"{endpoint}:{op_class}"
+    waited = 0.0
+
+    while True:
+        now = timezone.now()
+        bucket, created = RateLimitBucket.objects.get_or_create(
+            name=name,
+            defaults={'tokens': capacity, 'updated': now}
+        )
+
+        # Clocks of different hosts may disagree a little
+        elapsed = max(0.0, (now - bucket.updated).total_seconds())
+        available = min(capacity, bucket.tokens + elapsed * rate)
+
+        if available >= tokens:
+            taken = RateLimitBucket.objects.filter(
+                pk=bucket.pk,
+                tokens=bucket.tokens,
+                updated=bucket.updated
+            ).update(
+                tokens=available - tokens,
+                updated=max(now, bucket.updated)
+            )
+            if taken:
+                if waited:
+                    metrics.observe(WAIT, waited, op_class=op_class)
+                return waited
+            # Another worker got there first, go again shortly
+            delay = random.uniform(0, 0.05)
+        else:
+            delay = (tokens - available) / rate
+
+        time.sleep(delay)
+        waited += delay
+
+
+def limited(op_class):
+    """Decorator for utils functions taking a profile argument."""
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def inner_func(*args, **kwargs):
+            bound = signature.bind_partial(*args, **kwargs)
+            acquire(bound.arguments['profile']['endpoint'], op_class)
+            return func(*args, **kwargs)
+
+        return inner_func
+
+    return decorator
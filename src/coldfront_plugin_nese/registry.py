@@ -0,0 +1,120 @@
+import time
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Q
+
+from coldfront.core.allocation.models import (
+    AllocationAttributeType,
+    AllocationStatusChoice
+)
+from coldfront.core.resource.models import Resource
+
+from coldfront_plugin_nese import attributes
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Per process cache of the primary keys of the NESE allocation
+# attribute types, status choices and resources, so hot paths (the
+# signal handlers in particular) can compare ids instead of querying
+# by name. Warmed in AppConfig.ready and dropped whenever one of the
+# underlying rows changes in this process. Names without a row are
+# cached as misses too, so a missing attribute type costs nothing
+# until the cache is dropped. Rows created by another process
+# (register_nese_attributes, resources added elsewhere) fire no signal
+# here, the whole cache is reloaded once it is older than
+# NESE_REGISTRY_TTL seconds.
+#
+# The cache is a single dict swapped in and out as a whole, readers
+# take one reference to it and never see a half loaded or dropped one.
+
+_cache = None
+
+# Cached lookup of a name that has no row
+_MISSING = object()
+
+
+def attribute_type_pk(name):
+    return _lookup('attribute_types', name)
+
+
+def status_choice_pk(name):
+    return _lookup('status_choices', name)
+
+
+# A resource is a NESE resource if it carries the NESE endpoint
+# attribute. The description check covers resources created before
+# the attribute existed.
+def nese_resource_pks():
+    return _current()['resources']
+
+
+def warm():
+    try:
+        _load()
+    except DatabaseError:
+        # Tables not there yet (e.g. before migrate), load lazily
+        logger.debug("NESE registry not warmed, database not ready.")
+
+
+def invalidate(**kwargs):
+    global _cache
+    _cache = None
+
+# Cached lookup of a name that has no row
+_MISSING = object()
+
+
+def _lookup(kind, name):
+    pk = _current()[kind].get(name, _MISSING)
+    return None if pk is _MISSING else pk
+
+
+def _current() -> dict:
+    cache = _cache
+    if cache is None or \
+            time.monotonic() - cache['loaded'] > settings.NESE_REGISTRY_TTL:
+        cache = _load()
+    return cache
+
+
+def _load() -> dict:
+    global _cache
+
+    attribute_types = _with_misses(
+        AllocationAttributeType.objects,
+        attributes.ALLOCATION_TEXT_ATTRIBUTES +
+        attributes.ALLOCATION_INT_ATTRIBUTES
+    )
+    status_choices = _with_misses(
+        AllocationStatusChoice.objects,
+        attributes.ALLOCATION_STATUS_CHOICES
+    )
+
+    resources = frozenset(
+        Resource.objects.filter(
+            Q(description=attributes.RESOURCE_DESCRIPTION) |
+            Q(resourceattribute__resource_attribute_type__name=(
+                attributes.RESOURCE_ENDPOINT
+            ))
+        ).values_list('pk', flat=True).distinct()
+    )
+
+    cache = {
+        'attribute_types': attribute_types,
+        'status_choices': status_choices,
+        'resources': resources,
+        'loaded': time.monotonic()
+    }
+    _cache = cache
+    return cache
+
+
+# pk by name for every one of names, _MISSING for the ones without a row
+def _with_misses(manager, names) -> dict:
+    found = dict(
+        manager.filter(name__in=names).values_list('name', 'pk')
+    )
+    return {name: found.get(name, _MISSING) for name in names}
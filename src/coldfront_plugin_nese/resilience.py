@@ -0,0 +1,258 @@
+import inspect
+import random
+import socket
+import subprocess
+import threading
+import time
+from functools import wraps
+
+import botocore.exceptions
+import requests
+import urllib3
+from botocore.exceptions import ClientError
+from django.conf import settings
+from rgwadmin.exceptions import RGWAdminException
+
+from coldfront_plugin_nese import metrics
+from coldfront_plugin_nese.exceptions import EndpointUnavailable
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Retries and circuit breaking for remote calls.
+#
+# Every remote operation in utils.py goes through remote_call. Errors
+# that say the endpoint is unreachable or overloaded are retried with
+# jittered exponential backoff, anything else (bad request, access
+# denied, ...) is raised straight away. After NESE_BREAKER_THRESHOLD
+# consecutive retryable failures the endpoint's breaker opens and calls
+# fail at once with EndpointUnavailable instead of waiting on timeouts.
+# Once NESE_BREAKER_RESET seconds have passed a single probe call is let
+# through, its success closes the breaker again.
+#
+# Breakers live in the worker process, each worker finds out about a
+# dead endpoint on its own.
+
+RETRYABLE_S3_CODES = {
+    'InternalError',
+    'RequestTimeout',
+    'ServiceUnavailable',
+    'SlowDown',
+    'Throttling',
+    'ThrottlingException'
+}
+
+RETRYABLE_RGW_CODES = {
+    'ServerDown',
+    'ServiceUnavailable',
+    'SlowDown',
+    'InternalError'
+}
+
+# mc reports network problems in its output only
+RETRYABLE_MC_OUTPUT = (
+    'connection refused',
+    'connection reset',
+    'i/o timeout',
+    'no such host',
+    'server not initialized',
+    'service unavailable',
+    'timeout'
+)
+
+RETRYABLE_EXCEPTIONS = (
+    ConnectionError,
+    socket.timeout,
+    subprocess.TimeoutExpired,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    urllib3.exceptions.HTTPError,
+    botocore.exceptions.ConnectionError
+)
+
+
+def _causes(exc):
+    # Provisioning errors wrap the original error in args or chain it
+    seen = []
+    while exc is not None and len(seen) < 5 and exc not in seen:
+        seen.append(exc)
+        if exc.args and isinstance(exc.args[0], BaseException):
+            exc = exc.args[0]
+        else:
+            exc = exc.__cause__ or exc.__context__
+    return seen
+
+
+def is_retryable(exc) -> bool:
+    for e in _causes(exc):
+        if isinstance(e, EndpointUnavailable):
+            return False
+        if isinstance(e, RETRYABLE_EXCEPTIONS):
+            return True
+        if isinstance(e, ClientError):
+            code = e.response.get('Error', {}).get('Code')
+            status = e.response.get('ResponseMetadata', {}).get(
+                'HTTPStatusCode'
+            ) or 0
+            return code in RETRYABLE_S3_CODES or status >= 500
+        if isinstance(e, RGWAdminException):
+            return e.code in RETRYABLE_RGW_CODES
+        if isinstance(e, subprocess.CalledProcessError):
+            output = f"{e.stdout} {e.stderr}".lower()
+            return any(s in output for s in RETRYABLE_MC_OUTPUT)
+    return False
+
+
+def is_unavailable(exc) -> bool:
+    return any(isinstance(e, EndpointUnavailable) for e in _causes(exc))
+
+
+class CircuitBreaker:
+
+    def __init__(self, endpoint, threshold, reset_timeout):
+        self.endpoint = endpoint
+        self._threshold = threshold
+        self._reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        # Token of the call probing a half open breaker, None otherwise
+        self._probing = None
+
+    def before_call(self):
+        """Raise EndpointUnavailable if the call may not go ahead.
+
+        Returns a probe token when the call is the half open probe, pass
+        it to end_probe once the call is over.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return None
+            if time.monotonic() - self._opened_at < self._reset_timeout:
+                raise EndpointUnavailable(
+                    f"NESE endpoint {self.endpoint} is unavailable"
+                )
+            # Half open, one probe at a time
+            if self._probing is not None:
+                raise EndpointUnavailable(
+                    f"NESE endpoint {self.endpoint} is being probed"
+                )
+            self._probing = object()
+            return self._probing
+
+    def end_probe(self, token):
+        # A probe that neither succeeded nor failed (a nested breaker
+        # refused it, the worker was interrupted) frees the slot without
+        # changing the breaker state
+        with self._lock:
+            if token is not None and self._probing is token:
+                self._probing = None
+
+    def success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"NESE endpoint {self.endpoint} is back")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = None
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = None
+            if self._opened_at is not None or \
+                    self._failures >= self._threshold:
+                if self._opened_at is None:
+                    logger.warning(
+                        f"NESE endpoint {self.endpoint} unavailable after "
+                        f"{self._failures} failures, failing fast for "
+                        f"{self._reset_timeout}s"
+                    )
+                    metrics.inc(
+                        'nese_breaker_open_total',
+                        endpoint=self.endpoint
+                    )
+                self._opened_at = time.monotonic()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(endpoint) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                endpoint,
+                settings.NESE_BREAKER_THRESHOLD,
+                settings.NESE_BREAKER_RESET
+            )
+            _breakers[endpoint] = breaker
+        return breaker
+
+
+def backoff(attempt) -> float:
+    # Full jitter
+    ceiling = min(
+        settings.NESE_RETRY_MAX_BACKOFF,
+        settings.NESE_RETRY_BACKOFF * (2 ** attempt)
+    )
+    return random.uniform(0, ceiling)
+
+
+def call(profile, func, *args, **kwargs):
+    """Run func(*args, **kwargs) with retries and the endpoint breaker."""
+    breaker = get_breaker(profile['endpoint'])
+    attempts = max(1, settings.NESE_RETRY_ATTEMPTS)
+
+    for attempt in range(attempts):
+        probe = breaker.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except EndpointUnavailable:
+            # From a nested call, the breaker has seen it already
+            raise
+        except Exception as e:
+            if not is_retryable(e):
+                # The endpoint answered, it is up
+                breaker.success()
+                raise
+            breaker.failure()
+            if attempt + 1 >= attempts or breaker.is_open:
+                raise EndpointUnavailable(
+                    f"NESE endpoint {breaker.endpoint} did not respond: {e}"
+                ) from e
+            delay = backoff(attempt)
+            logger.debug(
+                f"Retrying {getattr(func, '__name__', func)} in "
+                f"{delay:.2f}s after: {e}"
+            )
+            metrics.inc(
+                'nese_remote_retries_total',
+                endpoint=breaker.endpoint
+            )
+            time.sleep(delay)
+        else:
+            breaker.success()
+            return result
+        finally:
+            breaker.end_probe(probe)
+
+
+def remote_call(func):
+    """Decorator for utils functions taking a profile argument."""
+    signature = inspect.signature(func)
+
+    @wraps(func)
+    def inner_func(*args, **kwargs):
+        bound = signature.bind_partial(*args, **kwargs)
+        return call(bound.arguments['profile'], func, *args, **kwargs)
+
+    return inner_func
@@ -1,16 +1,21 @@
 import os
 
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_save
 
-from coldfront.core.allocation.models import Allocation, AllocationAttribute, AllocationAttributeType
+from coldfront.core.allocation.models import (Allocation,
+                                              AllocationAttribute,
+                                              AllocationAttributeType,
+                                              AllocationStatusChoice)
+from coldfront.core.resource.models import Resource, ResourceAttribute
 from coldfront.core.allocation.signals import (allocation_activate,
                                                allocation_activate_user,
                                                allocation_disable,
                                                allocation_remove_user)
 
+from . import ledger, registry
 from .tasks import process_nese_allocation, process_nese_quota
-from .attributes import ALLOCATION_QUOTA
+from .attributes import ALLOCATION_QUOTA, RESOURCE_QUOTA
 
 
 @receiver(allocation_activate)
@@ -32,18 +37,81 @@ def allocation_disable_receiver(sender, **kwargs):
 @receiver(post_save, sender=AllocationAttribute)
 def UpdateAllocationQuota(sender, instance, created, **kwargs):
 
-    quota_type = AllocationAttributeType.objects.get(
-        name=ALLOCATION_QUOTA
+    if created:
+        return
+
+    quota_type_pk = registry.attribute_type_pk(ALLOCATION_QUOTA)
+
+    if instance.allocation_attribute_type_id == quota_type_pk:
+        process_nese_quota(instance.allocation_id)
+
+
+# Capacity admission. The quota change is committed to the ledger of
+# the allocation's NESE resources before the row is written, an
+# over-commit raises CapacityExceeded and the save does not happen
+# (shown as an error message in views, see middleware.py). Runs in the
+# same transaction as the row write, see ledger.install_atomic_save.
+@receiver(pre_save, sender=AllocationAttribute)
+def AdmitAllocationQuota(sender, instance, raw=False, **kwargs):
+
+    if raw:
+        return
+
+    quota_type_pk = registry.attribute_type_pk(ALLOCATION_QUOTA)
+    if instance.allocation_attribute_type_id != quota_type_pk:
+        return
+
+    old_value = None
+    if instance.pk is not None:
+        old_value = AllocationAttribute.objects.filter(
+            pk=instance.pk
+        ).values_list('value', flat=True).first()
+
+    delta = ledger.quota_bytes(instance.value) - ledger.quota_bytes(old_value)
+    if delta:
+        ledger.admit(
+            ledger.allocation_resources(instance.allocation_id),
+            delta
+        )
+
+
+@receiver(post_delete, sender=AllocationAttribute)
+def ReleaseAllocationQuota(sender, instance, **kwargs):
+
+    quota_type_pk = registry.attribute_type_pk(ALLOCATION_QUOTA)
+    if instance.allocation_attribute_type_id != quota_type_pk:
+        return
+
+    ledger.admit(
+        ledger.allocation_resources(instance.allocation_id),
+        -ledger.quota_bytes(instance.value)
     )
 
-    if instance.allocation_attribute_type == quota_type and not created:
-        process_nese_quota(instance.allocation.pk)
+
+@receiver(post_save, sender=ResourceAttribute)
+def UpdateResourceCapacity(sender, instance, raw=False, **kwargs):
+
+    if raw or instance.resource_id not in registry.nese_resource_pks():
+        return
+
+    if instance.resource_attribute_type.name == RESOURCE_QUOTA:
+        ledger.set_capacity(instance.resource_id, instance.value)
+
+
+# Keep the registry of NESE ids honest
+for _model in (AllocationAttributeType,
+               AllocationStatusChoice,
+               Resource,
+               ResourceAttribute):
+    post_save.connect(registry.invalidate, sender=_model)
+    post_delete.connect(registry.invalidate, sender=_model)
 
 
-# TODO: Refactor so that nese allocation is its own type and we can
-# detect based on resource type instead of relying
-# on naming/descriptions.
+# NESE allocations are the ones on a NESE resource, see
+# registry.nese_resource_pks. One indexed lookup on the
+# allocation/resource join table.
 def _is_nese_allocation(pk):
-    allocation = Allocation.objects.get(pk=pk)
-    desc_arry = [r.description for r in allocation.resources.all()]
-    return 'NESE S3 Allocation' in desc_arry
+    return Allocation.objects.filter(
+        pk=pk,
+        resources__pk__in=registry.nese_resource_pks()
+    ).exists()
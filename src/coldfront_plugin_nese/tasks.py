@@ -1,43 +1,125 @@
 from django.conf import settings
-from django_q.tasks import AsyncTask, Chain, fetch_group, delete_group
+from django_q.tasks import (
+    AsyncTask,
+    Chain,
+    async_task,
+    delete_group,
+    schedule
+)
 from django_q.humanhash import uuid
+from django_q.models import Schedule
 from coldfront.core.allocation.models import (
     Allocation,
-    AllocationAttribute,
-    AllocationAttributeType,
-    AllocationStatusChoice
+    AllocationAttribute
 )
 from coldfront.core.utils.mail import send_email_template
 from coldfront.config.email import EMAIL_TICKET_SYSTEM_ADDRESS, EMAIL_SENDER
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
-from django.db import transaction
+from django.db import connections, transaction
+from django.db.models import OuterRef, Q, Subquery
 from django.urls import reverse
-from coldfront_plugin_nese import attributes, utils
+from django.utils import timezone
+from coldfront_plugin_nese import (aio, attributes, backends, bucketstate,
+                                   endpoints, journal, leases, ledger,
+                                   metrics, registry, resilience)
+from coldfront_plugin_nese.backends import get_backend
+from coldfront_plugin_nese.clients import endpoint_slot
+from coldfront_plugin_nese.utils import in_thread
+from coldfront_plugin_nese.exceptions import (CapacityExceeded,
+                                              EndpointUnavailable,
+                                              NESEProvisioningError)
+from coldfront_plugin_nese.leases import allocation_lease
+from coldfront_plugin_nese.models import ProvisioningHandoff, SweepState
+from coldfront_plugin_nese.quota import STATE_HASH_TAG, equal, state_hash
+
+import datetime
+import time
 
 import logging
 
-ENDPOINT_TYPE_LIST = ['rgw', 'minio']
 
-logger = logging.getLogger(__name__)
+# Queries issued by _get_nese_quota_rows no matter how many
+# allocations there are. Meant for assertNumQueries in tests.
+SWEEP_PREFETCH_QUERY_COUNT = 1
+SWEEP_PREFETCH_CHUNK_SIZE = 2000
+
+# Attributes whose changes make an allocation eligible for an
+# incremental sweep
+SWEEP_WATCHED_ATTRIBUTES = [
+    attributes.ALLOCATION_BUCKETNAME,
+    attributes.ALLOCATION_QUOTA
+]
+
+# Overlap with the previous run so that changes committed while it
+# was running are not missed
+SWEEP_WATERMARK_OVERLAP = datetime.timedelta(minutes=1)
+
+# Handoff steps of the allocation chain. The queued marker is written
+# when the chain is started and only used to time queue waits.
+CHAIN_QUEUED_STEP = 'queued'
+CHAIN_RESULT_STEPS = ('nese_user', 'nese_bucket')
 
+logger = logging.getLogger(__name__)
 
 # Decorator to prevent task races
-# select_for_update is the magic
+# Holds the allocation lease (see leases.py) for the duration of the
+# step. No transaction is held open, steps keep their own database
+# writes short and atomic.
 def allocation_step(func):
     @wraps(func)
     def inner_func(*args, **kwargs):
-        allocations = Allocation.objects.select_for_update().filter(
-            pk=kwargs['allocation_pk']
-        )
-        with transaction.atomic():
-            allocations.get()
+        with allocation_lease(kwargs['allocation_pk']):
             return func(*args, **kwargs)
 
     return inner_func
 
 
+# Decorator recording the outcome of a provisioning chain step as a
+# ProvisioningHandoff for the chain group (resgroup kwarg), so the next
+# step can pick it up directly.
+def handoff_step(step):
+    def decorator(func):
+        func_name = f"{func.__module__}.{func.__name__}"
+
+        @wraps(func)
+        def inner_func(*args, **kwargs):
+            group = kwargs['resgroup']
+            _observe_queue_wait(group, step)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                _record_handoff(
+                    group,
+                    step,
+                    func_name,
+                    False,
+                    _failure_result(e)
+                )
+                raise
+            _record_handoff(group, step, func_name, True, result)
+            return result
+
+        return inner_func
+
+    return decorator
+
+
+# Quota changes are coalesced per allocation. With a debounce window
+# (NESE_QUOTA_DEBOUNCE seconds) the quota task is scheduled to run
+# once at the end of the window and further changes inside the window
+# find it pending and do nothing. The task reads the latest quota when
+# it runs, so only one remote write goes out per window. The pending
+# marker is the django-q schedule itself, which the scheduler deletes
+# when it hands the task to the cluster, so a change arriving after
+# that starts a new window.
 def process_nese_quota(allocation_pk):
-    profile = _get_profile()
+    window = settings.NESE_QUOTA_DEBOUNCE
+    if window > 0:
+        _schedule_nese_quota(allocation_pk, window)
+        return
+
+    profile = endpoints.profile_for_allocation(allocation_pk)
     t = AsyncTask(
         'coldfront_plugin_nese.tasks.provision_nese_quota',
         profile,
@@ -47,54 +129,288 @@ def process_nese_quota(allocation_pk):
     t.run()
 
 
+# Schedule names are not unique in django-q. Concurrent changes to one
+# allocation are serialized on the allocation row, so only one of them
+# finds no pending schedule and creates it.
+def _schedule_nese_quota(allocation_pk, window):
+    name = f"nese_quota_{allocation_pk}"
+    with transaction.atomic():
+        Allocation.objects.select_for_update().only('pk').get(
+            pk=allocation_pk
+        )
+        if Schedule.objects.filter(name=name).exists():
+            logger.debug(
+                f"Quota update for allocation {allocation_pk} "
+                "already pending."
+            )
+            return
+
+        schedule(
+            'coldfront_plugin_nese.tasks.provision_nese_quota',
+            endpoints.profile_for_allocation(allocation_pk),
+            name=name,
+            hook='coldfront_plugin_nese.tasks._provision_nese_quota_hook',
+            schedule_type=Schedule.ONCE,
+            repeats=-1,
+            next_run=timezone.now() + datetime.timedelta(seconds=window),
+            allocation_pk=allocation_pk
+        )
+
+
 # Run periodically to make sure allocation quota value
 # matches the value set on the bucket.
-def process_nese_quota_sweep():
+#
+# Incremental runs only look at allocations whose NESE attributes
+# changed since the last run plus the ones left drifted by it. A full
+# run over every allocation happens when full=True or once
+# NESE_SWEEP_FULL_INTERVAL seconds have passed since the last one.
+#
+# Each endpoint is swept on its own thread. With workers == 0 each
+# drifted allocation gets its own queued quota task. With workers > 0
+# drifted buckets are fixed inline on a thread pool, at most
+# NESE_ENDPOINT_CONCURRENCY at a time per endpoint. Returns a summary
+# of the run.
+@metrics.timed(metrics.TASK, task='process_nese_quota_sweep')
+def process_nese_quota_sweep(workers=None, full=None):
+
+    if workers is None:
+        workers = settings.NESE_SWEEP_WORKERS
+
+    started = timezone.now()
+    state, _ = SweepState.objects.get_or_create(name='quota')
+
+    if full is None:
+        full_interval = datetime.timedelta(
+            seconds=settings.NESE_SWEEP_FULL_INTERVAL
+        )
+        full = (
+            state.watermark is None or
+            state.last_full_sweep is None or
+            started - state.last_full_sweep >= full_interval
+        )
 
-    profile = _get_profile()
-    for alloc in Allocation.objects.all():
+    alloc_pks = None
+    if not full:
+        alloc_pks = set(state.drifted) | set(
+            AllocationAttribute.objects.filter(
+                allocation_attribute_type__name__in=SWEEP_WATCHED_ATTRIBUTES,
+                modified__gt=state.watermark - SWEEP_WATERMARK_OVERLAP
+            ).values_list('allocation_id', flat=True)
+        )
 
-        # Get the allocation quota attribute
-        quota_attr = alloc.get_attribute(attributes.ALLOCATION_QUOTA)
-        allocation_quota = quota_attr.value
+    summary = {
+        'full': full,
+        'checked': 0,
+        'drifted': 0,
+        'queued': 0,
+        'fixed': 0,
+        'failed': 0,
+        'failed_endpoints': []
+    }
 
-        # Get the allocation bucket name
-        bucket_attr = alloc.get_attribute(attributes.ALLOCATION_BUCKETNAME)
-        bucket_name = bucket_attr.value
+    profiles = endpoints.get_profiles()
 
-        # Get the bucket quota from object store
-        bucket_quota = utils.get_bucket_quota(bucket_name, profile)
+    def sweep(name):
+        try:
+            return _sweep_endpoint(profiles[name], alloc_pks, workers)
+        except Exception:
+            logger.exception(f"NESE quota sweep of endpoint {name} failed")
+            return None
+
+    if len(profiles) == 1:
+        results = [sweep(name) for name in profiles]
+    else:
+        with ThreadPoolExecutor(len(profiles)) as pool:
+            results = list(pool.map(in_thread(sweep), profiles))
+
+    # Allocations still drifted after this run, rechecked next time
+    unresolved = []
+    for name, result in zip(profiles, results):
+        if result is None:
+            summary['failed_endpoints'].append(name)
+            continue
+        endpoint_summary, endpoint_unresolved = result
+        for k, v in endpoint_summary.items():
+            summary[k] += v
+        unresolved.extend(endpoint_unresolved)
+
+    # An endpoint that could not be swept keeps the old watermark, so
+    # its changes are picked up by the next run
+    if summary['failed_endpoints']:
+        state.drifted = sorted(set(state.drifted) | set(unresolved))
+    else:
+        state.watermark = started
+        state.drifted = unresolved
+        if full:
+            state.last_full_sweep = started
+    state.save()
+
+    logger.info(f"NESE quota sweep finished: {summary}")
+    for result in ('checked', 'drifted', 'queued', 'fixed', 'failed'):
+        metrics.inc(
+            'nese_sweep_buckets_total',
+            amount=summary[result],
+            result=result
+        )
+    return summary
+
+
+# Sweep of the allocations on one endpoint, all of them when alloc_pks
+# is None. Returns the counts for the summary and the allocations
+# left drifted.
+def _sweep_endpoint(profile, alloc_pks, workers):
+    counts = {
+        'checked': 0,
+        'drifted': 0,
+        'queued': 0,
+        'fixed': 0,
+        'failed': 0
+    }
+
+    if alloc_pks is None:
+        rows = _get_nese_quota_rows(endpoint=profile['name'])
+        # Bucket state for the whole endpoint, fetched in bulk
+        snapshot = get_backend(profile).get_bucket_snapshot()
+        bucketstate.refresh(profile, snapshot)
+    else:
+        rows = list(_get_nese_quota_rows(alloc_pks, endpoint=profile['name']))
+        # Cached bucket state, the endpoint is only asked about stale
+        # entries. Full runs catch changes made behind our back.
+        snapshot = bucketstate.get_snapshot(
+            get_backend(profile),
+            [r[1] for r in rows]
+        ) if rows else {}
+
+    drifted = []
+    for alloc_pk, bucket_name, allocation_quota in rows:
+
+        # Nothing to enforce yet
+        if allocation_quota is None:
+            continue
+
+        # Not provisioned yet, the allocation chain owns this one
+        bucket_state = snapshot.get(bucket_name)
+        if bucket_state is None:
+            logger.debug(f"Bucket {bucket_name} not found, skipping.")
+            continue
+
+        counts['checked'] += 1
+        bucket_quota = bucket_state['quota']
 
         # Compare quota set in the store with what allocation
-        # expects. If different, fix.
-        if bucket_quota != allocation_quota:
+        # expects, normalized to bytes. If different, fix.
+        if not equal(bucket_quota, allocation_quota):
             logger.info(
                 f"Adjusting quota for bucket {bucket_name} "
                 f"from {bucket_quota} to value specified "
                 f"in allocation, {allocation_quota}"
             )
-            process_nese_quota(alloc.pk) 
+            drifted.append(alloc_pk)
+
+    counts['drifted'] = len(drifted)
+
+    unresolved = []
+    if workers <= 0:
+        for alloc_pk in drifted:
+            process_nese_quota(alloc_pk)
+        counts['queued'] = len(drifted)
+        unresolved = drifted
+    else:
+        with ThreadPoolExecutor(workers) as pool:
+            fixed = pool.map(
+                lambda pk: _reconcile_quota(pk, profile),
+                drifted
+            )
+            for alloc_pk, ok in zip(drifted, fixed):
+                counts['fixed' if ok else 'failed'] += 1
+                if not ok:
+                    unresolved.append(alloc_pk)
+
+    return counts, unresolved
+
+
+def _reconcile_quota(allocation_pk, profile):
+    try:
+        with endpoint_slot(profile['endpoint']):
+            provision_nese_quota(profile, allocation_pk=allocation_pk)
+        return True
+    except Exception:
+        logger.exception(
+            f"Quota reconciliation failed for allocation {allocation_pk}"
+        )
+        return False
+    finally:
+        # Worker threads get their own DB connections, don't leak them
+        connections.close_all()
 
 
-def process_nese_allocation(allocation_pk=None):
+# With batch_size > 0 (NESE_PROVISION_BATCH_SIZE by default) a
+# backfill queues one provision_nese_allocation_batch task per chunk of
+# allocations instead of a three step chain per allocation.
+@metrics.timed(metrics.TASK, task='process_nese_allocation')
+def process_nese_allocation(allocation_pk=None, batch_size=None):
 
-    alloc_pk_iter = None
     # Short circuit - if pk is passed, just process that
     if allocation_pk is not None:
-        alloc_pk_iter = [allocation_pk]
-    else:
-        # Find allocations with buckets spec'd but no keys
-        #
-        # Create "bucket set" of allocations with bucketnames
-        # Create "key set" of allocations with secret keys
-        # Subtract key set from bucket set == pks of allocs with
-        # buckets defined but no keys
-        attr_pk_list_buckets = _get_alloc_pks(attributes.ALLOCATION_BUCKETNAME)
-        attr_pk_list_secrets = _get_alloc_pks(attributes.ALLOCATION_SECRET_KEY)
-        alloc_pk_iter = set(attr_pk_list_buckets) - set(attr_pk_list_secrets)
+        start_allocation_task(allocation_pk)
+        return
+
+    alloc_pk_iter = _get_unprovisioned_pks()
+
+    if batch_size is None:
+        batch_size = settings.NESE_PROVISION_BATCH_SIZE
+
+    if batch_size <= 0:
+        for pk in alloc_pk_iter:
+            start_allocation_task(pk)
+        return
+
+    alloc_pks = sorted(alloc_pk_iter)
+    quantities = dict(
+        Allocation.objects.filter(pk__in=alloc_pks).values_list(
+            'pk',
+            'quantity'
+        )
+    )
+    quotas = {
+        pk: quota or quantities.get(pk)
+        for pk, _, quota in _get_nese_quota_rows(alloc_pks)
+    }
+
+    placed = endpoints.place_many(quotas)
+    unplaced = sorted(pk for pk in quotas if pk not in placed)
+    for allocation in Allocation.objects.filter(pk__in=unplaced):
+        _reject_allocation(
+            allocation,
+            f"No NESE endpoint has room for allocation {allocation.pk}",
+            func='coldfront_plugin_nese.tasks.process_nese_allocation'
+        )
+
+    # Every chunk goes to one endpoint, endpoints run in parallel
+    by_endpoint = {}
+    for pk, name in sorted(placed.items()):
+        by_endpoint.setdefault(name, []).append(pk)
+
+    for name, pks in by_endpoint.items():
+        profile = endpoints.get_profile(name)
+        for i in range(0, len(pks), batch_size):
+            async_task(
+                'coldfront_plugin_nese.tasks.provision_nese_allocation_batch',
+                pks[i:i + batch_size],
+                profile
+            )
 
-    for pk in alloc_pk_iter:
-        start_allocation_task(pk)
+
+# Find allocations with buckets spec'd but no keys
+#
+# Create "bucket set" of allocations with bucketnames
+# Create "key set" of allocations with secret keys
+# Subtract key set from bucket set == pks of allocs with
+# buckets defined but no keys
+def _get_unprovisioned_pks():
+    attr_pk_list_buckets = _get_alloc_pks(attributes.ALLOCATION_BUCKETNAME)
+    attr_pk_list_secrets = _get_alloc_pks(attributes.ALLOCATION_SECRET_KEY)
+    return set(attr_pk_list_buckets) - set(attr_pk_list_secrets)
 
 
 def start_allocation_task(allocation_pk):
@@ -110,21 +426,33 @@ def start_allocation_task(allocation_pk):
     )
 
     # TODO: If not set use default quantity specification
-    bucket_quota = (
-        allocation.get_attribute(attributes.ALLOCATION_QUOTA)
-        or
-        allocation.quantity
-    )
+    quota_attr = allocation.get_attribute(attributes.ALLOCATION_QUOTA)
+    bucket_quota = quota_attr or allocation.quantity
+
+    # A new quota is reserved on the ledger before anything is created
+    # remotely. update_nese_allocation turns the reservation into the
+    # quota attribute, or hands it back if provisioning failed.
+    reserved = 0
+    if quota_attr is None:
+        reserved = ledger.quota_bytes(bucket_quota)
+        try:
+            ledger.admit(ledger.allocation_resources(allocation_pk), reserved)
+        except CapacityExceeded as e:
+            _reject_allocation(allocation, e)
+            return
 
     bucket_user = f"{bucket_name}_datamanager"
-    profile = {
-        'endpoint': settings.NESE_ENDPOINT,
-        'endpoint_type': settings.NESE_ENDPOINT_TYPE,
-        'access_key': settings.NESE_ENDPOINT_ACCESS_KEY,
-        'secret_key': settings.NESE_ENDPOINT_SECRET_KEY,
-        'scheme': settings.NESE_ENDPOINT_SCHEME,
-        'uid': settings.NESE_ENDPOINT_UID
-    }
+    # New buckets are placed on the endpoint with the most room
+    try:
+        profile = endpoints.profile_for_allocation(
+            allocation_pk,
+            quota=bucket_quota,
+            place=True
+        )
+    except NESEProvisioningError as e:
+        _release_reservation(allocation_pk, reserved)
+        _reject_allocation(allocation, e)
+        return
 
     group = uuid()[0]
     alloc_chain = Chain(group=group)
@@ -133,6 +461,7 @@ def start_allocation_task(allocation_pk):
         'coldfront_plugin_nese.tasks.provision_nese_user',
         bucket_user,
         profile=profile,
+        resgroup=group,
         allocation_pk=allocation_pk
     )
 
@@ -149,19 +478,44 @@ def start_allocation_task(allocation_pk):
         'coldfront_plugin_nese.tasks.update_nese_allocation',
         resgroup=group,
         allocation_pk=allocation_pk,
+        reserved=reserved,
         hook=cleanup
     )
 
-    alloc_chain.run()
+    try:
+        _record_handoff(
+            group,
+            CHAIN_QUEUED_STEP,
+            'coldfront_plugin_nese.tasks.start_allocation_task',
+            True,
+            None
+        )
+        alloc_chain.run()
+    except Exception:
+        _release_reservation(allocation_pk, reserved)
+        raise
 
 
 def cleanup(task):
+    # update_nese_allocation raised (e.g. it never got the lease), so it
+    # neither reported the failure nor handed the reservation back
+    if not task.success:
+        allocation_pk = task.kwargs['allocation_pk']
+        _release_reservation(allocation_pk, task.kwargs.get('reserved', 0))
+        _reject_allocation(
+            Allocation.objects.get(pk=allocation_pk),
+            task.result,
+            func=task.func
+        )
+
+    ProvisioningHandoff.objects.filter(group=task.group).delete()
     delete_group(task.group)
 
 
 # Individual Task Steps - Expeceted to be Idempotent
 # Note: Allocation step decorator synchronizes. Uses
 # allocaion_pk from function arguments
+@metrics.timed(metrics.TASK, task='provision_nese_quota')
 @allocation_step
 def provision_nese_quota(
         profile,
@@ -171,17 +525,70 @@ def provision_nese_quota(
     allocation_quota = alloc.get_attribute(attributes.ALLOCATION_QUOTA)
     bucket_name = alloc.get_attribute(attributes.ALLOCATION_BUCKETNAME)
 
-    if profile['endpoint_type'] != 'minio':
-        utils.set_bucket_quota(bucket_name, allocation_quota, profile)
+    tags = {
+        'rsrc': alloc.get_parent_resource.name,
+        'pi': alloc.project.pi,
+        'projname': alloc.project.title
+    }
+    tags[STATE_HASH_TAG] = state_hash(allocation_quota, tags)
+
+    # Re-saving an unchanged allocation must not touch the endpoint
+    cached = bucketstate.fresh(profile, [bucket_name]).get(bucket_name)
+    if cached is not None and cached.state_hash == tags[STATE_HASH_TAG]:
+        logger.debug(f"Bucket {bucket_name} quota already up to date.")
+        return
+
+    backend = get_backend(profile)
+    bucket_state = backend.get_bucket_state(bucket_name)
+    if bucket_state is not None and backend.in_sync(
+            bucket_state,
+            allocation_quota,
+            tags[STATE_HASH_TAG]):
+        logger.debug(f"Bucket {bucket_name} quota already up to date.")
     else:
-        tags = {
-            'quota': allocation_quota,
-            'rsrc': alloc.get_parent_resource.name,
-            'pi': alloc.project.pi,
-            'projname': alloc.project.title
-        }
+        try:
+            backend.set_bucket_quota(
+                bucket_name,
+                allocation_quota,
+                tags=tags
+            )
+        except Exception as e:
+            bucketstate.record_errors(profile, {bucket_name: e})
+            raise
+        _journal_quotas([(bucket_name, allocation_quota)])
 
-        utils.set_bucket_tags_minio(bucket_name, tags, profile)
+    bucketstate.record(
+        bucket_name,
+        profile,
+        quota=allocation_quota,
+        state_hash=tags[STATE_HASH_TAG]
+    )
+
+
+# BucketState fields for a freshly provisioned bucket
+def _provisioned_state(backend, bucket_name, uid, quota):
+    return {
+        'owner_uid': uid,
+        'quota': quota,
+        'policy_hash': bucketstate.document_hash(
+            backend.policy_document(bucket_name, uid)
+        ),
+        'cors_hash': bucketstate.document_hash(
+            backend.cors_document(bucket_name)
+        )
+    }
+
+
+# Quota changes go to the local journal so the filesystem layer picks
+# them up without a full scan. The bucket itself is already updated, a
+# missed journal entry is caught by the next reconcile_nese_quota run.
+def _journal_quotas(entries):
+    if not journal.enabled():
+        return
+    try:
+        journal.append_many(entries)
+    except OSError:
+        logger.exception(f"Could not journal quota changes {entries}")
 
 
 def _provision_nese_quota_hook(task):
@@ -206,6 +613,12 @@ def _provision_nese_quota_hook(task):
         'bucket_name': bucket_name
     }
 
+    # Endpoint outages are not reported, the update is retried once
+    # the breaker lets calls through again
+    if not task.success and _is_unavailable_result(task.result):
+        _schedule_nese_quota(allocation_pk, settings.NESE_BREAKER_RESET)
+        return
+
     # comment
     if not task.success:
         send_email_template(
@@ -217,21 +630,20 @@ def _provision_nese_quota_hook(task):
         )
 
 
+@metrics.timed(metrics.TASK, task='provision_nese_user')
+@handoff_step('nese_user')
 @allocation_step
 def provision_nese_user(
         username: str,
         profile: dict = None,
+        resgroup: str = None,
         allocation_pk: str = None) -> dict:
 
     logger.debug("Processing nese bucket user provisioning.")
     # Throws if bad profile
     _check_profile(profile)
 
-    etype = profile['endpoint_type']
-    if etype == 'rgw':
-        uinfo = utils.create_user_rgw(username, profile)
-    elif etype == 'minio':
-        uinfo = utils.create_user_minio(username, profile)
+    uinfo = get_backend(profile).create_user(username)
     logger.debug("Processing nese bucket user provisioning - COMPLETED.")
     result = {
         'type': 'nese_user',
@@ -243,6 +655,8 @@ def provision_nese_user(
     return result
 
 
+@metrics.timed(metrics.TASK, task='provision_nese_bucket')
+@handoff_step('nese_bucket')
 @allocation_step
 def provision_nese_bucket(
         bucket_name: str,
@@ -255,46 +669,43 @@ def provision_nese_bucket(
     # Sanity check on endpoint type. Throws if problems.
     _check_profile(profile)
 
-    user_tasks = fetch_group(resgroup, wait=5000)
-
-    if user_tasks is None:
-        raise RuntimeError("Create user task not found.")
-
-    create_user_result = None
-    # Should only be one result
-    for t in user_tasks:
-        if not t.success:
-            raise RuntimeError(
-                f"Cannot create bucket {bucket_name}. "
-                "Depends on failed create user task."
-            )
+    # The user step has finished (chain order) and recorded its result
+    user_step = ProvisioningHandoff.objects.filter(
+        group=resgroup,
+        step='nese_user'
+    ).first()
 
-        if t.result.get('type', None) == 'nese_user':
-            create_user_result = t.result
-            break
-
-    if create_user_result is None:
+    if user_step is None:
         raise RuntimeError(
             f"Cannot create bucket {bucket_name}. "
             "Depends on missing create user task result."
         )
 
-    utils.create_bucket(bucket_name, profile)
+    if not user_step.success:
+        raise RuntimeError(
+            f"Cannot create bucket {bucket_name}. "
+            "Depends on failed create user task."
+        )
 
-    # Minio does not support CORS policy. CORS is on
-    # by default for all buckets and HTTP verbs
-    etype = profile['endpoint_type']
-    if etype == 'rgw':
-        utils.apply_policy_rgw(bucket_name, create_user_result['uid'], profile)
-        utils.apply_cors(bucket_name, profile)
-    elif etype == 'minio':
-        utils.apply_policy_minio(
+    create_user_result = user_step.result
+
+    backend = get_backend(profile)
+    try:
+        backend.provision_bucket(
             bucket_name,
             create_user_result['uid'],
-            profile
+            quota
         )
-
-    utils.set_bucket_quota(bucket_name, quota, profile)
+    except Exception as e:
+        bucketstate.record_errors(profile, {bucket_name: e})
+        raise
+    _journal_quotas([(bucket_name, quota)])
+    bucketstate.record(
+        bucket_name,
+        profile,
+        **_provisioned_state(backend, bucket_name, create_user_result['uid'],
+                             quota)
+    )
 
     result = {
         'type': 'nese_bucket',
@@ -305,16 +716,46 @@ def provision_nese_bucket(
     return result
 
 
+@metrics.timed(metrics.TASK, task='update_nese_allocation')
 @allocation_step
 def update_nese_allocation(
         allocation_pk: str = None,
-        resgroup: str = None) -> dict:
+        resgroup: str = None,
+        reserved: int = 0) -> dict:
+
+    _observe_queue_wait(resgroup, 'update_allocation')
 
     allocation = Allocation.objects.get(pk=allocation_pk)
-    alloc_tasks = fetch_group(resgroup, count=2, wait=5000)
+    alloc_tasks = list(ProvisioningHandoff.objects.filter(
+        group=resgroup,
+        step__in=CHAIN_RESULT_STEPS
+    ))
     failed = [f for f in alloc_tasks if not f.success]
     retval = ""
 
+    # The endpoint was down, try the whole chain again once it is
+    # back instead of reporting an error. Steps are idempotent.
+    if any(_is_unavailable_result(f.result) for f in failed):
+        # Reserved again when the chain restarts
+        _release_reservation(allocation_pk, reserved)
+        _schedule_allocation_retry(allocation_pk)
+        return (
+            f"NESE endpoint unavailable, provisioning of "
+            f"{allocation.description} rescheduled."
+        )
+
+    # A step that never recorded anything counts as failed too
+    recorded = {t.step for t in alloc_tasks}
+    for step in CHAIN_RESULT_STEPS:
+        if step not in recorded:
+            failed.append(ProvisioningHandoff(
+                group=resgroup,
+                step=step,
+                func=step,
+                success=False,
+                result="No result recorded for step."
+            ))
+
     # If any of the provisioning tasks failed, set the allocation status
     # to Provisioning Error and send email to ticket system
     # to have them fix the issue
@@ -323,27 +764,13 @@ def update_nese_allocation(
         for f in failed:
             print(f"FAILINFO (task={f.func}): {f.result}")
 
-        allocation_path = reverse('allocation-detail', args=[allocation_pk])
-        allocation_url = f"{settings.CENTER_BASE_URL}/{allocation_path}"
-
-        ctx = {
-            'allocation': allocation,
-            'allocation_url': allocation_url,
-            'failed_tasks': failed
-        }
+        _release_reservation(allocation_pk, reserved)
 
-        provisioning_error_status = AllocationStatusChoice.objects.get(
-            name=attributes.ALLOCATION_STATUS_PROVISIONING_ERROR
+        allocation.status_id = registry.status_choice_pk(
+            attributes.ALLOCATION_STATUS_PROVISIONING_ERROR
         )
-        allocation.status = provisioning_error_status
         allocation.save()
-        send_email_template(
-            "NESE Bucket provisioning failed.",
-            "coldfront_plugin_nese/bucket_provision_failed.html",
-            ctx,
-            EMAIL_SENDER,
-            [EMAIL_TICKET_SYSTEM_ADDRESS, ]
-        )
+        _send_provisioning_failure(allocation, failed)
         retval = f"NESE Bucket allocation for {allocation.description} failed."
     else:
         all_result_values = {}
@@ -357,15 +784,35 @@ def update_nese_allocation(
             attributes.ALLOCATION_QUOTA: all_result_values['bucket_quota'],
         }
 
-        for attr_type_name, attr_val in allocation_attributes.items():
-            attr_type = AllocationAttributeType.objects.get(
-                name=attr_type_name
-            )
-            AllocationAttribute.objects.get_or_create(
-                allocation_attribute_type=attr_type,
-                allocation=allocation,
-                value=attr_val
-            )
+        quota_type_pk = registry.attribute_type_pk(attributes.ALLOCATION_QUOTA)
+        with transaction.atomic():
+            if reserved:
+                # The reservation is the quota's ledger entry, bulk_create
+                # skips the signal that would commit it a second time.
+                # Someone else wrote a quota meanwhile, theirs counts.
+                quota = allocation_attributes.pop(attributes.ALLOCATION_QUOTA)
+                if AllocationAttribute.objects.filter(
+                    allocation=allocation,
+                    allocation_attribute_type_id=quota_type_pk
+                ).exists():
+                    _release_reservation(allocation_pk, reserved)
+                else:
+                    AllocationAttribute.objects.bulk_create([
+                        AllocationAttribute(
+                            allocation=allocation,
+                            allocation_attribute_type_id=quota_type_pk,
+                            value=quota
+                        )
+                    ])
+
+            for attr_type_name, attr_val in allocation_attributes.items():
+                AllocationAttribute.objects.get_or_create(
+                    allocation_attribute_type_id=registry.attribute_type_pk(
+                        attr_type_name
+                    ),
+                    allocation=allocation,
+                    value=attr_val
+                )
 
         retval = (
             "NESE Bucket allocation for "
@@ -375,40 +822,348 @@ def update_nese_allocation(
     return retval
 
 
+# Provision a chunk of allocations in one task. Remote calls for the
+# allocations in the chunk run concurrently on the asyncio engine
+# (NESE_PROVISION_WORKERS at a time), results are written back with
+# bulk ORM operations.
+@metrics.timed(metrics.TASK, task='provision_nese_allocation_batch')
+def provision_nese_allocation_batch(alloc_pks, profile) -> dict:
+
+    _check_profile(profile)
+
+    quantities = dict(
+        Allocation.objects.filter(pk__in=alloc_pks).values_list(
+            'pk',
+            'quantity'
+        )
+    )
+
+    failed = {}
+    leased = {}
+    work = []
+    uncommitted = set()
+    try:
+        for pk, bucket_name, quota in _get_nese_quota_rows(alloc_pks):
+            # Busy allocations are being handled elsewhere, the next
+            # backfill picks them up if that does not finish the job
+            try:
+                leased[pk] = leases.acquire(pk, wait=0)
+            except NESEProvisioningError:
+                logger.debug(f"Allocation {pk} is busy, skipping.")
+                continue
+            if quota is None:
+                uncommitted.add(pk)
+            work.append((pk, bucket_name, quota or quantities.get(pk)))
+
+        # The quota attributes are bulk created below, which bypasses the
+        # ledger signals. New quotas are committed here instead, before
+        # any remote work, and handed back if they are not written.
+        resources = ledger.resources_by_allocation(uncommitted)
+        admitted = {}
+        for pk, bucket_name, quota in work:
+            if pk not in uncommitted:
+                continue
+            try:
+                ledger.admit(resources.get(pk, []), ledger.quota_bytes(quota))
+            except CapacityExceeded as e:
+                logger.error(f"Not provisioning allocation {pk}: {e}")
+                failed[pk] = e
+            else:
+                admitted[pk] = ledger.quota_bytes(quota)
+        work = [entry for entry in work if entry[0] not in failed]
+
+        # Leases are held until the results are written back, a long
+        # batch renews them as buckets finish
+        results = aio.run_provisioning(
+            work,
+            profile,
+            on_done=_lease_keeper(leased)
+        )
+
+        backend = get_backend(profile)
+        succeeded = {}
+        journaled = []
+        provisioned = {}
+        bucket_errors = {}
+        for alloc_pk, bucket_name, quota in work:
+            uinfo = results[alloc_pk]
+            if isinstance(uinfo, Exception):
+                logger.error(
+                    f"Provisioning failed for allocation {alloc_pk}: {uinfo}"
+                )
+                bucket_errors[bucket_name] = uinfo
+                # Left unprovisioned for the next backfill
+                if resilience.is_unavailable(uinfo):
+                    continue
+                failed[alloc_pk] = uinfo
+                continue
+
+            succeeded[alloc_pk] = {
+                attributes.ALLOCATION_ACCESS_KEY: uinfo['access_key'],
+                attributes.ALLOCATION_SECRET_KEY: uinfo['secret_key'],
+                attributes.ALLOCATION_QUOTA: quota
+            }
+            journaled.append((bucket_name, quota))
+            provisioned[bucket_name] = _provisioned_state(
+                backend,
+                bucket_name,
+                uinfo['uid'],
+                quota
+            )
+
+        _journal_quotas(journaled)
+        bucketstate.record_many(profile, provisioned)
+        bucketstate.record_errors(profile, bucket_errors)
+
+        with transaction.atomic():
+            # Only fill in attributes the allocations do not have yet
+            existing = set(
+                AllocationAttribute.objects.filter(
+                    allocation_id__in=succeeded.keys(),
+                    allocation_attribute_type__name__in=[
+                        attributes.ALLOCATION_ACCESS_KEY,
+                        attributes.ALLOCATION_SECRET_KEY,
+                        attributes.ALLOCATION_QUOTA
+                    ]
+                ).values_list(
+                    'allocation_id',
+                    'allocation_attribute_type__name'
+                )
+            )
+            AllocationAttribute.objects.bulk_create([
+                AllocationAttribute(
+                    allocation_id=alloc_pk,
+                    allocation_attribute_type_id=registry.attribute_type_pk(
+                        attr_type_name
+                    ),
+                    value=attr_val
+                )
+                for alloc_pk, vals in succeeded.items()
+                for attr_type_name, attr_val in vals.items()
+                if (alloc_pk, attr_type_name) not in existing
+            ])
+
+            for pk, quota_bytes in admitted.items():
+                if pk not in succeeded or \
+                        (pk, attributes.ALLOCATION_QUOTA) in existing:
+                    ledger.admit(resources.get(pk, []), -quota_bytes)
+
+            if failed:
+                Allocation.objects.filter(pk__in=failed.keys()).update(
+                    status_id=registry.status_choice_pk(
+                        attributes.ALLOCATION_STATUS_PROVISIONING_ERROR
+                    )
+                )
+    finally:
+        # Held until the results are written back
+        for pk, token in leased.items():
+            leases.release(pk, token)
+
+    for allocation in Allocation.objects.filter(pk__in=failed.keys()):
+        _send_provisioning_failure(allocation, [{
+            'func': 'coldfront_plugin_nese.tasks.provision_nese_allocation_batch',
+            'result': failed[allocation.pk]
+        }])
+
+    return {
+        'provisioned': sorted(succeeded.keys()),
+        'failed': sorted(failed.keys())
+    }
+
+
+# Recompute the capacity ledger and correct any drift, meant to run
+# as a periodic django-q schedule
+@metrics.timed(metrics.TASK, task='process_nese_capacity_verify')
+def process_nese_capacity_verify() -> dict:
+    drift = ledger.verify()
+    metrics.inc('nese_capacity_drift_total', amount=len(drift))
+    return drift
+
+
 # ######## Internal #############
 
 
+# Callback renewing all leases of a batch, at most once every third
+# of the lease TTL
+def _lease_keeper(leased):
+    renewed = time.monotonic()
+
+    def keep(key=None):
+        nonlocal renewed
+        if time.monotonic() - renewed < settings.NESE_LEASE_TTL / 3:
+            return
+        renewed = time.monotonic()
+        for pk, token in leased.items():
+            if not leases.renew(pk, token):
+                logger.warning(f"Lost the lease on allocation {pk}.")
+
+    return keep
+
+
+# Hands back the ledger reservation start_allocation_task made for a
+# new quota
+def _release_reservation(allocation_pk, reserved):
+    if reserved:
+        ledger.admit(ledger.allocation_resources(allocation_pk), -reserved)
+
+
+# Allocation that cannot be provisioned at all (no room, no endpoint),
+# nothing was created remotely
+def _reject_allocation(
+        allocation,
+        error,
+        func='coldfront_plugin_nese.tasks.start_allocation_task'):
+    logger.error(f"Not provisioning allocation {allocation.pk}: {error}")
+    allocation.status_id = registry.status_choice_pk(
+        attributes.ALLOCATION_STATUS_PROVISIONING_ERROR
+    )
+    allocation.save()
+    _send_provisioning_failure(allocation, [{
+        'func': func,
+        'result': error
+    }])
+
+
+# Handoff result of a failed step. Endpoint outages are marked so the
+# chain can be retried instead of reported.
+def _failure_result(e):
+    if resilience.is_unavailable(e):
+        return {'error': str(e), 'endpoint_unavailable': True}
+    return str(e)
+
+
+# Failed handoff results are strings or dicts from _failure_result,
+# failed django-q task results the error text
+def _is_unavailable_result(result):
+    if isinstance(result, dict):
+        return bool(result.get('endpoint_unavailable'))
+    return EndpointUnavailable.__name__ in str(result)
+
+
+def _schedule_allocation_retry(allocation_pk):
+    name = f"nese_provision_{allocation_pk}"
+    if Schedule.objects.filter(name=name).exists():
+        return
+
+    logger.info(
+        f"NESE endpoint unavailable, retrying allocation {allocation_pk} "
+        f"in {settings.NESE_BREAKER_RESET}s."
+    )
+    schedule(
+        'coldfront_plugin_nese.tasks.start_allocation_task',
+        allocation_pk,
+        name=name,
+        schedule_type=Schedule.ONCE,
+        repeats=-1,
+        next_run=timezone.now() + datetime.timedelta(
+            seconds=settings.NESE_BREAKER_RESET
+        )
+    )
+
+
+def _record_handoff(group, step, func, success, result):
+    ProvisioningHandoff.objects.update_or_create(
+        group=group,
+        step=step,
+        defaults={
+            'func': func,
+            'success': success,
+            'result': result
+        }
+    )
+
+
+# Time between the previous step of the chain finishing (or the chain
+# being queued) and this step starting
+def _observe_queue_wait(group, step):
+    previous = ProvisioningHandoff.objects.filter(
+        group=group
+    ).order_by('-created').values_list('created', flat=True).first()
+
+    if previous is not None:
+        metrics.observe(
+            metrics.QUEUE_WAIT,
+            (timezone.now() - previous).total_seconds(),
+            step=step
+        )
+
+
+# Provisioning error email to the ticket system. failed_tasks are
+# django-q tasks or anything else with func and result.
+def _send_provisioning_failure(allocation, failed_tasks):
+    allocation_path = reverse('allocation-detail', args=[allocation.pk])
+    allocation_url = f"{settings.CENTER_BASE_URL}/{allocation_path}"
+
+    ctx = {
+        'allocation': allocation,
+        'allocation_url': allocation_url,
+        'failed_tasks': failed_tasks
+    }
+
+    send_email_template(
+        "NESE Bucket provisioning failed.",
+        "coldfront_plugin_nese/bucket_provision_failed.html",
+        ctx,
+        EMAIL_SENDER,
+        [EMAIL_TICKET_SYSTEM_ADDRESS, ]
+    )
+
+
 # Find all allocation ids with attributes of
 # a given type
 def _get_alloc_pks(attr_name):
-    attr_type = AllocationAttributeType.objects.get(
-        name=attr_name
-    )
     attrs = AllocationAttribute.objects.filter(
-        allocation_attribute_type=attr_type
+        allocation_attribute_type_id=registry.attribute_type_pk(attr_name)
     )
 
-    return [a.allocation.pk for a in attrs]
+    return list(attrs.values_list('allocation_id', flat=True))
 
 
-def _get_profile():
-    profile = {
-        'endpoint': settings.NESE_ENDPOINT,
-        'endpoint_type': settings.NESE_ENDPOINT_TYPE,
-        'access_key': settings.NESE_ENDPOINT_ACCESS_KEY,
-        'secret_key': settings.NESE_ENDPOINT_SECRET_KEY,
-        'scheme': settings.NESE_ENDPOINT_SCHEME,
-        'uid': settings.NESE_ENDPOINT_UID
-    }
+# (allocation pk, bucket name, quota) for every allocation with a
+# bucket name, or just the ones in alloc_pks, optionally limited to
+# the allocations on one endpoint. One query
+# (SWEEP_PREFETCH_QUERY_COUNT), streamed.
+def _get_nese_quota_rows(alloc_pks=None, endpoint=None):
+    quota_value = AllocationAttribute.objects.filter(
+        allocation=OuterRef('allocation'),
+        allocation_attribute_type__name=attributes.ALLOCATION_QUOTA
+    ).values('value')[:1]
+
+    rows = AllocationAttribute.objects.filter(
+        allocation_attribute_type__name=attributes.ALLOCATION_BUCKETNAME
+    ).annotate(
+        allocation_quota=Subquery(quota_value)
+    )
 
-    return profile
+    if alloc_pks is not None:
+        rows = rows.filter(allocation_id__in=alloc_pks)
+
+    if endpoint is not None:
+        endpoint_value = AllocationAttribute.objects.filter(
+            allocation=OuterRef('allocation'),
+            allocation_attribute_type__name=attributes.ALLOCATION_ENDPOINT
+        ).values('value')[:1]
+        rows = rows.annotate(endpoint_name=Subquery(endpoint_value))
+
+        # Allocations placed before endpoints were recorded live on
+        # the first one
+        on_endpoint = Q(endpoint_name=endpoint)
+        if endpoint == endpoints.default_name():
+            on_endpoint |= Q(endpoint_name__isnull=True)
+        rows = rows.filter(on_endpoint)
+
+    return rows.values_list(
+        'allocation_id',
+        'value',
+        'allocation_quota'
+    ).iterator(chunk_size=SWEEP_PREFETCH_CHUNK_SIZE)
 
 
 def _check_profile(profile: str):
 
     # Check valid endpoint type
     etype = profile.get('endpoint_type', None)
-    if etype not in ENDPOINT_TYPE_LIST:
+    if etype not in backends.allowed_types():
         raise ValueError(f"Unrecognized endpoint type: {etype}")
 
     # Valid http scheme
@@ -416,9 +1171,11 @@ def _check_profile(profile: str):
     if scheme not in ['http', 'https']:
         raise ValueError(f"Unrecognized endpoint scheme {scheme}")
 
-    # Missing values
-    required = ['endpoint', 'access_key', 'secret_key', 'uid']
-    missing = [r for r in required if profile.get(r, None) is None]
+    # Missing values. The uid owns the buckets RGW snapshots list.
+    required = ['endpoint', 'access_key', 'secret_key']
+    if etype == 'rgw':
+        required.append('uid')
+    missing = [r for r in required if not profile.get(r)]
     if len(missing) > 0:
         raise ValueError(
             f'Required profile values are missing: {",".join(missing)}'
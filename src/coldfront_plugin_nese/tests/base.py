@@ -0,0 +1,98 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+
+from coldfront.core.allocation.models import (Allocation,
+                                              AllocationAttribute,
+                                              AllocationAttributeType,
+                                              AllocationStatusChoice)
+from coldfront.core.allocation.models import \
+    AttributeType as AllocationAttributeValueType
+from coldfront.core.field_of_science.models import FieldOfScience
+from coldfront.core.project.models import Project, ProjectStatusChoice
+from coldfront.core.resource.models import \
+    AttributeType as ResourceAttributeValueType
+from coldfront.core.resource.models import (Resource, ResourceAttribute,
+                                            ResourceAttributeType,
+                                            ResourceType)
+
+from coldfront_plugin_nese import attributes, registry
+
+
+# A project on one NESE resource, with the NESE attribute types and
+# status choices registered the way register_nese_attributes does it
+class NESETestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('Text', 'Int'):
+            AllocationAttributeValueType.objects.get_or_create(name=name)
+            ResourceAttributeValueType.objects.get_or_create(name=name)
+        call_command('register_nese_attributes')
+
+        cls.project = Project.objects.create(
+            title='project',
+            pi=User.objects.create(username='pi'),
+            description='test project',
+            field_of_science=FieldOfScience.objects.create(
+                description='Other'
+            ),
+            status=ProjectStatusChoice.objects.get_or_create(
+                name='Active'
+            )[0]
+        )
+        cls.resource_type = ResourceType.objects.create(name='Storage')
+        cls.resource = cls.create_resource('NESE')
+        cls.status, _ = AllocationStatusChoice.objects.get_or_create(
+            name='Active'
+        )
+
+    def setUp(self):
+        registry.invalidate()
+
+    @classmethod
+    def create_resource(cls, name, capacity=None):
+        resource = Resource.objects.create(
+            resource_type=cls.resource_type,
+            name=name,
+            description=attributes.RESOURCE_DESCRIPTION
+        )
+        if capacity is not None:
+            ResourceAttribute.objects.create(
+                resource=resource,
+                resource_attribute_type=ResourceAttributeType.objects.get(
+                    name=attributes.RESOURCE_QUOTA
+                ),
+                value=str(capacity)
+            )
+        return resource
+
+    @classmethod
+    def create_allocation(cls, attrs=None, resource=None, quantity=1):
+        """Allocation on resource with the given NESE attributes.
+
+        attrs maps attribute names to values. They are bulk created,
+        so no signal handler sees them.
+        """
+        allocation = Allocation.objects.create(
+            project=cls.project,
+            status=cls.status,
+            quantity=quantity,
+            justification='test'
+        )
+        allocation.resources.add(resource or cls.resource)
+        AllocationAttribute.objects.bulk_create([
+            AllocationAttribute(
+                allocation=allocation,
+                allocation_attribute_type=AllocationAttributeType.objects.get(
+                    name=name
+                ),
+                value=value
+            )
+            for name, value in (attrs or {}).items()
+        ])
+        return allocation
+
+    @staticmethod
+    def attribute_type(name):
+        return AllocationAttributeType.objects.get(name=name)
@@ -0,0 +1,71 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from coldfront_plugin_nese import aio, backends
+from coldfront_plugin_nese.exceptions import NESEProvisioningError
+
+PROFILE = {
+    'name': 'memory',
+    'endpoint': 'aio.test',
+    'endpoint_type': 'memory',
+    'scheme': 'https',
+    'access_key': 'key',
+    'secret_key': 'secret',
+    'uid': ''
+}
+
+
+@override_settings(NESE_ALLOW_MEMORY_BACKEND=True)
+class ProvisionManyTests(SimpleTestCase):
+
+    def setUp(self):
+        self.addCleanup(backends.MemoryBackend.reset)
+        self.backend = backends.get_backend(PROFILE)
+
+    def test_every_bucket_provisioned(self):
+        items = [(i, f'bucket-{i}', '1') for i in range(20)]
+        results = aio.run_provisioning(items, PROFILE, concurrency=4)
+
+        self.assertEqual(sorted(results), list(range(20)))
+        snapshot = self.backend.get_bucket_snapshot()
+        for key, bucket_name, quota in items:
+            self.assertEqual(
+                results[key]['uid'],
+                f'{bucket_name}_datamanager'
+            )
+            self.assertEqual(snapshot[bucket_name]['quota'], '1')
+
+    def test_failure_stays_with_its_bucket(self):
+        create_bucket = backends.MemoryBackend.create_bucket
+
+        def fail_one(backend, bucket_name):
+            if bucket_name == 'bad':
+                raise NESEProvisioningError('refused')
+            create_bucket(backend, bucket_name)
+
+        with mock.patch.object(
+                backends.MemoryBackend,
+                'create_bucket',
+                fail_one):
+            results = aio.run_provisioning(
+                [('a', 'good', '1'), ('b', 'bad', '1')],
+                PROFILE
+            )
+
+        self.assertEqual(results['a']['uid'], 'good_datamanager')
+        self.assertIsInstance(results['b'], NESEProvisioningError)
+        self.assertIsNone(self.backend.get_bucket_state('bad'))
+
+    def test_on_done_after_each_bucket(self):
+        done = mock.Mock()
+        aio.run_provisioning(
+            [(i, f'bucket-{i}', '1') for i in range(3)],
+            PROFILE,
+            concurrency=1,
+            on_done=done
+        )
+        self.assertEqual(
+            sorted(c.args for c in done.call_args_list),
+            [(0,), (1,), (2,)]
+        )
@@ -0,0 +1,101 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from coldfront_plugin_nese import backends, tasks, utils
+from coldfront_plugin_nese.exceptions import NESEProvisioningError
+
+PROFILE = {
+    'name': 'memory',
+    'endpoint': 'memory.test',
+    'endpoint_type': 'memory',
+    'scheme': 'https',
+    'access_key': 'key',
+    'secret_key': 'secret',
+    'uid': ''
+}
+
+
+class BackendSelectionTests(SimpleTestCase):
+
+    def test_memory_refused_by_default(self):
+        with self.assertRaises(NESEProvisioningError):
+            backends.get_backend(PROFILE)
+        with self.assertRaises(ValueError):
+            tasks._check_profile(PROFILE)
+
+    @override_settings(NESE_ALLOW_MEMORY_BACKEND=True)
+    def test_memory_allowed_when_enabled(self):
+        self.assertIsInstance(
+            backends.get_backend(PROFILE),
+            backends.MemoryBackend
+        )
+        tasks._check_profile(PROFILE)
+
+    def test_production_types(self):
+        for endpoint_type, cls in (('rgw', backends.RGWBackend),
+                                   ('minio', backends.MinioBackend)):
+            profile = dict(PROFILE, endpoint_type=endpoint_type)
+            self.assertIsInstance(backends.get_backend(profile), cls)
+
+
+@override_settings(NESE_ALLOW_MEMORY_BACKEND=True)
+class MemoryBackendTests(SimpleTestCase):
+
+    def setUp(self):
+        self.addCleanup(backends.MemoryBackend.reset)
+        self.backend = backends.get_backend(PROFILE)
+
+    def test_provision_bucket(self):
+        user = self.backend.create_user('bucket_datamanager')
+        self.backend.provision_bucket('bucket', user['uid'], '10')
+
+        state = self.backend.get_bucket_state('bucket')
+        self.assertEqual(state['quota'], '10')
+        self.assertTrue(self.backend.in_sync(state, 10, ''))
+        self.assertFalse(self.backend.in_sync(state, 11, ''))
+
+    def test_create_user_is_idempotent(self):
+        self.assertEqual(
+            self.backend.create_user('user'),
+            self.backend.create_user('user')
+        )
+
+    def test_snapshot_limited_to_names(self):
+        for name in ('a', 'b', 'c'):
+            self.backend.create_bucket(name)
+        self.assertEqual(
+            sorted(self.backend.get_bucket_snapshot(['a', 'c', 'x'])),
+            ['a', 'c']
+        )
+        self.assertIsNone(self.backend.get_bucket_state('x'))
+
+    def test_quota_on_missing_bucket(self):
+        with self.assertRaises(NESEProvisioningError):
+            self.backend.set_bucket_quota('missing', '1')
+
+
+@override_settings(NESE_RATE_LIMITS={})
+class MinioQuotaTests(SimpleTestCase):
+
+    def setUp(self):
+        self.profile = dict(PROFILE, endpoint_type='minio')
+        for name in ('minio_admin_available', '_execute_mc'):
+            patcher = mock.patch.object(utils, name)
+            self.addCleanup(patcher.stop)
+            setattr(self, name, patcher.start())
+
+    def test_unset_quota_refused_before_any_client(self):
+        for quota in (None, '', 'none'):
+            with self.assertRaises(NESEProvisioningError):
+                utils.set_bucket_quota_minio('bucket', quota, self.profile)
+        self.minio_admin_available.assert_not_called()
+        self._execute_mc.assert_not_called()
+
+    def test_mc_gets_bytes(self):
+        self.minio_admin_available.return_value = False
+        utils.set_bucket_quota_minio('bucket', '1', self.profile)
+        self.assertEqual(
+            self._execute_mc.call_args.args[-1],
+            f"{1024**4}b"
+        )
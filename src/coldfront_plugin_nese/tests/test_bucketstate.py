@@ -0,0 +1,88 @@
+import datetime
+from unittest import mock
+
+from django.test import TestCase
+
+from coldfront_plugin_nese import bucketstate
+from coldfront_plugin_nese.models import BucketState
+from coldfront_plugin_nese.quota import STATE_HASH_TAG, state_hash
+
+TB = 1024**4
+PROFILE = {'name': 'default', 'endpoint': 's3.test'}
+
+
+class BucketStateTests(TestCase):
+
+    def age(self, bucket_name, seconds):
+        BucketState.objects.filter(bucket_name=bucket_name).update(
+            last_verified=BucketState.objects.get(
+                bucket_name=bucket_name
+            ).last_verified - datetime.timedelta(seconds=seconds)
+        )
+
+    def test_record_and_fresh(self):
+        bucketstate.record('bucket', PROFILE, quota='2', state_hash='abc')
+
+        row = bucketstate.fresh(PROFILE, ['bucket'])['bucket']
+        self.assertEqual(row.quota, 2 * TB)
+        self.assertEqual(row.state_hash, 'abc')
+
+        bucketstate.record('bucket', PROFILE, quota='3')
+        self.assertEqual(BucketState.objects.count(), 1)
+        self.assertEqual(
+            bucketstate.fresh(PROFILE)['bucket'].quota,
+            3 * TB
+        )
+
+    def test_old_and_failed_entries_are_stale(self):
+        bucketstate.record_many(PROFILE, {'old': {}, 'failed': {}})
+        with self.settings(NESE_BUCKET_STATE_TTL=60):
+            self.age('old', 61)
+            bucketstate.record_errors(PROFILE, {'failed': 'timed out'})
+            self.assertEqual(bucketstate.fresh(PROFILE), {})
+
+        self.assertEqual(
+            BucketState.objects.get(bucket_name='failed').last_error,
+            'timed out'
+        )
+
+    def test_snapshot_asks_endpoint_about_stale_only(self):
+        bucketstate.record('cached', PROFILE, quota='1')
+        backend = mock.Mock(profile=PROFILE)
+        backend.get_bucket_snapshot.return_value = {
+            'remote': {'quota': '5', 'tags': {}, 'usage_kb': 0}
+        }
+
+        snapshot = bucketstate.get_snapshot(backend, ['cached', 'remote'])
+
+        backend.get_bucket_snapshot.assert_called_once_with(['remote'])
+        self.assertEqual(snapshot['cached']['quota'], 1)
+        self.assertEqual(snapshot['remote']['quota'], '5')
+        self.assertEqual(
+            bucketstate.fresh(PROFILE, ['remote'])['remote'].quota,
+            5 * TB
+        )
+
+    def test_refresh_keeps_matching_hash_only(self):
+        tags = {'pi': 'pi'}
+        good = state_hash('1', tags)
+        bucketstate.refresh(PROFILE, {
+            'tagged': {
+                'quota': '1',
+                'tags': dict(tags, quota='1', **{STATE_HASH_TAG: good})
+            },
+            'changed': {
+                'quota': '2',
+                'tags': dict(tags, **{STATE_HASH_TAG: good})
+            },
+            'untagged': {'quota': '1', 'tags': tags}
+        })
+
+        hashes = {
+            name: row.state_hash
+            for name, row in bucketstate.fresh(PROFILE).items()
+        }
+        self.assertEqual(
+            hashes,
+            {'tagged': good, 'changed': '', 'untagged': ''}
+        )
@@ -0,0 +1,149 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from coldfront.core.allocation.models import Allocation
+
+from coldfront_plugin_nese import attributes, bucketstate, endpoints, tasks
+from coldfront_plugin_nese.tests.base import NESETestCase
+
+ENDPOINTS = [
+    {
+        'name': 'nese-a',
+        'endpoint': 's3a.test',
+        'endpoint_type': 'rgw',
+        'access_key': 'a',
+        'secret_key': 'a',
+        'uid': 'a',
+        'resource': 'NESE A'
+    },
+    {
+        'name': 'nese-b',
+        'endpoint': 's3b.test',
+        'endpoint_type': 'minio',
+        'access_key': 'b',
+        'secret_key': 'b',
+        'resource': 'NESE B'
+    }
+]
+
+
+def entry(resource, capacity, used=0.0, pending=0):
+    return {
+        'resource': resource,
+        'capacity': capacity,
+        'used': used,
+        'pending': pending
+    }
+
+
+class ChooseTests(SimpleTestCase):
+
+    def test_most_room_among_the_resource_endpoints(self):
+        usage = {
+            'a': entry('NESE', 100, used=90),
+            'b': entry('NESE', 100, used=10),
+            'c': entry('Other', 1000)
+        }
+        self.assertEqual(endpoints.choose(usage, 5, 'NESE'), 'b')
+
+    def test_pending_work_discounts_room(self):
+        usage = {
+            'a': entry('NESE', 100, used=20),
+            'b': entry('NESE', 100, used=10, pending=3)
+        }
+        self.assertEqual(endpoints.choose(usage, 5, 'NESE'), 'a')
+
+    def test_refuses_unserved_resource(self):
+        usage = {'a': entry('NESE', 100)}
+        self.assertIsNone(endpoints.choose(usage, 5, 'Other'))
+        self.assertIsNone(endpoints.choose(usage, 5))
+
+    def test_refuses_when_nothing_fits(self):
+        usage = {'a': entry('NESE', 100, used=98)}
+        self.assertIsNone(endpoints.choose(usage, 5, 'NESE'))
+
+
+class CheckProfileTests(SimpleTestCase):
+
+    def test_minio_needs_no_uid(self):
+        profile = dict(ENDPOINTS[1], scheme='https')
+        tasks._check_profile(profile)
+        tasks._check_profile(dict(profile, uid=None))
+
+    def test_rgw_needs_uid(self):
+        profile = dict(ENDPOINTS[0], scheme='https', uid='')
+        with self.assertRaisesRegex(ValueError, r'missing: uid$'):
+            tasks._check_profile(profile)
+
+
+@override_settings(NESE_ENDPOINTS=ENDPOINTS)
+class PlacementTests(NESETestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.resource_a = self.create_resource('NESE A', capacity=10)
+        self.resource_b = self.create_resource('NESE B', capacity=10)
+        self.unserved = self.create_resource('NESE C', capacity=10)
+
+    def new_allocation(self, resource, name):
+        return self.create_allocation(
+            {attributes.ALLOCATION_BUCKETNAME: name},
+            resource=resource
+        )
+
+    def test_placed_on_its_resource_endpoint(self):
+        a = self.new_allocation(self.resource_a, 'bucket-a')
+        b = self.new_allocation(self.resource_b, 'bucket-b')
+
+        placed = endpoints.place_many({a.pk: 1, b.pk: 1})
+        self.assertEqual(placed, {a.pk: 'nese-a', b.pk: 'nese-b'})
+        self.assertEqual(
+            a.get_attribute(attributes.ALLOCATION_ENDPOINT),
+            'nese-a'
+        )
+
+    def test_unserved_resource_not_placed(self):
+        allocation = self.new_allocation(self.unserved, 'bucket-c')
+        self.assertEqual(endpoints.place_many({allocation.pk: 1}), {})
+        self.assertIsNone(
+            allocation.get_attribute(attributes.ALLOCATION_ENDPOINT)
+        )
+
+    @mock.patch.object(tasks, '_send_provisioning_failure')
+    @mock.patch.object(tasks, 'async_task')
+    def test_unplaced_marked_provisioning_error(self, run, send_failure):
+        placed = self.new_allocation(self.resource_a, 'bucket-a')
+        unplaced = self.new_allocation(self.unserved, 'bucket-c')
+
+        tasks.process_nese_allocation(batch_size=10)
+
+        run.assert_called_once()
+        self.assertEqual(run.call_args.args[1], [placed.pk])
+        send_failure.assert_called_once()
+        self.assertEqual(
+            Allocation.objects.get(pk=unplaced.pk).status.name,
+            attributes.ALLOCATION_STATUS_PROVISIONING_ERROR
+        )
+        self.assertEqual(
+            Allocation.objects.get(pk=placed.pk).status.name,
+            self.status.name
+        )
+
+
+@override_settings(NESE_ENDPOINTS=ENDPOINTS)
+class BucketStatePerEndpointTests(NESETestCase):
+
+    def test_same_bucket_name_on_two_endpoints(self):
+        profiles = endpoints.get_profiles()
+        bucketstate.record('bucket', profiles['nese-a'], quota='1')
+        bucketstate.record('bucket', profiles['nese-b'], quota='2')
+
+        a = bucketstate.fresh(profiles['nese-a'], ['bucket'])['bucket']
+        b = bucketstate.fresh(profiles['nese-b'], ['bucket'])['bucket']
+        self.assertEqual(a.quota, 1024**4)
+        self.assertEqual(b.quota, 2 * 1024**4)
+
+        bucketstate.record_errors(profiles['nese-a'], {'bucket': 'down'})
+        self.assertEqual(bucketstate.fresh(profiles['nese-a']), {})
+        self.assertIn('bucket', bucketstate.fresh(profiles['nese-b']))
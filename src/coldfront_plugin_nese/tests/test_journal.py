@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from coldfront_plugin_nese import journal
+
+
+class JournalTests(TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.path = os.path.join(tmp_dir, 'quota.journal')
+
+    def test_empty_journal(self):
+        self.assertEqual(journal.read_offset(self.path), 0)
+        self.assertEqual(journal.read_entries(self.path, 0), ([], 0))
+
+    def test_append_and_read(self):
+        journal.append_many([('a', '1'), ('b', '2')], self.path)
+        journal.append('c', None, self.path)
+
+        entries, offset = journal.read_entries(self.path, 0)
+        self.assertEqual(
+            [(e['bucket'], e['quota']) for e in entries],
+            [('a', '1'), ('b', '2'), ('c', None)]
+        )
+        self.assertEqual(offset, os.path.getsize(self.path))
+
+        # Nothing new after the returned offset
+        self.assertEqual(
+            journal.read_entries(self.path, offset),
+            ([], offset)
+        )
+
+    def test_read_from_offset(self):
+        journal.append('a', '1', self.path)
+        _, offset = journal.read_entries(self.path, 0)
+        journal.append('b', '2', self.path)
+
+        entries, _ = journal.read_entries(self.path, offset)
+        self.assertEqual([e['bucket'] for e in entries], ['b'])
+
+    def test_partial_line_left_for_next_read(self):
+        journal.append('a', '1', self.path)
+        with open(self.path, 'a') as f:
+            f.write('{"bucket": "b", "quo')
+
+        entries, offset = journal.read_entries(self.path, 0)
+        self.assertEqual([e['bucket'] for e in entries], ['a'])
+
+        with open(self.path, 'a') as f:
+            f.write('ta": "2", "ts": 0}\n')
+        entries, _ = journal.read_entries(self.path, offset)
+        self.assertEqual([e['bucket'] for e in entries], ['b'])
+
+    def test_garbled_line_skipped(self):
+        with open(self.path, 'w') as f:
+            f.write('not json\n')
+        journal.append('a', '1', self.path)
+
+        entries, _ = journal.read_entries(self.path, 0)
+        self.assertEqual([e['bucket'] for e in entries], ['a'])
+
+    def test_stale_offset_restarts(self):
+        journal.append('a', '1', self.path)
+        entries, offset = journal.read_entries(self.path, 10**6)
+        self.assertEqual([e['bucket'] for e in entries], ['a'])
+        self.assertEqual(offset, os.path.getsize(self.path))
+
+    def test_offset_round_trip(self):
+        journal.write_offset(self.path, 42)
+        self.assertEqual(journal.read_offset(self.path), 42)
+
+    def test_compact_when_caught_up(self):
+        journal.append_many([('a', '1'), ('b', '2')], self.path)
+        _, offset = journal.read_entries(self.path, 0)
+        journal.write_offset(self.path, offset)
+
+        self.assertEqual(journal.compact(self.path, offset), 0)
+        self.assertEqual(os.path.getsize(self.path), 0)
+        self.assertEqual(journal.read_offset(self.path), 0)
+
+    def test_compact_keeps_unapplied_entries(self):
+        journal.append('a', '1', self.path)
+        _, offset = journal.read_entries(self.path, 0)
+        journal.append('b', '2', self.path)
+
+        self.assertEqual(journal.compact(self.path, offset), offset)
+        entries, _ = journal.read_entries(self.path, offset)
+        self.assertEqual([e['bucket'] for e in entries], ['b'])
+
+    def test_compact_missing_journal(self):
+        self.assertEqual(journal.compact(self.path, 0), 0)
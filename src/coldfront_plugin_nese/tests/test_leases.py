@@ -0,0 +1,71 @@
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from coldfront_plugin_nese import leases, tasks
+from coldfront_plugin_nese.exceptions import NESEProvisioningError
+from coldfront_plugin_nese.models import AllocationLease
+
+
+class LeaseTests(TestCase):
+
+    def expires(self):
+        return AllocationLease.objects.get(allocation_id=1).expires
+
+    def test_held_lease_refused(self):
+        token = leases.acquire(1, ttl=60, wait=0)
+        with self.assertRaises(NESEProvisioningError):
+            leases.acquire(1, ttl=60, wait=0)
+        leases.release(1, token)
+        leases.acquire(1, ttl=60, wait=0)
+
+    def test_renew_pushes_expiry_back(self):
+        token = leases.acquire(1, ttl=60, wait=0)
+        before = self.expires()
+        self.assertTrue(leases.renew(1, token, ttl=600))
+        self.assertGreater(self.expires(), before)
+
+    def test_renew_after_takeover(self):
+        token = leases.acquire(1, ttl=-1, wait=0)
+        other = leases.acquire(1, ttl=60, wait=0)
+
+        self.assertFalse(leases.renew(1, token))
+        # Releasing the lost lease leaves the new holder alone
+        leases.release(1, token)
+        self.assertEqual(
+            AllocationLease.objects.get(allocation_id=1).owner,
+            other
+        )
+
+
+@override_settings(NESE_LEASE_TTL=60)
+class LeaseKeeperTests(TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(
+            tasks.time,
+            'monotonic',
+            side_effect=lambda: self.now
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch.object(leases, 'renew', return_value=True)
+    def test_renews_every_third_of_the_ttl(self, renew):
+        keep = tasks._lease_keeper({1: 'a', 2: 'b'})
+
+        keep(1)
+        self.now += 19
+        keep(2)
+        renew.assert_not_called()
+
+        self.now += 1
+        keep(1)
+        self.assertEqual(
+            sorted(c.args for c in renew.call_args_list),
+            [(1, 'a'), (2, 'b')]
+        )
+
+        keep(2)
+        self.assertEqual(renew.call_count, 2)
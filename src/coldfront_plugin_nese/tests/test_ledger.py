@@ -0,0 +1,160 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.db.models.signals import post_save
+
+from coldfront.core.allocation.models import Allocation, AllocationAttribute
+
+from coldfront_plugin_nese import attributes, ledger, tasks
+from coldfront_plugin_nese.exceptions import CapacityExceeded
+from coldfront_plugin_nese.tests.base import NESETestCase
+
+TB = 1024**4
+
+
+class LedgerTests(NESETestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.small = self.create_resource('NESE small', capacity=10)
+        self.quota_type = self.attribute_type(attributes.ALLOCATION_QUOTA)
+
+    def committed(self):
+        return ledger.get([self.small.pk])[self.small.pk].committed
+
+    def set_quota(self, allocation, value):
+        AllocationAttribute.objects.update_or_create(
+            allocation=allocation,
+            allocation_attribute_type=self.quota_type,
+            defaults={'value': value}
+        )
+
+    def test_capacity_from_resource_attribute(self):
+        self.assertEqual(ledger.get([self.small.pk])[self.small.pk].capacity,
+                         10 * TB)
+
+    def test_quota_writes_move_committed(self):
+        allocation = self.create_allocation(resource=self.small)
+        self.set_quota(allocation, '4')
+        self.assertEqual(self.committed(), 4 * TB)
+
+        self.set_quota(allocation, '6')
+        self.assertEqual(self.committed(), 6 * TB)
+
+        AllocationAttribute.objects.filter(
+            allocation=allocation,
+            allocation_attribute_type=self.quota_type
+        ).delete()
+        self.assertEqual(self.committed(), 0)
+
+    def test_over_commit_refused(self):
+        self.set_quota(self.create_allocation(resource=self.small), '8')
+
+        other = self.create_allocation(resource=self.small)
+        with self.assertRaises(CapacityExceeded):
+            self.set_quota(other, '3')
+
+        self.assertEqual(self.committed(), 8 * TB)
+        self.assertFalse(AllocationAttribute.objects.filter(
+            allocation=other,
+            allocation_attribute_type=self.quota_type
+        ).exists())
+
+    def test_decrease_always_allowed(self):
+        allocation = self.create_allocation(resource=self.small)
+        self.set_quota(allocation, '8')
+        ledger.set_capacity(self.small.pk, '5')
+
+        self.set_quota(allocation, '6')
+        self.assertEqual(self.committed(), 6 * TB)
+
+    def test_failed_write_rolls_ledger_back(self):
+        def fail(sender, instance, **kwargs):
+            raise RuntimeError("write failed")
+
+        post_save.connect(fail, sender=AllocationAttribute)
+        self.addCleanup(
+            post_save.disconnect,
+            fail,
+            sender=AllocationAttribute
+        )
+
+        allocation = self.create_allocation(resource=self.small)
+        with self.assertRaises(RuntimeError):
+            self.set_quota(allocation, '4')
+        self.assertEqual(self.committed(), 0)
+
+    def test_verify_fixes_drift(self):
+        ledger.get([self.small.pk])
+        # Bulk created, the ledger does not see it
+        self.create_allocation(
+            {attributes.ALLOCATION_QUOTA: '3'},
+            resource=self.small
+        )
+
+        drift = ledger.verify()
+        self.assertEqual(drift[self.small.pk], (0, 3 * TB))
+        self.assertEqual(self.committed(), 3 * TB)
+        self.assertEqual(ledger.verify(), {})
+
+
+@mock.patch.object(tasks, '_send_provisioning_failure')
+@mock.patch.object(tasks, 'Chain')
+class AllocationReservationTests(NESETestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.small = self.create_resource('NESE small', capacity=10)
+
+    def committed(self):
+        return ledger.get([self.small.pk])[self.small.pk].committed
+
+    def new_allocation(self, quantity):
+        return self.create_allocation(
+            {attributes.ALLOCATION_BUCKETNAME: f'bucket-{quantity}'},
+            resource=self.small,
+            quantity=quantity
+        )
+
+    def status(self, allocation):
+        return Allocation.objects.get(pk=allocation.pk).status.name
+
+    def test_reserves_before_the_chain(self, chain, send_failure):
+        allocation = self.new_allocation(4)
+        tasks.start_allocation_task(allocation.pk)
+
+        self.assertEqual(self.committed(), 4 * TB)
+        chain.return_value.run.assert_called_once()
+        update_step = chain.return_value.append.call_args_list[-1]
+        self.assertEqual(update_step.kwargs['reserved'], 4 * TB)
+
+    def test_rejects_over_commit_up_front(self, chain, send_failure):
+        allocation = self.new_allocation(20)
+        tasks.start_allocation_task(allocation.pk)
+
+        self.assertEqual(self.committed(), 0)
+        chain.return_value.run.assert_not_called()
+        send_failure.assert_called_once()
+        self.assertEqual(
+            self.status(allocation),
+            attributes.ALLOCATION_STATUS_PROVISIONING_ERROR
+        )
+
+    def test_failed_chain_releases_reservation(self, chain, send_failure):
+        allocation = self.new_allocation(4)
+        tasks.start_allocation_task(allocation.pk)
+
+        tasks.cleanup(SimpleNamespace(
+            success=False,
+            group='group',
+            func='coldfront_plugin_nese.tasks.update_nese_allocation',
+            result='lease timeout',
+            kwargs={'allocation_pk': allocation.pk, 'reserved': 4 * TB}
+        ))
+
+        self.assertEqual(self.committed(), 0)
+        send_failure.assert_called_once()
+        self.assertEqual(
+            self.status(allocation),
+            attributes.ALLOCATION_STATUS_PROVISIONING_ERROR
+        )
@@ -0,0 +1,52 @@
+from django.contrib.auth.models import AnonymousUser, User
+from django.test import RequestFactory, SimpleTestCase, TestCase
+
+from coldfront_plugin_nese import metrics, views
+
+
+class RenderTests(SimpleTestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry(buckets=(1.0,))
+
+    def test_histogram(self):
+        self.registry.observe('op_seconds', 0.5, {'op': 'create'})
+        self.registry.observe('op_seconds', 2.0, {'op': 'create'})
+        self.assertEqual(self.registry.render().splitlines(), [
+            '# TYPE op_seconds histogram',
+            'op_seconds_bucket{op="create",le="1.0"} 1',
+            'op_seconds_bucket{op="create",le="+Inf"} 2',
+            'op_seconds_sum{op="create"} 2.5',
+            'op_seconds_count{op="create"} 2'
+        ])
+
+    def test_label_values_escaped(self):
+        self.registry.inc('errors_total', {'error': 'a "b"\\c\nd'})
+        self.assertEqual(
+            self.registry.render().splitlines()[-1],
+            'errors_total{error="a \\"b\\"\\\\c\\nd"} 1'
+        )
+
+
+class MetricsViewTests(TestCase):
+
+    def get(self, user):
+        request = RequestFactory().get('/nese/metrics/')
+        request.user = user
+        return views.metrics_view(request)
+
+    def test_superuser_only(self):
+        self.assertEqual(self.get(AnonymousUser()).status_code, 302)
+        self.assertEqual(
+            self.get(User.objects.create(username='user')).status_code,
+            302
+        )
+
+        response = self.get(
+            User.objects.create(username='admin', is_superuser=True)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response['Content-Type'],
+            views.METRICS_CONTENT_TYPE
+        )
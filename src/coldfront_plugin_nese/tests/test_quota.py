@@ -0,0 +1,84 @@
+from unittest import TestCase
+
+from coldfront_plugin_nese.quota import convert, equal, state_hash, to_bytes
+
+TB = 1024**4
+
+
+class ToBytesTests(TestCase):
+
+    def test_tb_by_default(self):
+        self.assertEqual(to_bytes(10), 10 * TB)
+        self.assertEqual(to_bytes("10"), 10 * TB)
+        self.assertEqual(to_bytes("10.0"), 10 * TB)
+        self.assertEqual(to_bytes("0.5"), TB // 2)
+
+    def test_unit_argument(self):
+        self.assertEqual(to_bytes(1024, 'kb'), 1024**2)
+        self.assertEqual(to_bytes("512", 'b'), 512)
+
+    def test_suffixes(self):
+        self.assertEqual(to_bytes("10t"), 10 * TB)
+        self.assertEqual(to_bytes("512 GiB"), 512 * 1024**3)
+        self.assertEqual(to_bytes("1kb", 'tb'), 1024)
+        self.assertEqual(to_bytes(" 2 TB "), 2 * TB)
+
+    def test_unset_and_unlimited(self):
+        for value in (None, '', ' ', 'none', 'NULL', -1, "-1"):
+            self.assertIsNone(to_bytes(value), value)
+
+    def test_invalid(self):
+        for value in ("ten", "10 parsecs", "nan", "inf", object()):
+            with self.assertRaises(ValueError):
+                to_bytes(value)
+
+
+class EqualTests(TestCase):
+
+    def test_same_quota_in_different_shapes(self):
+        self.assertTrue(equal("10", 10))
+        self.assertTrue(equal("10.0", "10"))
+        self.assertTrue(equal(10 * TB, 10 * TB, unit='b'))
+        self.assertTrue(equal(convert(10, 'tb', 'kb'), 10 * 1024**3, 'kb'))
+
+    def test_different_quotas(self):
+        self.assertFalse(equal("10", "11"))
+        self.assertFalse(equal("10", None))
+
+    def test_unset_quotas_match(self):
+        self.assertTrue(equal(None, ''))
+
+    def test_unparsable_never_matches(self):
+        self.assertFalse(equal("ten", "ten"))
+
+
+class ConvertTests(TestCase):
+
+    def test_even_division_gives_int(self):
+        self.assertEqual(convert(10, 'tb', 'kb'), 10 * 1024**3)
+        self.assertIsInstance(convert(2048, 'kb', 'mb'), int)
+
+    def test_uneven_division_gives_float(self):
+        self.assertEqual(convert(512, 'gb', 'tb'), 0.5)
+
+    def test_unset(self):
+        self.assertIsNone(convert(None, 'tb', 'kb'))
+
+
+class StateHashTests(TestCase):
+
+    def test_quota_shape_does_not_matter(self):
+        self.assertEqual(state_hash("10"), state_hash(10))
+
+    def test_volatile_tags_ignored(self):
+        self.assertEqual(
+            state_hash("10", {'pi': 'x', 'timestamp': '1'}),
+            state_hash("10", {'pi': 'x', 'timestamp': '2'})
+        )
+
+    def test_quota_and_tags_matter(self):
+        self.assertNotEqual(state_hash("10"), state_hash("11"))
+        self.assertNotEqual(
+            state_hash("10", {'pi': 'x'}),
+            state_hash("10", {'pi': 'y'})
+        )
@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from coldfront_plugin_nese import quotafs
+
+TB = 1024**4
+NAMESPACE = 'user'
+
+
+class ReconcileBucketTests(TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir)
+        self.bucket_dir = os.path.join(self.base_dir, 'bucket')
+        os.mkdir(self.bucket_dir)
+        try:
+            quotafs.write_quota(self.bucket_dir, 1, NAMESPACE)
+            os.removexattr(self.bucket_dir, quotafs.quota_attr(NAMESPACE))
+        except OSError:
+            self.skipTest("No user xattr support on the temp filesystem")
+
+    def reconcile(self, quota, bucket='bucket', dry_run=False):
+        return quotafs.reconcile_bucket(
+            self.base_dir,
+            bucket,
+            quota,
+            NAMESPACE,
+            dry_run=dry_run
+        )
+
+    def test_sets_missing_quota(self):
+        self.assertEqual(
+            self.reconcile("2"),
+            (quotafs.CHANGED, None, 2 * TB, None)
+        )
+        self.assertEqual(
+            quotafs.read_quota(self.bucket_dir, NAMESPACE),
+            2 * TB
+        )
+
+    def test_unchanged(self):
+        quotafs.write_quota(self.bucket_dir, 2 * TB, NAMESPACE)
+        self.assertEqual(
+            self.reconcile("2.0"),
+            (quotafs.UNCHANGED, 2 * TB, 2 * TB, None)
+        )
+
+    def test_changes_drifted_quota(self):
+        quotafs.write_quota(self.bucket_dir, TB, NAMESPACE)
+        self.assertEqual(
+            self.reconcile("3"),
+            (quotafs.CHANGED, TB, 3 * TB, None)
+        )
+        self.assertEqual(
+            quotafs.read_quota(self.bucket_dir, NAMESPACE),
+            3 * TB
+        )
+
+    def test_dry_run_does_not_write(self):
+        quotafs.write_quota(self.bucket_dir, TB, NAMESPACE)
+        outcome, current, wanted, error = self.reconcile("3", dry_run=True)
+        self.assertEqual(outcome, quotafs.CHANGED)
+        self.assertEqual(
+            quotafs.read_quota(self.bucket_dir, NAMESPACE),
+            TB
+        )
+
+    def test_no_quota(self):
+        self.assertEqual(
+            self.reconcile(None),
+            (quotafs.NO_QUOTA, None, None, None)
+        )
+
+    def test_missing_directory(self):
+        self.assertEqual(
+            self.reconcile("1", bucket='nope'),
+            (quotafs.MISSING, None, TB, None)
+        )
+
+    def test_bad_quota(self):
+        outcome, current, wanted, error = self.reconcile("lots")
+        self.assertEqual(outcome, quotafs.FAILED)
+        self.assertIsInstance(error, ValueError)
+
+    def test_reconcile_summary(self):
+        summary = quotafs.reconcile(
+            self.base_dir,
+            {'bucket': "1", 'nope': "1", 'unset': None},
+            NAMESPACE,
+            workers=2
+        )
+        self.assertEqual(
+            [name for name, *_ in summary[quotafs.CHANGED]],
+            ['bucket']
+        )
+        self.assertEqual(
+            [name for name, *_ in summary[quotafs.MISSING]],
+            ['nope']
+        )
+        self.assertEqual(
+            [name for name, *_ in summary[quotafs.NO_QUOTA]],
+            ['unset']
+        )
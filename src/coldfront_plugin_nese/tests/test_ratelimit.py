@@ -0,0 +1,56 @@
+import datetime
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from coldfront_plugin_nese import ratelimit
+
+
+@override_settings(
+    NESE_RATE_LIMITS={ratelimit.QUOTA_SET: 1.0},
+    NESE_RATE_LIMIT_BURST=2.0
+)
+class RateLimitTests(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        for target, attr, side_effect in (
+                (ratelimit.timezone, 'now', lambda: self.now),
+                (ratelimit.time, 'sleep', self.sleep)):
+            patcher = mock.patch.object(target, attr, side_effect=side_effect)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def sleep(self, seconds):
+        self.now += datetime.timedelta(seconds=seconds)
+
+    def acquire(self):
+        return ratelimit.acquire('s3.test', ratelimit.QUOTA_SET)
+
+    def test_unlimited_class_is_free(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                ratelimit.acquire('s3.test', ratelimit.READ),
+                0.0
+            )
+
+    def test_burst_then_sustained_rate(self):
+        self.assertEqual(self.acquire(), 0.0)
+        self.assertEqual(self.acquire(), 0.0)
+        self.assertAlmostEqual(self.acquire(), 1.0)
+
+    def test_refills_while_idle(self):
+        self.acquire()
+        self.acquire()
+        self.sleep(2)
+        self.assertEqual(self.acquire(), 0.0)
+        self.assertEqual(self.acquire(), 0.0)
+
+    def test_buckets_per_endpoint(self):
+        self.acquire()
+        self.acquire()
+        self.assertEqual(
+            ratelimit.acquire('other.test', ratelimit.QUOTA_SET),
+            0.0
+        )
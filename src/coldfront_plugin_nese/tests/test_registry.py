@@ -0,0 +1,60 @@
+from unittest import mock
+
+from coldfront.core.allocation.models import AllocationAttributeType
+
+from coldfront_plugin_nese import attributes, registry
+from coldfront_plugin_nese.tests.base import NESETestCase
+
+NAME = attributes.ALLOCATION_QUOTA_UPDATE
+
+
+class RegistryTests(NESETestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.now = 1000.0
+        patcher = mock.patch.object(
+            registry.time,
+            'monotonic',
+            side_effect=lambda: self.now
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.attr_type = self.attribute_type(NAME)
+        self.attr_type.delete()
+
+    def recreate(self, signals=True):
+        self.attr_type.pk = None
+        if signals:
+            self.attr_type.save()
+        else:
+            AllocationAttributeType.objects.bulk_create([self.attr_type])
+        return AllocationAttributeType.objects.get(name=NAME).pk
+
+    def test_hits_cached(self):
+        pk = registry.attribute_type_pk(attributes.ALLOCATION_QUOTA)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                registry.attribute_type_pk(attributes.ALLOCATION_QUOTA),
+                pk
+            )
+
+    def test_misses_cached(self):
+        self.assertIsNone(registry.attribute_type_pk(NAME))
+        with self.assertNumQueries(0):
+            self.assertIsNone(registry.attribute_type_pk(NAME))
+            self.assertIsNone(registry.attribute_type_pk('Not NESE'))
+
+    def test_save_in_this_process_refreshes(self):
+        self.assertIsNone(registry.attribute_type_pk(NAME))
+        pk = self.recreate()
+        self.assertEqual(registry.attribute_type_pk(NAME), pk)
+
+    def test_rows_from_elsewhere_show_up_after_ttl(self):
+        self.assertIsNone(registry.attribute_type_pk(NAME))
+        pk = self.recreate(signals=False)
+        self.assertIsNone(registry.attribute_type_pk(NAME))
+
+        self.now += 61
+        self.assertEqual(registry.attribute_type_pk(NAME), pk)
@@ -0,0 +1,157 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from coldfront_plugin_nese import resilience
+from coldfront_plugin_nese.exceptions import EndpointUnavailable
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(
+            resilience.time,
+            'monotonic',
+            side_effect=lambda: self.now
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = resilience.CircuitBreaker('s3.test', 3, 30)
+
+    def fail(self, times):
+        for i in range(times):
+            self.breaker.failure()
+
+    def test_closed_below_threshold(self):
+        self.fail(2)
+        self.assertFalse(self.breaker.is_open)
+        self.breaker.before_call()
+
+    def test_opens_at_threshold(self):
+        self.fail(3)
+        self.assertTrue(self.breaker.is_open)
+        with self.assertRaises(EndpointUnavailable):
+            self.breaker.before_call()
+
+    def test_success_resets_failure_count(self):
+        self.fail(2)
+        self.breaker.success()
+        self.fail(2)
+        self.assertFalse(self.breaker.is_open)
+
+    def test_half_open_lets_one_probe_through(self):
+        self.fail(3)
+        self.now += 31
+
+        self.breaker.before_call()
+        with self.assertRaises(EndpointUnavailable):
+            self.breaker.before_call()
+
+    def test_probe_success_closes(self):
+        self.fail(3)
+        self.now += 31
+        self.breaker.before_call()
+        self.breaker.success()
+
+        self.assertFalse(self.breaker.is_open)
+        self.breaker.before_call()
+        self.breaker.before_call()
+
+    def test_probe_failure_reopens(self):
+        self.fail(3)
+        self.now += 31
+        self.breaker.before_call()
+        self.breaker.failure()
+
+        self.assertTrue(self.breaker.is_open)
+        with self.assertRaises(EndpointUnavailable):
+            self.breaker.before_call()
+
+        # The reset timeout starts over from the failed probe
+        self.now += 31
+        self.breaker.before_call()
+
+    def test_ended_probe_frees_the_slot(self):
+        self.fail(3)
+        self.now += 31
+        probe = self.breaker.before_call()
+        self.breaker.end_probe(probe)
+
+        self.assertTrue(self.breaker.is_open)
+        self.breaker.before_call()
+
+    def test_stale_probe_token_ignored(self):
+        self.fail(3)
+        self.now += 31
+        stale = self.breaker.before_call()
+        self.breaker.failure()
+        self.now += 31
+        self.breaker.before_call()
+
+        self.breaker.end_probe(stale)
+        with self.assertRaises(EndpointUnavailable):
+            self.breaker.before_call()
+
+
+@override_settings(
+    NESE_RETRY_ATTEMPTS=3,
+    NESE_RETRY_BACKOFF=0,
+    NESE_RETRY_MAX_BACKOFF=0,
+    NESE_BREAKER_THRESHOLD=5,
+    NESE_BREAKER_RESET=30
+)
+class CallTests(SimpleTestCase):
+
+    def setUp(self):
+        resilience._breakers.clear()
+        self.addCleanup(resilience._breakers.clear)
+        patcher = mock.patch.object(resilience.time, 'sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.profile = {'endpoint': 's3.test'}
+
+    def test_retries_retryable_errors(self):
+        func = mock.Mock(side_effect=[ConnectionError(), 'ok'])
+        self.assertEqual(resilience.call(self.profile, func), 'ok')
+        self.assertEqual(func.call_count, 2)
+
+    def test_gives_up_after_attempts(self):
+        func = mock.Mock(side_effect=ConnectionError())
+        with self.assertRaises(EndpointUnavailable):
+            resilience.call(self.profile, func)
+        self.assertEqual(func.call_count, 3)
+
+    def test_other_errors_raised_at_once(self):
+        func = mock.Mock(side_effect=KeyError('nope'))
+        with self.assertRaises(KeyError):
+            resilience.call(self.profile, func)
+        self.assertEqual(func.call_count, 1)
+        self.assertFalse(resilience.get_breaker('s3.test').is_open)
+
+    def open_for_probe(self):
+        breaker = resilience.get_breaker('s3.test')
+        for i in range(5):
+            breaker.failure()
+        breaker._opened_at -= 31
+        return breaker
+
+    def test_nested_unavailable_frees_probe(self):
+        breaker = self.open_for_probe()
+        func = mock.Mock(side_effect=EndpointUnavailable('nested'))
+        with self.assertRaises(EndpointUnavailable):
+            resilience.call(self.profile, func)
+
+        func = mock.Mock(return_value='ok')
+        self.assertEqual(resilience.call(self.profile, func), 'ok')
+        self.assertFalse(breaker.is_open)
+
+    def test_interrupted_probe_frees_probe(self):
+        breaker = self.open_for_probe()
+        func = mock.Mock(side_effect=KeyboardInterrupt())
+        with self.assertRaises(KeyboardInterrupt):
+            resilience.call(self.profile, func)
+
+        self.assertTrue(breaker.is_open)
+        func = mock.Mock(return_value='ok')
+        self.assertEqual(resilience.call(self.profile, func), 'ok')
@@ -0,0 +1,22 @@
+from coldfront.core.resource.models import Resource
+
+from coldfront_plugin_nese import registry, signals
+from coldfront_plugin_nese.tests.base import NESETestCase
+
+
+class IsNeseAllocationTests(NESETestCase):
+
+    def test_allocation_on_nese_resource(self):
+        other = Resource.objects.create(
+            resource_type=self.resource_type,
+            name='Other',
+            description='Not NESE'
+        )
+        nese = self.create_allocation()
+        not_nese = self.create_allocation(resource=other)
+
+        registry.nese_resource_pks()
+        with self.assertNumQueries(1):
+            self.assertTrue(signals._is_nese_allocation(nese.pk))
+        with self.assertNumQueries(1):
+            self.assertFalse(signals._is_nese_allocation(not_nese.pk))
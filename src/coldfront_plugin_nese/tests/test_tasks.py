@@ -0,0 +1,173 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django_q.models import Schedule
+
+from coldfront.core.allocation.models import (Allocation,
+                                              AllocationAttribute,
+                                              AllocationAttributeType,
+                                              AllocationStatusChoice)
+from coldfront.core.allocation.models import \
+    AttributeType as AllocationAttributeValueType
+from coldfront.core.field_of_science.models import FieldOfScience
+from coldfront.core.project.models import Project, ProjectStatusChoice
+from coldfront.core.resource.models import \
+    AttributeType as ResourceAttributeValueType
+from coldfront.core.resource.models import Resource, ResourceType
+
+from coldfront_plugin_nese import attributes, registry, tasks
+from coldfront_plugin_nese.tests.base import NESETestCase
+
+ENDPOINTS = [
+    {
+        'name': 'nese-a',
+        'endpoint': 's3a.test',
+        'endpoint_type': 'rgw',
+        'access_key': 'a',
+        'secret_key': 'a',
+        'uid': 'a'
+    },
+    {
+        'name': 'nese-b',
+        'endpoint': 's3b.test',
+        'endpoint_type': 'rgw',
+        'access_key': 'b',
+        'secret_key': 'b',
+        'uid': 'b'
+    }
+]
+
+
+@override_settings(NESE_ENDPOINTS=ENDPOINTS)
+class GetNeseQuotaRowsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('Text', 'Int'):
+            AllocationAttributeValueType.objects.get_or_create(name=name)
+            ResourceAttributeValueType.objects.get_or_create(name=name)
+        call_command('register_nese_attributes')
+
+        pi = User.objects.create(username='pi')
+        project = Project.objects.create(
+            title='project',
+            pi=pi,
+            description='test project',
+            field_of_science=FieldOfScience.objects.create(
+                description='Other'
+            ),
+            status=ProjectStatusChoice.objects.get_or_create(
+                name='Active'
+            )[0]
+        )
+        resource = Resource.objects.create(
+            resource_type=ResourceType.objects.create(name='Storage'),
+            name='NESE',
+            description=attributes.RESOURCE_DESCRIPTION
+        )
+        status, _ = AllocationStatusChoice.objects.get_or_create(
+            name='Active'
+        )
+
+        # pk -> (bucket name, quota, endpoint), None leaves it unset
+        cls.rows = {}
+        layout = [
+            ('bucket-0', '10', None),
+            ('bucket-1', None, None),
+            ('bucket-2', '5', 'nese-b'),
+            ('bucket-3', '1', 'nese-a'),
+            (None, '2', None)
+        ]
+        types = {
+            name: AllocationAttributeType.objects.get(name=name)
+            for name in (
+                attributes.ALLOCATION_BUCKETNAME,
+                attributes.ALLOCATION_QUOTA,
+                attributes.ALLOCATION_ENDPOINT
+            )
+        }
+        attrs = []
+        for bucket_name, quota, endpoint in layout:
+            allocation = Allocation.objects.create(
+                project=project,
+                status=status,
+                quantity=1,
+                justification='test'
+            )
+            allocation.resources.add(resource)
+            values = {
+                attributes.ALLOCATION_BUCKETNAME: bucket_name,
+                attributes.ALLOCATION_QUOTA: quota,
+                attributes.ALLOCATION_ENDPOINT: endpoint
+            }
+            attrs.extend(
+                AllocationAttribute(
+                    allocation=allocation,
+                    allocation_attribute_type=types[name],
+                    value=value
+                )
+                for name, value in values.items() if value is not None
+            )
+            cls.rows[allocation.pk] = (bucket_name, quota, endpoint)
+
+        # Skips the ledger and quota signals, not what is tested here
+        AllocationAttribute.objects.bulk_create(attrs)
+
+    def setUp(self):
+        registry.invalidate()
+
+    def expected(self, endpoints=None, alloc_pks=None):
+        return sorted(
+            (pk, bucket_name, quota)
+            for pk, (bucket_name, quota, endpoint) in self.rows.items()
+            if bucket_name is not None and
+            (alloc_pks is None or pk in alloc_pks) and
+            (endpoints is None or endpoint in endpoints)
+        )
+
+    def test_all_rows_in_one_query(self):
+        with self.assertNumQueries(tasks.SWEEP_PREFETCH_QUERY_COUNT):
+            rows = list(tasks._get_nese_quota_rows())
+        self.assertEqual(sorted(rows), self.expected())
+
+    def test_selected_allocations_in_one_query(self):
+        alloc_pks = sorted(self.rows)[:3]
+        with self.assertNumQueries(tasks.SWEEP_PREFETCH_QUERY_COUNT):
+            rows = list(tasks._get_nese_quota_rows(alloc_pks))
+        self.assertEqual(sorted(rows), self.expected(alloc_pks=alloc_pks))
+
+    def test_endpoint_in_one_query(self):
+        # Allocations without an endpoint live on the first one
+        with self.assertNumQueries(tasks.SWEEP_PREFETCH_QUERY_COUNT):
+            rows = list(tasks._get_nese_quota_rows(endpoint='nese-a'))
+        self.assertEqual(sorted(rows), self.expected({None, 'nese-a'}))
+
+        with self.assertNumQueries(tasks.SWEEP_PREFETCH_QUERY_COUNT):
+            rows = list(tasks._get_nese_quota_rows(endpoint='nese-b'))
+        self.assertEqual(sorted(rows), self.expected({'nese-b'}))
+
+
+@override_settings(NESE_QUOTA_DEBOUNCE=30)
+class QuotaDebounceTests(NESETestCase):
+
+    def test_one_schedule_per_window(self):
+        allocation = self.create_allocation()
+        tasks.process_nese_quota(allocation.pk)
+        tasks.process_nese_quota(allocation.pk)
+
+        schedules = Schedule.objects.filter(
+            name=f"nese_quota_{allocation.pk}"
+        )
+        self.assertEqual(schedules.count(), 1)
+        self.assertEqual(schedules.get().schedule_type, Schedule.ONCE)
+
+    def test_new_window_after_handoff(self):
+        allocation = self.create_allocation()
+        tasks.process_nese_quota(allocation.pk)
+        # The scheduler deletes ONCE schedules it has queued
+        Schedule.objects.filter(name=f"nese_quota_{allocation.pk}").delete()
+
+        tasks.process_nese_quota(allocation.pk)
+        self.assertTrue(Schedule.objects.filter(
+            name=f"nese_quota_{allocation.pk}"
+        ).exists())
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from coldfront_plugin_nese import views
+
+app_name = 'nese'
+
+urlpatterns = [
+    path('metrics/', views.metrics_view, name='metrics'),
+]
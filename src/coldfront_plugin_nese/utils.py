@@ -3,31 +3,51 @@ from subprocess import run as runsub, CalledProcessError
 import os
 import secrets
 import string
-import boto3
 import json
 import tempfile
 import time
-from rgwadmin import RGWAdmin
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from django.conf import settings
+from django.db import connections
 from rgwadmin.exceptions import RGWAdminException
 from botocore.exceptions import ClientError
 
+from .clients import (
+    minio_admin_available,
+    minio_admins,
+    rgw_call,
+    s3_clients
+)
+from . import metrics, ratelimit, resilience
 from .exceptions import NESEProvisioningError
+from .quota import convert, to_bytes
 
 NESE_MC_ALIAS = "NESE"
 
 
 def get_client(profile):
-    client = boto3.client(
-            's3',
-            aws_access_key_id=profile['access_key'],
-            aws_secret_access_key=profile['secret_key'],
-            endpoint_url=f"{profile['scheme']}://{profile['endpoint']}"
-        )
-    return client
+    # Pooled per process, see clients.py
+    return s3_clients.get(profile)
 
 
-def apply_policy_minio(bucket_name, user_name, profile):
-    policy = {
+# Wraps func for running on a pool thread, closing the thread's DB
+# connections when it is done. Remote calls touch the database for
+# their rate limit tokens, and pool threads never go through Django's
+# request cycle that would close them.
+def in_thread(func):
+    @wraps(func)
+    def inner_func(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            connections.close_all()
+
+    return inner_func
+
+
+def bucket_policy_minio(bucket_name, user_name):
+    return {
         "Version": "2012-10-17",
         "Statement": [
             {
@@ -46,13 +66,32 @@ def apply_policy_minio(bucket_name, user_name, profile):
             }
             ]
     }
-    policy_str = json.dumps(policy)
+
+
+@metrics.timed(metrics.REMOTE_OP, op='apply_policy_minio')
+@resilience.remote_call
+@ratelimit.limited(ratelimit.BUCKET_CREATE)
+def apply_policy_minio(bucket_name, user_name, profile):
+    policy = bucket_policy_minio(bucket_name, user_name)
     policy_name = f"{bucket_name}_policy"
 
+    policy_str = json.dumps(policy)
+
     # Create the canned policy
     with tempfile.NamedTemporaryFile() as policy_file:
         policy_file.write(policy_str.encode())
         policy_file.flush()
+
+        if minio_admin_available():
+            admin = minio_admins.get(profile)
+            try:
+                # policy_file is the only form minio < 7.2.17 takes
+                admin.policy_add(policy_name, policy_file=policy_file.name)
+                admin.policy_set(policy_name, user=user_name)
+            except Exception as e:
+                raise NESEProvisioningError(e)
+            return
+
         _execute_mc(
             "admin",
             "policy",
@@ -75,9 +114,8 @@ def apply_policy_minio(bucket_name, user_name, profile):
     )
 
 
-def apply_policy_rgw(bucket_name, user_name, profile):
-
-    bucket_policy = {
+def bucket_policy_rgw(bucket_name, user_name):
+    return {
         "Version": "2012-10-17",
         "Statement": [
             {
@@ -111,6 +149,14 @@ def apply_policy_rgw(bucket_name, user_name, profile):
          ]
     }
 
+
+@metrics.timed(metrics.REMOTE_OP, op='apply_policy_rgw')
+@resilience.remote_call
+@ratelimit.limited(ratelimit.BUCKET_CREATE)
+def apply_policy_rgw(bucket_name, user_name, profile):
+
+    bucket_policy = bucket_policy_rgw(bucket_name, user_name)
+
     # Convert the policy from JSON dict to string
     bucket_policy = json.dumps(bucket_policy)
 
@@ -119,6 +165,9 @@ def apply_policy_rgw(bucket_name, user_name, profile):
     s3_client.put_bucket_policy(Bucket=bucket_name, Policy=bucket_policy)
 
 
+@metrics.timed(metrics.REMOTE_OP, op='create_bucket')
+@resilience.remote_call
+@ratelimit.limited(ratelimit.BUCKET_CREATE)
 def create_bucket(bucket_name, profile):
     """Create an S3 bucket
 
@@ -131,14 +180,16 @@ def create_bucket(bucket_name, profile):
         s3_client = get_client(profile)
         s3_client.create_bucket(Bucket=bucket_name)
     except ClientError as e:
+        # A retry after a lost response finds the bucket in place
+        if e.response['Error']['Code'] == 'BucketAlreadyOwnedByYou':
+            return True
         raise NESEProvisioningError(e)
 
     return True
 
 
-def apply_cors(bucket_name, profile):
-
-    cors_configuration = {
+def bucket_cors_configuration():
+    return {
         'CORSRules': [{
             'AllowedHeaders': [
                 '*'
@@ -167,6 +218,14 @@ def apply_cors(bucket_name, profile):
         }]
     }
 
+
+@metrics.timed(metrics.REMOTE_OP, op='apply_cors')
+@resilience.remote_call
+@ratelimit.limited(ratelimit.BUCKET_CREATE)
+def apply_cors(bucket_name, profile):
+
+    cors_configuration = bucket_cors_configuration()
+
     s3_client = get_client(profile)
 
     try:
@@ -180,29 +239,28 @@ def apply_cors(bucket_name, profile):
     return True
 
 
+@metrics.timed(metrics.REMOTE_OP, op='create_user_rgw')
+@resilience.remote_call
+@ratelimit.limited(ratelimit.USER_CREATE)
 def create_user_rgw(username, profile, display_name=None, email=None):
 
     ret_user = None
-    isSecure = profile['scheme'] == 'https'
-    rgw = RGWAdmin(
-        access_key=profile['access_key'],
-        secret_key=profile['secret_key'],
-        server=profile['endpoint'],
-        secure=isSecure
-    )
 
     try:
-        ret_user = rgw.create_user(
+        ret_user = rgw_call(profile, lambda rgw: rgw.create_user(
             uid=username,
             display_name=display_name or username,
             email=email or "unknown@unknown.org",
             max_buckets=-1,
-        )
+        ))
 
     except RGWAdminException as e:
         if e.code == "UserAlreadyExists":
             print("INFO: User already exists")
-            ret_user = rgw.get_user(uid=username)
+            ret_user = rgw_call(
+                profile,
+                lambda rgw: rgw.get_user(uid=username)
+            )
         else:
             raise NESEProvisioningError(e)
 
@@ -215,31 +273,32 @@ def create_user_rgw(username, profile, display_name=None, email=None):
     return result
 
 
+@metrics.timed(metrics.REMOTE_OP, op='set_bucket_quota_rgw')
+@resilience.remote_call
+@ratelimit.limited(ratelimit.QUOTA_SET)
 def set_bucket_quota_rgw(
         bucketname: str,
         quota: int,
         profile: dict) -> bool:
 
-    isSecure = profile['scheme'] == 'https'
-    rgw = RGWAdmin(
-        access_key=profile['access_key'],
-        secret_key=profile['secret_key'],
-        server=profile['endpoint'],
-        secure=isSecure
-    )
-
     # Quota in TB to value in KB
-    quota_kb = quota * (1024*1024*1024)
     try:
-        rgw.set_bucket_quota(
+        quota_kb = convert(quota, 'tb', 'kb')
+    except ValueError as e:
+        raise NESEProvisioningError(e)
+    try:
+        rgw_call(profile, lambda rgw: rgw.set_bucket_quota(
             uid=profile['uid'],
             bucket=bucketname,
             max_size_kb=quota_kb,
-            enabled=True)
+            enabled=True))
     except Exception as e:
         raise NESEProvisioningError(e)
 
 
+@metrics.timed(metrics.REMOTE_OP, op='create_user_minio')
+@resilience.remote_call
+@ratelimit.limited(ratelimit.USER_CREATE)
 def create_user_minio(
         username: str,
         profile: dict) -> dict:
@@ -249,16 +308,25 @@ def create_user_minio(
         secrets.choice(ALPHABET) for i in range(30)
     )
 
-    subres = _execute_mc(
-        "admin",
-        "user",
-        "add",
-        "--json",
-        NESE_MC_ALIAS,
-        username,
-        user_secret,
-        profile=profile
-    )
+    if minio_admin_available():
+        try:
+            subres = minio_admins.get(profile).user_add(
+                username,
+                user_secret
+            )
+        except Exception as e:
+            raise NESEProvisioningError(e)
+    else:
+        subres = _execute_mc(
+            "admin",
+            "user",
+            "add",
+            "--json",
+            NESE_MC_ALIAS,
+            username,
+            user_secret,
+            profile=profile
+        )
 
     result = {
         'uid': username,
@@ -270,12 +338,35 @@ def create_user_minio(
     return result
 
 
+@metrics.timed(metrics.REMOTE_OP, op='set_bucket_quota_minio')
+@resilience.remote_call
+@ratelimit.limited(ratelimit.QUOTA_SET)
 def set_bucket_quota_minio(
         bucketname: str,
         quota: int,
         profile: dict):
 
     # Note: Quota in TB
+    try:
+        quota_bytes = to_bytes(quota)
+    except ValueError as e:
+        raise NESEProvisioningError(e)
+    # Neither the SDK nor mc can set an unlimited hard quota
+    if quota_bytes is None:
+        raise NESEProvisioningError(
+            f"No quota to set on bucket {bucketname}: {quota!r}"
+        )
+
+    if minio_admin_available():
+        try:
+            minio_admins.get(profile).bucket_quota_set(
+                bucketname,
+                quota_bytes
+            )
+        except Exception as e:
+            raise NESEProvisioningError(e)
+        return
+
     # Throws if command is not successful
     _execute_mc(
         "admin",
@@ -283,17 +374,33 @@ def set_bucket_quota_minio(
         "quota",
         f"{NESE_MC_ALIAS}/{bucketname}",
         "--hard",
-        f"{quota}t",
+        f"{quota_bytes}b",
         profile=profile
     )
 
 
+@metrics.timed(metrics.REMOTE_OP, op='set_bucket_tags_minio')
+@resilience.remote_call
+@ratelimit.limited(ratelimit.QUOTA_SET)
 def set_bucket_tags_minio(
         bucketname: str,
         tags: dict,
         profile: dict):
 
     tags['timestamp'] = str(time.time())
+
+    # Bucket tagging is plain S3, so the pooled boto3 client does it
+    if minio_admin_available():
+        tagset = [{'Key': k, 'Value': str(v)} for k, v in tags.items()]
+        try:
+            get_client(profile).put_bucket_tagging(
+                Bucket=bucketname,
+                Tagging={'TagSet': tagset}
+            )
+        except ClientError as e:
+            raise NESEProvisioningError(e)
+        return
+
     tagstr = "&".join([f"{k}={v}" for k, v in tags.items()])
     _execute_mc(
         "tag",
@@ -304,54 +411,137 @@ def set_bucket_tags_minio(
     )
 
 
+@metrics.timed(metrics.REMOTE_OP, op='get_bucket_tags_minio')
+@resilience.remote_call
+@ratelimit.limited(ratelimit.READ)
 def get_bucket_tags_minio(
         bucketname: str,
         profile: dict) -> dict:
 
-    tags_json_str = _execute_mc(
+    if minio_admin_available():
+        try:
+            resp = get_client(profile).get_bucket_tagging(Bucket=bucketname)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchTagSet':
+                return {}
+            raise NESEProvisioningError(e)
+        return {t['Key']: t['Value'] for t in resp['TagSet']}
+
+    subres = _execute_mc(
         "tag",
         "list",
-        "--json"
+        "--json",
         f"{NESE_MC_ALIAS}/{bucketname}",
         profile=profile
     )
 
-    tags = json.loads(tags_json_str)
+    tags = json.loads(subres.stdout).get('tagset') or {}
 
     return tags
 
 
-def set_bucket_quota(bucket_name, quota, profile):
+# Bucket snapshots map bucket name to the bucket 'quota' (TB, None if
+# unset), its 'tags' and its 'usage_kb' (None if the endpoint does not
+# report it).
+@metrics.timed(metrics.REMOTE_OP, op='get_bucket_snapshot_rgw')
+@resilience.remote_call
+@ratelimit.limited(ratelimit.READ)
+def get_bucket_snapshot_rgw(profile, bucket_names=None):
+    # A handful of buckets is cheaper to stat one by one than
+    # listing the whole endpoint
+    if bucket_names is not None and \
+            len(bucket_names) <= settings.NESE_SNAPSHOT_WORKERS:
+
+        def fetch_stats(name):
+            try:
+                return rgw_call(
+                    profile,
+                    lambda rgw: rgw.get_bucket(bucket=name, stats=True)
+                )
+            except RGWAdminException as e:
+                if e.code == 'NoSuchBucket':
+                    return None
+                raise NESEProvisioningError(e)
+
+        with ThreadPoolExecutor(settings.NESE_SNAPSHOT_WORKERS) as pool:
+            all_stats = list(pool.map(in_thread(fetch_stats), bucket_names))
+
+        return {
+            s['bucket']: _rgw_bucket_state(s)
+            for s in all_stats if s is not None
+        }
 
-    etype = profile['endpoint_type']
-    if etype == 'rgw':
-        set_bucket_quota_rgw(bucket_name, quota, profile)
+    # One admin call returns stats for every bucket owned by the uid
+    try:
+        all_stats = rgw_call(
+            profile,
+            lambda rgw: rgw.get_bucket(uid=profile['uid'], stats=True)
+        )
+    except RGWAdminException as e:
+        raise NESEProvisioningError(e)
 
-    elif etype == 'minio':
-        tags = {
-            'quota': quota,
-            # 'rsrc': allocation.get_parent_resource.name,
-            # 'pi': allocation.project.pi,
-            # 'projname': allocation.project.title
-        }
+    return {s['bucket']: _rgw_bucket_state(s) for s in all_stats}
+
+
+def _rgw_bucket_state(stats):
+    bucket_quota = stats.get('bucket_quota') or {}
+    max_size_kb = bucket_quota.get('max_size_kb', -1)
+    quota = None
+    if bucket_quota.get('enabled'):
+        # KB back to TB, see set_bucket_quota_rgw
+        quota = convert(max_size_kb, 'kb', 'tb')
 
-        # utils.set_bucket_quota_minio(bucket_name, quota, profile)
-        set_bucket_tags_minio(bucket_name, tags, profile)
+    usage = stats.get('usage') or {}
+    usage_kb = usage.get('rgw.main', {}).get('size_kb')
+
+    return {
+        'quota': quota,
+        'tags': {},
+        'usage_kb': usage_kb
+    }
 
 
-def get_bucket_quota(bucket_name, profile):
-    etype = profile['endpoint_type']
-    if etype == 'rgw':
-        # TODO: Implement rgw bucket quota retrieval
-        raise NotImplementedError()
-        #get_bucket_quota_rgw(bucket_name, quota, profile)
+@metrics.timed(metrics.REMOTE_OP, op='get_bucket_snapshot_minio')
+def get_bucket_snapshot_minio(profile, bucket_names=None):
+    if bucket_names is None:
+        try:
+            ratelimit.acquire(profile['endpoint'], ratelimit.READ)
+            resp = resilience.call(profile, get_client(profile).list_buckets)
+        except ClientError as e:
+            raise NESEProvisioningError(e)
+        bucket_names = [b['Name'] for b in resp['Buckets']]
 
-    elif etype == 'minio':
-        # utils.get_bucket_quota_minio(bucket_name, quota, profile)
-        tags = get_bucket_tags_minio(bucket_name, profile)
-        quota = tags['quota']
+    # No bulk tag listing in S3, fan the reads out instead
+    def fetch_tags(name):
+        return name, get_bucket_tags_minio(name, profile)
 
-    return quota
+    with ThreadPoolExecutor(settings.NESE_SNAPSHOT_WORKERS) as pool:
+        all_tags = dict(pool.map(in_thread(fetch_tags), bucket_names))
+
+    usage = _get_bucket_usage_minio(profile)
+
+    return {
+        name: {
+            'quota': tags.get('quota'),
+            'tags': tags,
+            'usage_kb': usage.get(name)
+        }
+        for name, tags in all_tags.items()
+    }
+
+
+def _get_bucket_usage_minio(profile):
+    # Usage is informational only, an empty result is fine
+    if not minio_admin_available():
+        return {}
+
+    try:
+        info = json.loads(minio_admins.get(profile).get_data_usage_info())
+    except Exception:
+        return {}
+
+    buckets = info.get('bucketsUsageInfo') or {}
+    return {name: b.get('size', 0) // 1024 for name, b in buckets.items()}
 
 
 def _execute_mc(*args, profile, timeout=60, input=None):
@@ -368,15 +558,22 @@ def _execute_mc(*args, profile, timeout=60, input=None):
     # container is executing as root. beedoo
     command = ("mc", "--config-dir", "/tmp/.mc") + args
 
+    # e.g. "mc admin user add", "mc tag set"
+    subcommand = args[:3] if args[0] == "admin" else args[:2]
+
     try:
-        subres = runsub(
-            command,
-            capture_output=True,
-            check=True,
-            env=subenv,
-            timeout=timeout,
-            input=input
-        )
+        with metrics.timer(
+            metrics.REMOTE_OP,
+            op=" ".join(("mc",) + subcommand)
+        ):
+            subres = runsub(
+                command,
+                capture_output=True,
+                check=True,
+                env=subenv,
+                timeout=timeout,
+                input=input
+            )
     except CalledProcessError as e:
         msg = (
             f"MINIO CMD: {e.cmd}{os.linesep}"
@@ -384,6 +581,6 @@ def _execute_mc(*args, profile, timeout=60, input=None):
             f"STDERR: {e.stderr}{os.linesep}"
             f"RETCODE: {e.returncode}{os.linesep}"
         )
-        raise NESEProvisioningError(msg)
+        raise NESEProvisioningError(msg) from e
 
     return subres
@@ -0,0 +1,14 @@
+from django.contrib.auth.decorators import user_passes_test
+from django.http import HttpResponse
+
+from coldfront_plugin_nese import metrics
+
+# Prometheus text format content type
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# Metrics of the process serving the request, see metrics.py. Worker
+# processes only report through NESE_METRICS_SINKS.
+@user_passes_test(lambda user: user.is_superuser)
+def metrics_view(request):
+    return HttpResponse(metrics.render(), content_type=METRICS_CONTENT_TYPE)